@@ -0,0 +1,64 @@
+"""Compare the throughput of static and continuous batching.
+
+Usage:
+    python benchmarks/continuous_batching.py MODEL_NAME [--split arithmetic] [--rows 64]
+
+Generates responses for the first ToT questions with early stopping, once with static batches
+and once with continuous batching, and reports generated tokens per second. Early stopping makes
+the response lengths vary, which is the case continuous batching is meant for.
+"""
+
+import sys
+import time
+from pathlib import Path
+
+# Run from a checkout: the package is not installed.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import typer
+
+from temp_answer_qa import LastToken, Prompting, ToTSplit
+from temp_answer_qa.chat_builder import ToTChatBuilder
+from temp_answer_qa.data_loader import DataLoader
+from temp_answer_qa.models import HFModel
+from temp_answer_qa.response_processing import ToTJSONParser
+
+
+def main(
+    model_name: str,
+    split: ToTSplit = ToTSplit.arithmetic,
+    rows: int = 64,
+    batch_size: int = 16,
+    max_new_tokens: int = 512,
+):
+    dataset = DataLoader().load_tot(split=split).head(rows)
+    chat_builder = ToTChatBuilder(prompting=Prompting.zero_shot, split=split)
+    last_token = LastToken.add_generation_prompt
+    chats = [
+        chat_builder.build_chat(question, last_token, instruction)
+        for question, instruction in zip(dataset["question_wo_instruct"], dataset["instruction"])
+    ]
+    model = HFModel(model_name=model_name)
+    print(f"{'mode':<12} {'time [s]':>9} {'tokens':>8} {'tokens/s':>9}")
+    for name, continuous in (("static", False), ("continuous", True)):
+        start = time.perf_counter()
+        responses = [
+            response
+            for _, batch_responses in model.iter_generate_with_chat_template(
+                chats,
+                add_generation_prompt=True,
+                continue_final_message=False,
+                max_new_tokens=max_new_tokens,
+                batch_size=batch_size,
+                stop_when=ToTJSONParser(last_token).is_complete,
+                continuous=continuous,
+            )
+            for response in batch_responses
+        ]
+        elapsed = time.perf_counter() - start
+        tokens = sum(len(model.tokenizer.encode(r, add_special_tokens=False)) for r in responses)
+        print(f"{name:<12} {elapsed:>9.2f} {tokens:>8} {tokens / elapsed:>9.1f}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
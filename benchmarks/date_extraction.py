@@ -0,0 +1,64 @@
+"""Compare the date extraction of TTQA answers with datefinder.
+
+Usage:
+    python benchmarks/date_extraction.py [--repeats 5]
+
+Takes the final answers of the `%B %d, %Y` questions in the bundled TTQA responses, reports how
+many of them the regex fast path parses, checks that the extracted dates equal those of
+datefinder and times both.
+"""
+
+import statistics
+import sys
+import time
+from pathlib import Path
+
+# Run from a checkout: the package is not installed.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pandas as pd
+import typer
+
+from temp_answer_qa.chunked import TEXT_COLUMNS
+from temp_answer_qa.date_extraction import find_first_dates, first_date, parse_dates
+from temp_answer_qa.response_processing import TTQAResponseParser
+
+RESPONSES_DIR = Path(__file__).parent.parent / "data/responses"
+
+
+def median_time(function, repeats: int) -> float:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings)
+
+
+def main(repeats: int = 5):
+    responses = pd.concat(
+        [
+            pd.read_csv(path, dtype=TEXT_COLUMNS, usecols=["answer_format", "response"])
+            for path in sorted(RESPONSES_DIR.glob("ttqa_*.csv"))
+        ],
+        ignore_index=True,
+    )
+    final_answers = (
+        responses.loc[responses["answer_format"] == "%B %d, %Y", "response"]
+        .str.extract(TTQAResponseParser().final_answer_regex, expand=False)
+        .dropna()
+    )
+    hits = sum(date is not None for date in parse_dates(final_answers))
+    if find_first_dates(final_answers) != [first_date(answer) for answer in final_answers]:
+        raise AssertionError("The extracted dates differ from those of datefinder.")
+    datefinder_time = median_time(lambda: [first_date(a) for a in final_answers], repeats)
+    extraction_time = median_time(lambda: find_first_dates(final_answers), repeats)
+    print(f"final answers:  {len(final_answers)}")
+    print(f"fast path hits: {hits} ({hits / len(final_answers):.1%})")
+    print(f"datefinder:     {datefinder_time * 1000:.1f} ms")
+    print(f"fast path:      {extraction_time * 1000:.1f} ms")
+    print(f"speedup:        {datefinder_time / extraction_time:.1f}x")
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,90 @@
+"""Compare the vectorized error measurement with the row-wise reference.
+
+Usage:
+    python benchmarks/error_measurement.py [--repeats 3]
+
+Processes the bundled responses in `data/responses`, measures their errors with both
+implementations, checks that their outputs match row for row and reports wall-clock times.
+"""
+
+import statistics
+import sys
+import time
+from collections.abc import Callable
+from pathlib import Path
+
+# Run from a checkout: the package is not installed.
+sys.path.insert(0, str(Path(__file__).parent.parent))
+
+import pandas as pd
+import typer
+
+from temp_answer_qa import LastToken
+from temp_answer_qa.chunked import TEXT_COLUMNS
+from temp_answer_qa.measure_error import (
+    tot_measure_error,
+    tot_measure_error_rowwise,
+    ttqa_measure_error,
+    ttqa_measure_error_rowwise,
+)
+from temp_answer_qa.response_processing import tot_process_response, ttqa_process_response
+
+RESPONSES_DIR = Path(__file__).parent.parent / "data/responses"
+
+
+def load_processed_responses(pattern: str, process: Callable) -> pd.DataFrame:
+    # Processed file by file, as `evaluate` processes them.
+    return pd.concat(
+        [
+            process(pd.read_csv(path, dtype=TEXT_COLUMNS))
+            for path in sorted(RESPONSES_DIR.glob(pattern))
+        ],
+        ignore_index=True,
+    )
+
+
+def time_call(measure: Callable, responses: pd.DataFrame, repeats: int) -> tuple[float, object]:
+    timings = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        result = measure(responses)
+        timings.append(time.perf_counter() - start)
+    return statistics.median(timings), result
+
+
+def main(repeats: int = 3):
+    benchmarks = {
+        f"tot {last_token}": (
+            f"tot_*_{last_token}.csv",
+            lambda responses, last_token=last_token: tot_process_response(responses, last_token),
+            tot_measure_error_rowwise,
+            tot_measure_error,
+        )
+        for last_token in LastToken
+    } | {
+        f"ttqa {last_token}": (
+            f"ttqa_*_{last_token}.csv",
+            ttqa_process_response,
+            ttqa_measure_error_rowwise,
+            ttqa_measure_error,
+        )
+        for last_token in LastToken
+    }
+    print(
+        f"{'responses':<30} {'rows':>6} {'row-wise [s]':>12} {'vectorized [s]':>14} {'speedup':>8}"
+    )
+    for name, (pattern, process, rowwise, vectorized) in benchmarks.items():
+        if not any(RESPONSES_DIR.glob(pattern)):
+            continue
+        responses = load_processed_responses(pattern, process)
+        rowwise_time, expected = time_call(rowwise, responses, repeats)
+        vectorized_time, result = time_call(vectorized, responses, repeats)
+        pd.testing.assert_frame_equal(result, expected)
+        print(
+            f"{name:<30} {len(responses):>6} {rowwise_time:>12.2f} {vectorized_time:>14.2f} "
+            f"{rowwise_time / vectorized_time:>7.1f}x"
+        )
+
+
+if __name__ == "__main__":
+    typer.run(main)
@@ -0,0 +1,78 @@
+"""Measure the startup time of the CLI.
+
+Usage:
+    python benchmarks/startup.py [--repeats 5]
+
+Runs `main.py --help`, the `--help` of the evaluate commands and a full `evaluate-ttqa` on the
+bundled responses in fresh interpreters without `HF_TOKEN`, and reports wall-clock times. It also
+lists heavy modules that were imported by the evaluation entry points.
+"""
+
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import typer
+
+ROOT = Path(__file__).parent.parent
+HEAVY_MODULES = ["torch", "transformers", "accelerate", "dotenv"]
+
+
+def time_command(args: list[str], repeats: int, env: dict[str, str]) -> tuple[list[float], int]:
+    timings = []
+    returncode = 0
+    for _ in range(repeats):
+        start = time.perf_counter()
+        returncode = subprocess.run(
+            [sys.executable, *args], cwd=ROOT, env=env, capture_output=True, check=False
+        ).returncode
+        timings.append(time.perf_counter() - start)
+    return timings, returncode
+
+
+def heavy_imports(statement: str, env: dict[str, str]) -> list[str]:
+    check = (
+        f"import sys; {statement}; "
+        f"print(','.join(m for m in {HEAVY_MODULES!r} if m in sys.modules))"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", check], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    return [m for m in output.stdout.strip().split(",") if m]
+
+
+def main(repeats: int = 5, full_evaluation_repeats: int = 1):
+    env = {k: v for k, v in os.environ.items() if k != "HF_TOKEN"}
+    with tempfile.TemporaryDirectory() as output_folder:
+        commands = {
+            "main.py --help": (["main.py", "--help"], repeats),
+            "main.py evaluate-tot --help": (["main.py", "evaluate-tot", "--help"], repeats),
+            "main.py evaluate-ttqa --help": (["main.py", "evaluate-ttqa", "--help"], repeats),
+            "main.py evaluate-ttqa data/responses add_generation_prompt": (
+                [
+                    "main.py",
+                    "evaluate-ttqa",
+                    "data/responses",
+                    "add_generation_prompt",
+                    "--output-folder",
+                    output_folder,
+                ],
+                full_evaluation_repeats,
+            ),
+        }
+        print(f"{'command':<60} {'median [s]':>10} {'min [s]':>8}")
+        for name, (args, n) in commands.items():
+            timings, returncode = time_command(args, n, env)
+            status = "" if returncode == 0 else f"  (exit code {returncode})"
+            print(f"{name:<60} {statistics.median(timings):>10.2f} {min(timings):>8.2f}{status}")
+
+    for statement in ("import main", "import temp_answer_qa.evaluate"):
+        print(f"heavy modules after `{statement}`: {heavy_imports(statement, env) or 'none'}")
+
+
+if __name__ == "__main__":
+    typer.run(main)
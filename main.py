@@ -1,16 +1,21 @@
+from dataclasses import fields
 from pathlib import Path
 
 import typer
 
 from temp_answer_qa import (
+    Aggregation,
+    Backend,
+    Dataset,
     LastToken,
     Prompting,
     ToTSplit,
     TTQASplit,
 )
-from temp_answer_qa.evaluate import eval_tot, eval_ttqa
-from temp_answer_qa.inference import tot, ttqa
+from temp_answer_qa.response_cache import DEFAULT_MAX_SIZE_MB
 
+# Commands import their modules on demand, so that evaluation and --help start without loading
+# transformers, reading .env or probing devices.
 app = typer.Typer()
 RESPONSE_DIR = Path(__file__).parent / "data/responses/"
 EVAL_DIR = Path(__file__).parent / "data/responses_evaluated/"
@@ -24,8 +29,39 @@ def inference_tot(
     split: ToTSplit,
     test_mode: bool = False,
     output_folder: Path = RESPONSE_DIR,
+    batch_size: int = 1,
+    checkpoint: bool = False,
+    resume: bool = False,
+    prefix_cache: bool = False,
+    backend: Backend = Backend.hf,
+    api_base: str | None = None,
+    max_concurrency: int = 8,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    early_stopping: bool = False,
+    constrained_decoding: bool = False,
+    cache: bool = False,
+    cache_max_mb: int = DEFAULT_MAX_SIZE_MB,
+    prompt_store: bool = False,
+    token_budget: int | None = None,
+    continuous_batching: bool = False,
+    pipeline: bool = False,
+    stage_timing: bool = False,
+    num_samples: int = 1,
+    adaptive_max_new_tokens: bool = False,
 ):
-    tot(prompting, split, model_name, last_token, output_folder, test_mode)
+    from temp_answer_qa.inference import tot
+
+    tot(
+        prompting=prompting,
+        split=split,
+        model_name=model_name,
+        last_token=last_token,
+        output_folder=output_folder,
+        options=_generation_options(locals()),
+        num_shards=num_shards,
+        shard_index=shard_index,
+    )
 
 
 @app.command()
@@ -36,18 +72,185 @@ def inference_ttqa(
     split: TTQASplit,
     test_mode: bool = False,
     output_folder: Path = RESPONSE_DIR,
+    batch_size: int = 1,
+    checkpoint: bool = False,
+    resume: bool = False,
+    prefix_cache: bool = False,
+    backend: Backend = Backend.hf,
+    api_base: str | None = None,
+    max_concurrency: int = 8,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    early_stopping: bool = False,
+    cache: bool = False,
+    cache_max_mb: int = DEFAULT_MAX_SIZE_MB,
+    prompt_store: bool = False,
+    token_budget: int | None = None,
+    continuous_batching: bool = False,
+    pipeline: bool = False,
+    stage_timing: bool = False,
+    num_samples: int = 1,
+    adaptive_max_new_tokens: bool = False,
+):
+    from temp_answer_qa.inference import ttqa
+
+    ttqa(
+        prompting=prompting,
+        split=split,
+        model_name=model_name,
+        last_token=last_token,
+        output_folder=output_folder,
+        options=_generation_options(locals()),
+        num_shards=num_shards,
+        shard_index=shard_index,
+    )
+
+
+@app.command()
+def sweep(
+    dataset: Dataset,
+    model_name: str,
+    prompting: list[Prompting] | None = None,
+    split: list[str] | None = None,
+    last_token: list[LastToken] | None = None,
+    test_mode: bool = False,
+    output_folder: Path = RESPONSE_DIR,
+    batch_size: int = 1,
+    checkpoint: bool = False,
+    resume: bool = False,
+    prefix_cache: bool = False,
+    backend: Backend = Backend.hf,
+    api_base: str | None = None,
+    max_concurrency: int = 8,
+    early_stopping: bool = False,
+    constrained_decoding: bool = False,
+    cache: bool = False,
+    cache_max_mb: int = DEFAULT_MAX_SIZE_MB,
+    prompt_store: bool = False,
+    token_budget: int | None = None,
+    continuous_batching: bool = False,
+    pipeline: bool = False,
+    stage_timing: bool = False,
+    num_samples: int = 1,
+    adaptive_max_new_tokens: bool = False,
+):
+    """Run the grid of PROMPTING x SPLIT x LAST_TOKEN (default: all values) with one model load.
+
+    Configurations whose response CSV already exists are skipped.
+    """
+    from temp_answer_qa.inference import sweep as run_sweep
+
+    split_enum = ToTSplit if dataset == Dataset.tot else TTQASplit
+    run_sweep(
+        dataset=dataset,
+        model_name=model_name,
+        output_folder=output_folder,
+        promptings=prompting or list(Prompting),
+        splits=[split_enum(s) for s in split] if split else list(split_enum),
+        last_tokens=last_token or list(LastToken),
+        options=_generation_options(locals()),
+    )
+
+
+@app.command()
+def compile_prompts(
+    dataset: Dataset,
+    model_name: str,
+    prompting: list[Prompting] | None = None,
+    split: list[str] | None = None,
+    last_token: list[LastToken] | None = None,
 ):
-    ttqa(prompting, split, model_name, last_token, output_folder, test_mode)
+    """Tokenize the chats of the PROMPTING x SPLIT x LAST_TOKEN grid for --prompt-store."""
+    from temp_answer_qa.inference import compile_prompts as compile_prompt_store
+
+    split_enum = ToTSplit if dataset == Dataset.tot else TTQASplit
+    compile_prompt_store(
+        dataset,
+        model_name,
+        promptings=prompting or list(Prompting),
+        splits=[split_enum(s) for s in split] if split else list(split_enum),
+        last_tokens=last_token or list(LastToken),
+    )
 
 
 @app.command()
-def evaluate_tot(results_folder: Path, last_token: LastToken, output_folder: Path = EVAL_DIR):
-    eval_tot(results_folder, last_token, output_folder)
+def learn_max_new_tokens(
+    model_name: str, quantile: float = 0.99, responses_folder: Path = RESPONSE_DIR
+):
+    """Learn per-type max_new_tokens caps of MODEL_NAME for --adaptive-max-new-tokens."""
+    from temp_answer_qa.inference import learn_max_new_tokens as learn_profile
+
+    learn_profile(model_name, responses_folder, quantile)
 
 
 @app.command()
-def evaluate_ttqa(results_folder: Path, last_token: LastToken, output_folder: Path = EVAL_DIR):
-    eval_ttqa(results_folder, last_token, output_folder)
+def drop_table_texts(responses_folder: Path = RESPONSE_DIR):
+    """Remove the TTQA table texts from the response CSVs; their table_id refers to them."""
+    from temp_answer_qa.data_loader import DataLoader
+    from temp_answer_qa.question_store import drop_table_texts as drop_texts
+
+    tables = DataLoader().load_ttqa_tables()
+    paths = sorted(responses_folder.glob("ttqa_*.csv"))
+    dropped = sum(drop_texts(path, tables) for path in paths)
+    print(f"Removed the table texts from {dropped} of {len(paths)} TTQA response files.")
+
+
+@app.command()
+def merge_shards(output_path: Path):
+    """Merge the shard files of OUTPUT_PATH (the unsharded response CSV) into OUTPUT_PATH."""
+    from temp_answer_qa.shards import merge_shards as merge_response_shards
+
+    merge_response_shards(output_path)
+
+
+@app.command()
+def prune_cache(max_mb: int = DEFAULT_MAX_SIZE_MB, clear: bool = False):
+    """Evict least recently used responses until the response cache holds at most MAX_MB."""
+    from temp_answer_qa.response_cache import ResponseCache
+
+    response_cache = ResponseCache()
+    evicted = response_cache.prune(0 if clear else max_mb * 2**20)
+    print(f"Evicted {evicted} responses, {response_cache.size_bytes() / 2**20:.1f} MB left.")
+    response_cache.close()
+
+
+@app.command()
+def evaluate_tot(
+    results_folder: Path,
+    last_token: LastToken,
+    output_folder: Path = EVAL_DIR,
+    aggregation: Aggregation = Aggregation.majority,
+    chunk_size: int = 10_000,
+):
+    from temp_answer_qa.evaluate import eval_tot
+
+    eval_tot(results_folder, last_token, output_folder, aggregation, chunk_size)
+
+
+@app.command()
+def evaluate_ttqa(
+    results_folder: Path,
+    last_token: LastToken,
+    output_folder: Path = EVAL_DIR,
+    aggregation: Aggregation = Aggregation.majority,
+    chunk_size: int = 10_000,
+):
+    from temp_answer_qa.evaluate import eval_ttqa
+
+    eval_ttqa(results_folder, last_token, output_folder, aggregation, chunk_size)
+
+
+def _generation_options(arguments: dict):
+    """The `GenerationOptions` among the `arguments` of a command; others keep their default."""
+    from temp_answer_qa.inference import GenerationOptions
+
+    return GenerationOptions(
+        **{
+            field.name: arguments[field.name]
+            for field in fields(GenerationOptions)
+            if field.name in arguments
+        }
+    )
 
 
 if __name__ == "__main__":
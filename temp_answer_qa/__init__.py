@@ -4,6 +4,11 @@ from pathlib import Path
 DATA_DIR = Path(__file__).parent.parent / "data"
 
 
+class Dataset(StrEnum):
+    tot = "tot"
+    ttqa = "ttqa"
+
+
 class TTQASplit(StrEnum):
     head = "head"
     tail = "tail"
@@ -22,3 +27,13 @@ class LastToken(StrEnum):
 class Prompting(StrEnum):
     few_shot = "few-shot"
     zero_shot = "zero-shot"
+
+
+class Backend(StrEnum):
+    hf = "hf"
+    openai = "openai"
+
+
+class Aggregation(StrEnum):
+    majority = "majority"
+    median = "median"
@@ -32,6 +32,10 @@ class ToTChatBuilder:
 
         return conversation
 
+    def shared_prefix(self) -> list[dict[str, str]]:
+        """Messages that every chat of this builder starts with."""
+        return self._add_few_shot_examples([]) if self.prompting == Prompting.few_shot else []
+
     def _add_few_shot_examples(self, conversation: list[dict[str, str]]) -> list[dict[str, str]]:
         """Add few-shot examples for ToT dataset."""
         few_shot_path = DATA_DIR / f"prompts/tot_{self.split}_few_shot.json"
@@ -59,6 +63,15 @@ class TTQAChatBuilder:
         else:
             raise ValueError(f"Unknown prompting: {self.prompting}")
 
+    def shared_prefix(self) -> list[dict[str, str]]:
+        """Messages that every chat of this builder starts with."""
+        if self.prompting == Prompting.zero_shot:
+            return [{"role": "system", "content": self.system_prompt}]
+        elif self.prompting == Prompting.few_shot:
+            return self._add_few_shot_examples([])
+        else:
+            raise ValueError(f"Unknown prompting: {self.prompting}")
+
     def _add_few_shot_examples(self, conversation: list[dict[str, str]]) -> list[dict[str, str]]:
         few_shot_path = DATA_DIR / "prompts/ttqa_few_shot.json"
         return load_chat_template(few_shot_path) + conversation
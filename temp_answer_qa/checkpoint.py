@@ -0,0 +1,49 @@
+import json
+import os
+from pathlib import Path
+
+
+class ResponseCheckpoint:
+    """Append-only record of the responses of an unfinished inference run.
+
+    Every completed row is written as one JSON line next to the final output file and synced to
+    disk, so that a crashed run can be resumed without generating answered rows again.
+    """
+
+    def __init__(self, output_path: Path):
+        self.path = output_path.with_name(f"{output_path.stem}.partial.jsonl")
+
+    def exists(self) -> bool:
+        return self.path.exists()
+
+    def load(self) -> dict[int, str]:
+        """Read all completed rows and drop a trailing line that a crash left incomplete."""
+        if not self.path.exists():
+            return {}
+        responses = {}
+        valid_bytes = 0
+        with open(self.path, "rb") as f:
+            for line in f:
+                if not line.endswith(b"\n"):
+                    break
+                try:
+                    record = json.loads(line)
+                except json.JSONDecodeError:
+                    break
+                responses[record["row"]] = record["response"]
+                valid_bytes += len(line)
+        if valid_bytes < self.path.stat().st_size:
+            os.truncate(self.path, valid_bytes)
+        return responses
+
+    def append(self, rows: list[int], responses: list[str]) -> None:
+        with open(self.path, "a", encoding="utf-8") as f:
+            f.writelines(
+                json.dumps({"row": int(row), "response": response}) + "\n"
+                for row, response in zip(rows, responses)
+            )
+            f.flush()
+            os.fsync(f.fileno())
+
+    def remove(self) -> None:
+        self.path.unlink(missing_ok=True)
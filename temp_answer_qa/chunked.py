@@ -0,0 +1,130 @@
+import io
+import tempfile
+from collections import defaultdict
+from collections.abc import Iterator
+from pathlib import Path
+from typing import Self
+
+import numpy as np
+import pandas as pd
+import pyarrow as pa
+
+from temp_answer_qa.typed_values import untyped
+
+KEY_COLUMN = "_key"
+# Read as text in every chunk, as they are in a whole file; a chunk of only numeric labels would
+# otherwise be parsed differently.
+TEXT_COLUMNS = {"label": str, "response": str}
+# Chunks read every other column as text too, so that a column with gaps in some chunks is not
+# parsed as ints in one chunk and floats in the next; only sample numbers are counted.
+CHUNK_DTYPES = defaultdict(lambda: str, sample=int)
+
+
+def iter_response_chunks(path: Path, chunk_size: int, usecols=None) -> Iterator[pd.DataFrame]:
+    """Yield the rows of the response CSV `path` in chunks of about `chunk_size` rows.
+
+    The samples of a question in a `--num-samples` run stay in one chunk, so that they can be
+    aggregated chunk by chunk.
+    """
+    carry = None
+    with pd.read_csv(path, chunksize=chunk_size, usecols=usecols, dtype=CHUNK_DTYPES) as reader:
+        for chunk in reader:
+            if carry is not None:
+                chunk = pd.concat([carry, chunk])
+            if "sample" in chunk:
+                # The last question may go on in the next chunk.
+                starts = np.flatnonzero(chunk["sample"].to_numpy() == 0)
+                last = starts[-1] if len(starts) else 0
+                chunk, carry = chunk.iloc[:last], chunk.iloc[last:]
+            if len(chunk):
+                yield chunk
+    if carry is not None and len(carry):
+        yield carry
+
+
+def hash_keys(df: pd.DataFrame, columns: list[str]) -> np.ndarray:
+    """One 64-bit hash per row of the text of `columns`, independent of their dtypes."""
+    return pd.util.hash_pandas_object(df[columns].astype(str), index=False).to_numpy()
+
+
+class SpilledFrame:
+    """A DataFrame built chunk by chunk of which only `resident_columns` stay in memory.
+
+    The other columns are kept as the text that `to_csv` writes for them, in Arrow files that
+    `write_csv` memory-maps again. Typed values, as `assign_typed` stores them, are written as
+    the values that they hold. With `key_columns`, a hash of them is kept in `KEY_COLUMN`.
+    """
+
+    def __init__(
+        self, folder: Path, resident_columns: list[str], key_columns: list[str] | None = None
+    ):
+        self.resident_columns = resident_columns
+        self.key_columns = key_columns
+        # Columns in order of appearance, as `pd.concat` orders them.
+        self.columns: dict[str, None] = {}
+        self._directory = tempfile.TemporaryDirectory(prefix="spill-", dir=folder)
+        self._resident: list[pd.DataFrame] = []
+        self._parts: list[Path] = []
+
+    def __enter__(self) -> Self:
+        return self
+
+    def __exit__(self, *exc_info) -> None:
+        self._directory.cleanup()
+
+    def append(self, df: pd.DataFrame) -> None:
+        df = untyped(df)
+        self.columns.update(dict.fromkeys(df.columns))
+        resident = df.reindex(columns=self.resident_columns)
+        if self.key_columns:
+            resident[KEY_COLUMN] = hash_keys(df, self.key_columns)
+        self._resident.append(resident)
+        spilled = df.drop(columns=[column for column in self.resident_columns if column in df])
+        text = pd.read_csv(
+            io.StringIO(spilled.to_csv(index=False)), dtype=str, keep_default_na=False
+        )
+        table = pa.Table.from_pandas(text, preserve_index=False)
+        path = Path(self._directory.name) / f"part-{len(self._parts)}.arrow"
+        with pa.OSFile(str(path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+        self._parts.append(path)
+
+    def resident(self) -> pd.DataFrame:
+        """The resident columns of all rows, with a fresh range index."""
+        if not self._resident:
+            return pd.DataFrame(columns=self.resident_columns)
+        return pd.concat(self._resident, ignore_index=True)
+
+    def write_csv(
+        self,
+        path: Path,
+        columns: list[str],
+        rows: np.ndarray,
+        front: pd.DataFrame,
+        chunk_size: int,
+    ) -> None:
+        """Write `columns` of the spilled `rows` to `path`, in that order, `chunk_size` at a time.
+
+        Columns of `front`, which has one row per entry of `rows`, take the place of spilled ones.
+        Rows of -1 and columns that a chunk did not have are written empty.
+        """
+        tables = [pa.ipc.open_file(pa.memory_map(str(part))).read_all() for part in self._parts]
+        table = pa.concat_tables(tables, promote_options="default") if tables else None
+        front = front.reset_index(drop=True)
+        for start in range(0, max(len(rows), 1), chunk_size):
+            positions = rows[start : start + chunk_size]
+            found = positions >= 0
+            text = pd.DataFrame(index=range(len(positions)))
+            if table is not None and found.any():
+                text = table.take(positions[found]).to_pandas().fillna("")
+                text.index = np.flatnonzero(found)
+                text = text.reindex(range(len(positions)), fill_value="")
+            block = front.iloc[start : start + chunk_size].reset_index(drop=True)
+            output = pd.DataFrame(
+                {
+                    column: block[column] if column in block else text.get(column, "")
+                    for column in columns
+                },
+                index=range(len(positions)),
+            )
+            output.to_csv(path, mode="w" if start == 0 else "a", header=start == 0, index=False)
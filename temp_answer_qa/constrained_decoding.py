@@ -0,0 +1,209 @@
+import re
+
+import torch
+from transformers import LogitsProcessor
+
+from temp_answer_qa import LastToken
+
+DIGITS = set("0123456789")
+NUMBER_END_STATES = {"zero", "int", "frac"}
+ESCAPE_CHARS = set('"\\/bfnrt')
+HEX_DIGITS = set("0123456789abcdefABCDEF")
+# Marks a token that starts with a space in SentencePiece vocabularies.
+SPIECE_UNDERLINE = "▁"
+
+
+def answer_keys_from_instruction(instruction: str) -> tuple[str, ...] | None:
+    """Return the answer keys of the JSON template in a ToT instruction, e.g. `("H", "M", "S")`.
+
+    These are the keys that `ToTResponseToNumericObj.cast_response_to_numeric` dispatches on.
+    Instructions without a flat template, e.g. with a nested object, give None and are generated
+    unconstrained; `tot` reports how many.
+    """
+    template = re.search(r"{\s*[\"']explanation[\"']\s*:[^{}]*}", instruction)
+    if not template:
+        return None
+    keys = re.findall(r"[\"'](\w+)[\"']\s*:", template.group(0))[1:]
+    return tuple(keys) or None
+
+
+class AnswerSchema:
+    """Character automaton for `{"explanation": <string>, "<key>": <string or number>, ...}`.
+
+    States are `(segment, substate)` tuples; `None` means the text left the schema and
+    `(len(segments), 0)` that the object has been closed. At most one space is allowed between
+    JSON tokens, so that the model cannot pad its answer with whitespace.
+    """
+
+    def __init__(self, keys: tuple[str, ...], last_token: LastToken):
+        self.keys = keys
+        self.last_token = last_token
+        self.segments = [("literal", "{"), ("literal", '"explanation"'), ("literal", ":")]
+        self.segments.append(("string", None))
+        for key in keys:
+            self.segments += [("literal", ","), ("literal", f'"{key}"'), ("literal", ":")]
+            self.segments.append(("value", None))
+        self.segments.append(("literal", "}"))
+        # Every JSON token may be preceded by one space.
+        self.segments = [segment for s in self.segments for segment in (("space", None), s)]
+        self.done = (len(self.segments), 0)
+        self.initial_state = (0, 0)
+        if last_token == LastToken.continue_final_message:
+            # The assistant message already opened the object, see `ToTJSONParser`.
+            self.initial_state = self.advance(self.initial_state, '{"explanation":')
+
+    def advance(self, state: tuple[int, int | str] | None, text: str):
+        for char in text:
+            if state is None:
+                return None
+            state = self.step(state, char)
+        return state
+
+    def step(self, state: tuple[int, int | str], char: str):
+        index, sub = state
+        while index < len(self.segments):
+            kind, literal = self.segments[index]
+            if kind == "space":
+                if char == " ":
+                    return (index + 1, 0)
+                index += 1
+            elif kind == "literal":
+                if char != literal[sub]:
+                    return None
+                return (index, sub + 1) if sub + 1 < len(literal) else (index + 1, 0)
+            else:
+                sub = self._step_value(kind, sub, char)
+                if sub is None:
+                    return None
+                if sub == "end":
+                    # Numbers end with the first character that is not part of them.
+                    index, sub = index + 1, 0
+                    continue
+                return (index + 1, 0) if sub == "closed" else (index, sub)
+        return None
+
+    def _step_value(self, kind: str, sub: int | str, char: str) -> int | str | None:
+        if sub == 0:
+            if char == '"':
+                return "string"
+            if kind == "value" and char == "-":
+                return "minus"
+            if kind == "value" and char in DIGITS:
+                return "zero" if char == "0" else "int"
+            return None
+        if sub == "string":
+            if char == '"':
+                return "closed"
+            if char == "\\":
+                return "escape"
+            return None if ord(char) < 0x20 else "string"
+        if sub == "escape":
+            if char == "u":
+                return "u0"
+            return "string" if char in ESCAPE_CHARS else None
+        if isinstance(sub, str) and sub.startswith("u"):
+            if char not in HEX_DIGITS:
+                return None
+            return "string" if sub == "u3" else f"u{int(sub[1]) + 1}"
+        # JSON numbers without exponent: -?(0|[1-9][0-9]*)(.[0-9]+)?
+        if sub == "minus":
+            return ("zero" if char == "0" else "int") if char in DIGITS else None
+        if sub == "int" and char in DIGITS:
+            return "int"
+        if sub in ("zero", "int") and char == ".":
+            return "dot"
+        if sub in ("dot", "frac") and char in DIGITS:
+            return "frac"
+        return "end" if sub in NUMBER_END_STATES else None
+
+
+class TokenTrie:
+    """Trie over the text that every regular token of a tokenizer adds to a response."""
+
+    def __init__(self, tokenizer):
+        special_ids = set(tokenizer.all_special_ids)
+        token_ids = [i for i in range(len(tokenizer)) if i not in special_ids]
+        texts = [
+            _token_text(tokenizer, token) for token in tokenizer.convert_ids_to_tokens(token_ids)
+        ]
+        self.root = {}
+        for token_id, text in zip(token_ids, texts):
+            if not text:
+                continue
+            node = self.root
+            for char in text:
+                node = node.setdefault(char, {})
+            node.setdefault(None, []).append(token_id)
+        self.texts = dict(zip(token_ids, texts))
+
+    def allowed_tokens(self, schema: AnswerSchema, state) -> list[int]:
+        """Token ids whose text keeps `schema` valid when appended in `state`."""
+        allowed = []
+        stack = [(self.root, state)]
+        while stack:
+            node, node_state = stack.pop()
+            for char, child in node.items():
+                if char is None:
+                    allowed.extend(child)
+                    continue
+                child_state = schema.step(node_state, char)
+                if child_state is not None:
+                    stack.append((child, child_state))
+        return allowed
+
+
+def _token_text(tokenizer, token: str) -> str:
+    # Decoding a token on its own drops the space of a leading "▁", which it keeps mid-response.
+    text = tokenizer.convert_tokens_to_string([token])
+    if (token.startswith(SPIECE_UNDERLINE) or token == "<0x20>") and not text.startswith(" "):
+        text = " " + text
+    return text
+
+
+class AnswerSchemaLogitsProcessor(LogitsProcessor):
+    """Mask every token that would leave the answer schema of its row.
+
+    Rows without a schema are not constrained. Once a row has closed its JSON object only the end
+    of sequence token remains. Masks are cached in `mask_cache` per schema and automaton state,
+    so that they are computed once per run rather than once per step.
+    """
+
+    def __init__(
+        self,
+        token_trie: TokenTrie,
+        schemas: list[AnswerSchema | None],
+        prompt_length: int,
+        eos_token_ids: list[int],
+        mask_cache: dict,
+    ):
+        self.token_trie = token_trie
+        self.schemas = schemas
+        self.states = [schema.initial_state if schema else None for schema in schemas]
+        self.processed_length = prompt_length
+        self.eos_token_ids = eos_token_ids
+        self.mask_cache = mask_cache
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor):
+        new_tokens = input_ids[:, self.processed_length :].tolist()
+        self.processed_length = input_ids.shape[1]
+        for row, schema in enumerate(self.schemas):
+            if schema is None:
+                continue
+            text = "".join(self.token_trie.texts.get(token_id, "") for token_id in new_tokens[row])
+            self.states[row] = schema.advance(self.states[row], text)
+            scores[row] = scores[row].masked_fill(
+                ~self._mask(schema, self.states[row], scores), -float("inf")
+            )
+        return scores
+
+    def _mask(self, schema: AnswerSchema, state, scores: torch.FloatTensor) -> torch.Tensor:
+        key = (schema.keys, schema.last_token, state)
+        if key not in self.mask_cache:
+            if state is None or state == schema.done:
+                allowed = self.eos_token_ids
+            else:
+                allowed = self.token_trie.allowed_tokens(schema, state)
+            mask = torch.zeros(scores.shape[-1], dtype=torch.bool)
+            mask[allowed] = True
+            self.mask_cache[key] = mask
+        return self.mask_cache[key].to(scores.device)
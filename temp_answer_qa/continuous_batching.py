@@ -0,0 +1,330 @@
+from collections import deque
+from collections.abc import Callable, Iterator, Sequence
+
+import torch
+import torch.nn.functional as F
+import transformers
+from packaging.specifiers import SpecifierSet
+from transformers import (
+    LogitsProcessorList,
+    MinPLogitsWarper,
+    NoRepeatNGramLogitsProcessor,
+    RepetitionPenaltyLogitsProcessor,
+    TemperatureLogitsWarper,
+    TopKLogitsWarper,
+    TopPLogitsWarper,
+    TypicalLogitsWarper,
+)
+
+from temp_answer_qa.constrained_decoding import AnswerSchema
+
+# Versions whose `DynamicCache` keeps the key/value tensors of each layer in `layers`, which the
+# batcher merges and trims in place.
+TRANSFORMERS_VERSIONS = ">=4.56,<6"
+# Generation config settings that the batcher applies with the same processors as `generate`,
+# and settings that do not change the logits.
+_APPLIED_SETTINGS = {
+    "repetition_penalty",
+    "no_repeat_ngram_size",
+    "do_sample",
+    "temperature",
+    "top_k",
+    "top_p",
+    "min_p",
+    "typical_p",
+}
+_NEUTRAL_SETTINGS = {
+    "bos_token_id",
+    "eos_token_id",
+    "pad_token_id",
+    "max_length",
+    "max_new_tokens",
+    "use_cache",
+    "output_attentions",
+    "output_hidden_states",
+    "output_scores",
+    "output_logits",
+    "return_dict_in_generate",
+    "transformers_version",
+    "_from_model_config",
+}
+
+
+class ContinuousBatcher:
+    """Decode loop that refills the slots of finished sequences with new prompts.
+
+    Static batching keeps a batch on the device until its longest response is done. Here every
+    sequence leaves the batch as soon as it ends, and waiting prompts are prefilled and merged
+    into the running key/value cache at the next step. Rows of the cache are left-padded to a
+    common length, and the attention mask and position ids hide the padding. Every row gets the
+    logits processors that `generate` builds from the model's generation config, e.g. for a
+    `repetition_penalty`, so that it decodes as it would on its own; `unsupported_reason` tells
+    which models and configs the batcher cannot decode like `generate`.
+    """
+
+    def __init__(
+        self,
+        hf_model,
+        max_new_tokens: int | list[int],
+        batch_size: int,
+        stop_when: Callable[[str], bool] | None = None,
+        answer_schemas: list[AnswerSchema | None] | None = None,
+        token_budget: int | None = None,
+    ):
+        reason = unsupported_reason(hf_model.model)
+        if reason:
+            raise ValueError(f"Continuous batching {reason}.")
+        self.hf_model = hf_model
+        self.max_new_tokens = max_new_tokens
+        self.batch_size = batch_size
+        self.stop_when = stop_when
+        self.answer_schemas = answer_schemas
+        self.token_budget = token_budget
+        self.eos_token_ids = set(hf_model.eos_token_ids())
+        generation_config = hf_model.model.generation_config
+        self.do_sample = bool(generation_config.do_sample)
+        self.config_processors = _config_processors(generation_config)
+        self.sampling_warpers = _sampling_warpers(generation_config)
+        # State of the running batch, one entry per row.
+        self.rows: list[int] = []
+        self.prompts: list[list[int]] = []
+        self.generated: list[list[int]] = []
+        self.processors: list[LogitsProcessorList] = []
+        self.past_key_values = None
+        self.attention_mask: torch.Tensor | None = None
+        self.next_tokens: torch.Tensor | None = None
+
+    def run(self, prompts: Sequence[list[int]]) -> Iterator[tuple[list[int], list[str]]]:
+        """Yield `(indices, responses)` for the rows that finished at each step."""
+        lengths = [len(prompts[i]) for i in range(len(prompts))]
+        # Shortest prompts first, so that the rows of the cache need little padding.
+        queue = deque(sorted(range(len(prompts)), key=lengths.__getitem__))
+        while queue or self.rows:
+            admitted = self._admit(queue, lengths)
+            if admitted:
+                with torch.no_grad():
+                    finished = self._prefill(prompts, admitted)
+                if finished:
+                    yield finished
+            if self.rows:
+                with torch.no_grad():
+                    finished = self._decode()
+                if finished:
+                    yield finished
+
+    def _admit(self, queue: deque, lengths: list[int]) -> list[int]:
+        admitted = []
+        while queue:
+            rows = len(self.rows) + len(admitted)
+            if self.token_budget is None:
+                if rows >= self.batch_size:
+                    break
+            # The queue is sorted, so the next prompt is the longest one, as in `plan_batches`.
+            elif rows and (rows + 1) * (lengths[queue[0]] + self._max_new_tokens(queue[0])) > (
+                self.token_budget
+            ):
+                break
+            admitted.append(queue.popleft())
+        return admitted
+
+    def _prefill(self, prompts: Sequence[list[int]], admitted: list[int]):
+        batch, past_key_values, prefix_length = self.hf_model.prepare_batch(
+            [prompts[i] for i in admitted]
+        )
+        batch = batch.to(self.hf_model.device)
+        attention_mask = batch["attention_mask"]
+        position_ids = attention_mask.long().cumsum(-1) - 1
+        position_ids.masked_fill_(attention_mask == 0, 1)
+        outputs = self.hf_model.model(
+            input_ids=batch["input_ids"][:, prefix_length:],
+            attention_mask=attention_mask,
+            position_ids=position_ids[:, prefix_length:],
+            past_key_values=past_key_values,
+            use_cache=True,
+            logits_to_keep=1,
+        )
+        self._merge(outputs.past_key_values, attention_mask)
+        self.rows += admitted
+        self.prompts += [prompts[i] for i in admitted]
+        self.generated += [[] for _ in admitted]
+        self.processors += [
+            self._logits_processor(
+                prompts[i], self.answer_schemas[i] if self.answer_schemas else None
+            )
+            for i in admitted
+        ]
+        start = len(self.rows) - len(admitted)
+        new_tokens = self._sample(outputs.logits[:, -1, :], range(start, len(self.rows)))
+        self.next_tokens = (
+            torch.cat([self.next_tokens[:start], new_tokens]) if start else new_tokens
+        )
+        return self._drop_finished()
+
+    def _decode(self):
+        self.attention_mask = F.pad(self.attention_mask, (0, 1), value=1)
+        position_ids = self.attention_mask.sum(-1, keepdim=True) - 1
+        outputs = self.hf_model.model(
+            input_ids=self.next_tokens[:, None],
+            attention_mask=self.attention_mask,
+            position_ids=position_ids,
+            past_key_values=self.past_key_values,
+            use_cache=True,
+        )
+        self.next_tokens = self._sample(outputs.logits[:, -1, :], range(len(self.rows)))
+        return self._drop_finished()
+
+    def _logits_processor(
+        self, prompt: list[int], answer_schema: AnswerSchema | None
+    ) -> LogitsProcessorList:
+        """The processors and sampling warpers that `generate` applies to `prompt`, in its order."""
+        schema_processor = self.hf_model._logits_processor(len(prompt), [answer_schema]) or []
+        return LogitsProcessorList(
+            [*self.config_processors, *schema_processor, *self.sampling_warpers]
+        )
+
+    def _sample(self, logits: torch.Tensor, rows: range) -> torch.Tensor:
+        scores = logits.float()
+        for i, row in enumerate(rows):
+            if self.processors[row]:
+                # Processors see the prompt and the tokens so far, as in `generate`.
+                input_ids = torch.tensor(
+                    [self.prompts[row] + self.generated[row]], device=scores.device
+                )
+                scores[i : i + 1] = self.processors[row](input_ids, scores[i : i + 1])
+        if self.do_sample:
+            tokens = torch.multinomial(torch.softmax(scores, dim=-1), num_samples=1)[:, 0]
+        else:
+            tokens = scores.argmax(dim=-1)
+        for row, token in zip(rows, tokens.tolist()):
+            self.generated[row].append(token)
+        return tokens
+
+    def _drop_finished(self) -> tuple[list[int], list[str]] | None:
+        decode = self.hf_model.tokenizer.decode
+        finished = [
+            row
+            for row, tokens in enumerate(self.generated)
+            if tokens[-1] in self.eos_token_ids
+            or len(tokens) >= self._max_new_tokens(self.rows[row])
+            or (
+                self.stop_when is not None
+                and may_complete(self.stop_when, decode(tokens[-1:], skip_special_tokens=True))
+                and self.stop_when(decode(tokens, skip_special_tokens=True))
+            )
+        ]
+        if not finished:
+            return None
+        result = (
+            [self.rows[row] for row in finished],
+            [decode(self.generated[row], skip_special_tokens=True) for row in finished],
+        )
+        keep = sorted(set(range(len(self.rows))) - set(finished))
+        self.rows = [self.rows[row] for row in keep]
+        self.prompts = [self.prompts[row] for row in keep]
+        self.generated = [self.generated[row] for row in keep]
+        self.processors = [self.processors[row] for row in keep]
+        if not keep:
+            self.past_key_values = self.attention_mask = self.next_tokens = None
+            return result
+        keep_index = torch.tensor(keep, device=self.attention_mask.device)
+        self.next_tokens = self.next_tokens[keep_index]
+        self.attention_mask = self.attention_mask[keep_index]
+        # Columns that are padding in every remaining row are cut off.
+        start = int(self.attention_mask.any(dim=0).long().argmax())
+        self.attention_mask = self.attention_mask[:, start:]
+        for layer in self.past_key_values.layers:
+            layer.keys = layer.keys[keep_index, :, start:]
+            layer.values = layer.values[keep_index, :, start:]
+        return result
+
+    def _max_new_tokens(self, index: int) -> int:
+        if isinstance(self.max_new_tokens, int):
+            return self.max_new_tokens
+        return self.max_new_tokens[index]
+
+    def _merge(self, past_key_values, attention_mask: torch.Tensor) -> None:
+        """Append the rows of a prefilled cache to the running batch, left-padding the shorter."""
+        if self.past_key_values is None:
+            self.past_key_values, self.attention_mask = past_key_values, attention_mask
+            return
+        length = max(self.attention_mask.shape[1], attention_mask.shape[1])
+        for layer, new_layer in zip(self.past_key_values.layers, past_key_values.layers):
+            layer.keys = torch.cat(
+                [_pad_left(layer.keys, length), _pad_left(new_layer.keys, length)]
+            )
+            layer.values = torch.cat(
+                [_pad_left(layer.values, length), _pad_left(new_layer.values, length)]
+            )
+        self.attention_mask = torch.cat(
+            [
+                F.pad(self.attention_mask, (length - self.attention_mask.shape[1], 0)),
+                F.pad(attention_mask, (length - attention_mask.shape[1], 0)),
+            ]
+        )
+
+
+def _pad_left(states: torch.Tensor, length: int) -> torch.Tensor:
+    # Key/value states are [batch, heads, sequence, head_dim].
+    return F.pad(states, (0, 0, length - states.shape[2], 0))
+
+
+def unsupported_reason(model) -> str | None:
+    """Why `ContinuousBatcher` cannot decode like `generate` with `model`, or None if it can."""
+    if not SpecifierSet(TRANSFORMERS_VERSIONS).contains(transformers.__version__, prereleases=True):
+        return f"needs transformers{TRANSFORMERS_VERSIONS}, found {transformers.__version__}"
+    if not _full_attention_only(model.config.get_text_config()):
+        return "does not support sliding window or chunked attention"
+    settings = set(model.generation_config.to_diff_dict())
+    unsupported = sorted(settings - _APPLIED_SETTINGS - _NEUTRAL_SETTINGS)
+    if unsupported:
+        return f"does not apply the generation config's {', '.join(unsupported)}"
+    return None
+
+
+def _full_attention_only(config) -> bool:
+    # Layers of other types get caches that are not plain [batch, heads, sequence, head_dim].
+    layer_types = getattr(config, "layer_types", None)
+    if layer_types is not None:
+        return all(layer_type == "full_attention" for layer_type in layer_types)
+    return (
+        getattr(config, "sliding_window", None) is None
+        and getattr(config, "attention_chunk_size", None) is None
+    )
+
+
+def _config_processors(generation_config) -> list:
+    """The processors of `_APPLIED_SETTINGS` that `generate` applies before custom ones."""
+    processors = []
+    if generation_config.repetition_penalty not in (None, 1.0):
+        processors.append(RepetitionPenaltyLogitsProcessor(generation_config.repetition_penalty))
+    if generation_config.no_repeat_ngram_size:
+        processors.append(NoRepeatNGramLogitsProcessor(generation_config.no_repeat_ngram_size))
+    return processors
+
+
+def _sampling_warpers(generation_config) -> list:
+    """The warpers that `generate` applies after the other processors when sampling."""
+    if not generation_config.do_sample:
+        return []
+    warpers = []
+    if generation_config.temperature is not None and generation_config.temperature != 1.0:
+        warpers.append(TemperatureLogitsWarper(generation_config.temperature))
+    if generation_config.top_k:
+        warpers.append(TopKLogitsWarper(generation_config.top_k))
+    if generation_config.top_p is not None and generation_config.top_p < 1.0:
+        warpers.append(TopPLogitsWarper(generation_config.top_p))
+    if generation_config.min_p is not None:
+        warpers.append(MinPLogitsWarper(generation_config.min_p))
+    if generation_config.typical_p is not None and generation_config.typical_p < 1.0:
+        warpers.append(TypicalLogitsWarper(generation_config.typical_p))
+    return warpers
+
+
+def may_complete(stop_when: Callable[[str], bool], token_text: str) -> bool:
+    """Whether a response can start to satisfy `stop_when` with a token decoded to `token_text`.
+
+    Predicates marked with `completes_on`, like the parsers' `is_complete`, are only worth a
+    check after tokens that contain one of its characters; others after every token.
+    """
+    chars = getattr(stop_when, "completes_on", None)
+    return chars is None or any(char in token_text for char in chars)
@@ -1,17 +1,28 @@
 import pandas as pd
 
-from temp_answer_qa import DATA_DIR, ToTSplit, TTQASplit
+from temp_answer_qa import Dataset, ToTSplit, TTQASplit
+from temp_answer_qa.question_store import load_questions, load_tables
 
 
 class DataLoader:
-    def load_ttqa(self, split: TTQASplit | None = None, test_mode: bool = False) -> pd.DataFrame:
-        df = pd.read_csv(DATA_DIR / "questions/ttqa.csv")
-        if split:
-            df = df.loc[df.loc[:, "split"] == split]
+    def load_ttqa(
+        self,
+        split: TTQASplit | None = None,
+        test_mode: bool = False,
+        columns: list[str] | None = None,
+    ) -> pd.DataFrame:
+        df = load_questions(Dataset.ttqa, split, columns)
         return df.sample(50, random_state=146) if test_mode else df
 
-    def load_tot(self, split: ToTSplit | None = None, test_mode: bool = False) -> pd.DataFrame:
-        df = pd.read_csv(DATA_DIR / "questions/tot.csv")
-        if split:
-            df = df.loc[df.loc[:, "split"] == split]
+    def load_ttqa_tables(self) -> pd.Series:
+        """The table texts of TTQA indexed by `table_id`, which the questions refer to."""
+        return load_tables(Dataset.ttqa)
+
+    def load_tot(
+        self,
+        split: ToTSplit | None = None,
+        test_mode: bool = False,
+        columns: list[str] | None = None,
+    ) -> pd.DataFrame:
+        df = load_questions(Dataset.tot, split, columns)
         return df.sample(50, random_state=146) if test_mode else df
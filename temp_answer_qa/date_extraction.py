@@ -0,0 +1,91 @@
+import re
+from datetime import datetime
+
+import datefinder
+import numpy as np
+import pandas as pd
+
+MONTH_NAMES = [
+    "january",
+    "february",
+    "march",
+    "april",
+    "may",
+    "june",
+    "july",
+    "august",
+    "september",
+    "october",
+    "november",
+    "december",
+]
+MONTHS = {name.capitalize(): number for number, name in enumerate(MONTH_NAMES, start=1)}
+ABBREVIATED_MONTHS = {name[:3]: number for name, number in MONTHS.items()}
+# Answers that are nothing but a date, in the layouts that models write: "February 17, 1837",
+# "Feb. 17 1837", "17th of February 1837" and "1837-02-17", optionally followed by a full stop.
+# Only capitalized month names and four-digit years from 1000 on are matched; datefinder reads
+# other spellings in ways that differ between its versions, so they are left to it.
+DATE_REGEX = re.compile(
+    r"^\s*(?:"
+    r"(?P<month_1>[A-Z][a-z]+)\.? (?P<day_1>[0-9]{1,2})(?:st|nd|rd|th)?,? (?P<year_1>[1-9][0-9]{3})"
+    r"|(?P<day_2>[0-9]{1,2})(?:st|nd|rd|th)? (?:of )?(?P<month_2>[A-Z][a-z]+),? "
+    r"(?P<year_2>[1-9][0-9]{3})"
+    r"|(?P<year_3>[1-9][0-9]{3})-(?P<month_3>[0-9]{2})-(?P<day_3>[0-9]{2})"
+    r")\.?\s*\Z"
+)
+
+
+def find_first_dates(texts: pd.Series) -> list[datetime | None]:
+    """The first date that datefinder finds in each of `texts`, None if there is none.
+
+    Texts that are just a date are parsed by `parse_dates`; datefinder only searches the rest,
+    every distinct text once.
+    """
+    dates = parse_dates(texts)
+    missed = {
+        text: first_date(text)
+        for text, date in zip(texts, dates)
+        if date is None and isinstance(text, str)
+    }
+    return [
+        missed[text] if date is None and isinstance(text, str) else date
+        for text, date in zip(texts, dates)
+    ]
+
+
+def parse_dates(texts: pd.Series) -> list[datetime | None]:
+    """The date of every text that `DATE_REGEX` matches and that is a valid date, else None."""
+    parts = texts.str.extract(DATE_REGEX)
+    # Only the groups of the matching alternative are set, the others are -1.
+    years = np.max([_numbers(parts[f"year_{i}"]) for i in (1, 2, 3)], axis=0)
+    days = np.max([_numbers(parts[f"day_{i}"]) for i in (1, 2, 3)], axis=0)
+    months = np.max(
+        [
+            _numbers(parts["month_1"].map(MONTHS | ABBREVIATED_MONTHS)),
+            _numbers(parts["month_2"].map(MONTHS)),
+            _numbers(parts["month_3"]),
+        ],
+        axis=0,
+    )
+    valid = (years >= 1) & (months >= 1) & (months <= 12) & (days >= 1)
+    month_starts = (years[valid] - 1970).astype("datetime64[Y]").astype("datetime64[M]") + (
+        months[valid] - 1
+    ).astype("timedelta64[M]")
+    dates = month_starts.astype("datetime64[D]") + (days[valid] - 1).astype("timedelta64[D]")
+    # Days beyond the end of their month spill over into the next one.
+    in_month = dates.astype("datetime64[M]") == month_starts
+    valid[valid] = in_month
+    parsed = iter(dates[in_month].astype("datetime64[us]").astype(object))
+    return [next(parsed) if ok else None for ok in valid]
+
+
+def first_date(text: str) -> datetime | None:
+    try:
+        return next(datefinder.find_dates(text))
+    except StopIteration:
+        return None
+
+
+def _numbers(values: pd.Series) -> np.ndarray:
+    # Rows without a number are -1, which no date part is.
+    return pd.to_numeric(values).fillna(-1).to_numpy(dtype=np.int64)
@@ -1,89 +1,178 @@
 from glob import glob
 from pathlib import Path
 
+import numpy as np
 import pandas as pd
 from tqdm import tqdm
 
-from temp_answer_qa import LastToken
+from temp_answer_qa import Aggregation, Dataset, LastToken
+from temp_answer_qa.chunked import KEY_COLUMN, SpilledFrame, hash_keys, iter_response_chunks
+from temp_answer_qa.label_registry import load_labels
 from temp_answer_qa.measure_error import tot_measure_error, ttqa_measure_error
 from temp_answer_qa.metrics import calculate_metrics
 from temp_answer_qa.response_processing import tot_process_response, ttqa_process_response
+from temp_answer_qa.self_consistency import aggregate_samples
 
+# Rows per chunk that is parsed and measured at a time.
+EVAL_CHUNK_SIZE = 10_000
+# The columns `calculate_metrics` reads; only these stay in memory while the rest is spilled.
+METRIC_INPUT_COLUMNS = [
+    "split",
+    "answer_temporal_unit",
+    "error_numeric",
+    "response_digit",
+    "label_digit",
+]
+# The numeric answers and errors that the metrics are computed from.
+DIGIT_COLUMNS = ["error_numeric", "response_digit", "label_digit"]
+REF_INDEX_PATH = Path(__file__).parent.parent / "data/responses_evaluated/ref_index.pickle"
+REF_INDEX_COLUMNS = [
+    "question",
+    "label",
+    "question_type",
+    "question_wo_instruct",
+    "instruction",
+    "answer_format",
+    "answer_temporal_unit",
+    "split",
+    "prompting",
+    "model",
+]
 
-def eval_tot(results_folder: Path, last_token: LastToken, output_folder: Path):
+
+def eval_tot(
+    results_folder: Path,
+    last_token: LastToken,
+    output_folder: Path,
+    aggregation: Aggregation = Aggregation.majority,
+    chunk_size: int = EVAL_CHUNK_SIZE,
+):
     files = glob(str(results_folder / f"tot*_{last_token.value}.csv"))
     if len(files) == 0:
         raise FileNotFoundError(f"No files found in {results_folder} for {last_token.value}")
-    response_dfs = []
-    for file in tqdm(files, desc="Evaluating ToT model responses"):
-        file_name_split = Path(file).name.split("_")
-        model = file_name_split[2]
-        prompting = file_name_split[3]
-        df = (
-            pd.read_csv(file)
-            .assign(model=model, prompting=prompting)
-            .pipe(tot_process_response, last_token)
-            .pipe(tot_measure_error)
+    # Every file answers the same questions, so their labels are parsed once for all of them.
+    labels = load_labels(Dataset.tot)
+    with SpilledFrame(output_folder, METRIC_INPUT_COLUMNS, REF_INDEX_COLUMNS) as responses:
+        for file in tqdm(files, desc="Evaluating ToT model responses"):
+            file_name_split = Path(file).name.split("_")
+            model = file_name_split[2]
+            prompting = file_name_split[3]
+            for chunk in iter_response_chunks(Path(file), chunk_size):
+                responses.append(
+                    chunk.assign(model=model, prompting=prompting)
+                    .pipe(tot_process_response, last_token, labels, infer_dtypes=False, typed=True)
+                    .pipe(tot_measure_error, infer_dtypes=False)
+                    .pipe(_aggregate_samples, aggregation)
+                    .pipe(_digits_as_floats)
+                )
+        rows, metrics = _reindex_response_df(responses.resident())
+        metrics = metrics.groupby("split", group_keys=False).apply(calculate_metrics)
+        # sMAPE not defined for dates
+        metrics.loc[
+            metrics.loc[:, "answer_temporal_unit"] == "date",
+            "symmetric_absolute_percentage_error",
+        ] = None
+        responses.write_csv(
+            output_folder / f"tot_{last_token.value}_evaluated.csv",
+            _output_columns(REF_INDEX_COLUMNS + list(responses.columns), metrics),
+            rows,
+            metrics,
+            chunk_size,
         )
-        response_dfs.append(df)
-    response_df = pd.concat(response_dfs)
-    response_df = _reindex_response_df(response_df)
-    response_df = response_df.groupby("split", group_keys=False).apply(calculate_metrics)
-    # sMAPE not defined for dates
-    response_df.loc[
-        response_df.loc[:, "answer_temporal_unit"] == "date",
-        "symmetric_absolute_percentage_error",
-    ] = None
-    response_df.to_csv(output_folder / f"tot_{last_token.value}_evaluated.csv", index=False)
-
-
-def _reindex_response_df(response_df: pd.DataFrame):
-    cols = [
-        "question",
-        "label",
-        "question_type",
-        "question_wo_instruct",
-        "instruction",
-        "answer_format",
-        "answer_temporal_unit",
-        "split",
-        "prompting",
-        "model",
-    ]
-    ref_index = (
-        pd.read_pickle(Path(__file__).parent.parent / "data/responses_evaluated/ref_index.pickle").set_index(cols).index
+
+
+def _aggregate_samples(response_df: pd.DataFrame, aggregation: Aggregation) -> pd.DataFrame:
+    # Responses of --num-samples runs come with one row per sample, measured like any other.
+    if "sample" not in response_df.columns:
+        return response_df
+    return aggregate_samples(response_df, aggregation=aggregation)
+
+
+def _digits_as_floats(response_df: pd.DataFrame) -> pd.DataFrame:
+    """The numbers of the digit columns as floats, which columns of whole files infer them as.
+
+    Chunks are processed without inferring dtypes, so that their text does not depend on the
+    chunk size; digits that are not numbers are kept as they are.
+    """
+    return response_df.assign(
+        **{
+            column: response_df[column]
+            .map(lambda digit: float(digit) if _is_number(digit) else digit)
+            .infer_objects()
+            for column in DIGIT_COLUMNS
+        }
+    )
+
+
+def _is_number(value) -> bool:
+    return isinstance(value, (int, float)) and not isinstance(value, bool)
+
+
+def _reindex_response_df(resident: pd.DataFrame) -> tuple[np.ndarray, pd.DataFrame]:
+    """Order the responses like the reference index, with empty rows for missing responses.
+
+    Returns the response row of every reference row (-1 if missing) and the metric inputs in
+    that order, with the index columns taken from the reference.
+    """
+    reference = pd.read_pickle(REF_INDEX_PATH)[REF_INDEX_COLUMNS].reset_index(drop=True)
+    keys = pd.Index(resident[KEY_COLUMN])
+    if keys.has_duplicates:
+        raise ValueError("cannot reindex on an axis with duplicate labels")
+    rows = keys.get_indexer(hash_keys(reference, REF_INDEX_COLUMNS))
+    metric_inputs = (
+        resident.drop(columns=[KEY_COLUMN, *REF_INDEX_COLUMNS], errors="ignore")
+        .reindex(rows)
+        .reset_index(drop=True)
     )
-    tmp = response_df.set_index(cols)
-    response_df_sorted = tmp.reindex(ref_index)
-    response_df_sorted = response_df_sorted.reset_index()
-    return response_df_sorted
+    return rows, pd.concat([reference, metric_inputs], axis=1)
+
+
+def _output_columns(columns: list[str], metrics: pd.DataFrame) -> list[str]:
+    # The metrics are added after the response columns, as `calculate_metrics` assigns them.
+    return list(dict.fromkeys(columns + list(metrics.columns)))
 
 
-def eval_ttqa(results_folder: Path, last_token: LastToken, output_folder: Path):
+def eval_ttqa(
+    results_folder: Path,
+    last_token: LastToken,
+    output_folder: Path,
+    aggregation: Aggregation = Aggregation.majority,
+    chunk_size: int = EVAL_CHUNK_SIZE,
+):
     files = glob(str(results_folder / f"ttqa*_{last_token.value}.csv"))
     if len(files) == 0:
         raise FileNotFoundError(f"No files found in {results_folder} for {last_token.value}")
-    response_dfs = []
-    for file in tqdm(files, desc="Evaluating TTQA model responses"):
-        file_name_split = Path(file).name.split("_")
-        model = file_name_split[2]
-        prompting = file_name_split[3]
-        df = (
-            pd.read_csv(file)
-            .assign(model=model, prompting=prompting)
-            .pipe(ttqa_process_response)
-            .pipe(ttqa_measure_error)
+    labels = load_labels(Dataset.ttqa)
+    with SpilledFrame(output_folder, METRIC_INPUT_COLUMNS) as responses:
+        for file in tqdm(files, desc="Evaluating TTQA model responses"):
+            file_name_split = Path(file).name.split("_")
+            model = file_name_split[2]
+            prompting = file_name_split[3]
+            # The tables are only needed to prompt the model.
+            for chunk in iter_response_chunks(
+                Path(file), chunk_size, usecols=lambda column: column != "table_context"
+            ):
+                responses.append(
+                    chunk.assign(model=model, prompting=prompting)
+                    .pipe(ttqa_process_response, labels, infer_dtypes=False, typed=True)
+                    .pipe(ttqa_measure_error, infer_dtypes=False)
+                    .pipe(_aggregate_samples, aggregation)
+                    .pipe(_digits_as_floats)
+                )
+        metrics = responses.resident().pipe(calculate_metrics)
+        # sMAPE not defined for dates
+        metrics.loc[
+            metrics.loc[:, "answer_temporal_unit"].str.contains("date"),
+            "symmetric_absolute_percentage_error",
+        ] = None
+        metrics.loc[
+            metrics.loc[:, "answer_temporal_unit"].str.contains("time"),
+            "symmetric_absolute_percentage_error",
+        ] = None
+        responses.write_csv(
+            output_folder / f"ttqa_{last_token.value}_evaluated.csv",
+            _output_columns(list(responses.columns), metrics),
+            np.arange(len(metrics)),
+            metrics,
+            chunk_size,
         )
-        response_dfs.append(df)
-    response_df = pd.concat(response_dfs)
-    response_df = response_df.pipe(calculate_metrics)
-    # sMAPE not defined for dates
-    response_df.loc[
-        response_df.loc[:, "answer_temporal_unit"].str.contains("date"),
-        "symmetric_absolute_percentage_error",
-    ] = None
-    response_df.loc[
-        response_df.loc[:, "answer_temporal_unit"].str.contains("time"),
-        "symmetric_absolute_percentage_error",
-    ] = None
-    response_df.to_csv(output_folder / f"ttqa_{last_token.value}_evaluated.csv", index=False)
@@ -1,13 +1,131 @@
+import contextlib
+import itertools
+import json
+import os
+from collections.abc import Callable, Iterator
+from dataclasses import dataclass
 from pathlib import Path
+from typing import Protocol
 
+import numpy as np
+import pandas as pd
 from tqdm import tqdm
 
-from temp_answer_qa import LastToken, Prompting, ToTSplit, TTQASplit
+from temp_answer_qa import Backend, Dataset, LastToken, Prompting, ToTSplit, TTQASplit
 from temp_answer_qa.chat_builder import ToTChatBuilder, TTQAChatBuilder
+from temp_answer_qa.checkpoint import ResponseCheckpoint
+from temp_answer_qa.constrained_decoding import AnswerSchema, answer_keys_from_instruction
 from temp_answer_qa.data_loader import DataLoader
-from temp_answer_qa.models import HFModel
+from temp_answer_qa.length_profile import (
+    MAX_NEW_TOKENS,
+    TYPE_COLUMNS,
+    learn_caps,
+    load_caps,
+    max_new_tokens_per_row,
+    profile_path,
+    response_files,
+    write_profile,
+)
+from temp_answer_qa.models import PIPELINE_DEPTH, HFModel, load_tokenizer
+from temp_answer_qa.pipeline import BackgroundWorker, StageTimer
+from temp_answer_qa.prompt_store import (
+    PromptStore,
+    TokenizedPrompts,
+    prompt_store_path,
+    write_prompt_store,
+)
+from temp_answer_qa.response_cache import DEFAULT_MAX_SIZE_MB, ResponseCache
+from temp_answer_qa.response_processing import ToTJSONParser, TTQAResponseParser
+from temp_answer_qa.shards import select_shard, shard_path
 
 data_loader = DataLoader()
+# TTQA chats end with the question; there is no assistant message to continue.
+TTQA_LAST_TOKENS = [LastToken.add_generation_prompt]
+
+
+@dataclass(frozen=True)
+class GenerationOptions:
+    """The options of an inference run that `tot`, `ttqa` and `sweep` pass through."""
+
+    test_mode: bool = False
+    batch_size: int = 1
+    checkpoint: bool = False
+    resume: bool = False
+    prefix_cache: bool = False
+    backend: Backend = Backend.hf
+    api_base: str | None = None
+    max_concurrency: int = 8
+    early_stopping: bool = False
+    constrained_decoding: bool = False
+    cache: bool = False
+    cache_max_mb: int = DEFAULT_MAX_SIZE_MB
+    prompt_store: bool = False
+    token_budget: int | None = None
+    continuous_batching: bool = False
+    pipeline: bool = False
+    stage_timing: bool = False
+    num_samples: int = 1
+    adaptive_max_new_tokens: bool = False
+
+    def check(self, dataset: Dataset) -> None:
+        """Raise a ValueError if `dataset` or the backend does not support the options."""
+        if dataset == Dataset.ttqa and self.constrained_decoding:
+            raise ValueError("Constrained decoding is only available for ToT.")
+        if self.backend == Backend.openai:
+            if self.api_base is None:
+                raise ValueError("The openai backend needs an --api-base URL.")
+            unsupported = [option for option, used in self._hf_only().items() if used]
+            if unsupported:
+                raise ValueError(f"{', '.join(unsupported)}: only available for the hf backend.")
+
+    @property
+    def sequential(self) -> bool:
+        """Whether the hf backend generates the rows one by one."""
+        return (
+            self.backend == Backend.hf
+            and self.batch_size == 1
+            and self.token_budget is None
+            and not self.continuous_batching
+            and not self.pipeline
+            and self.num_samples == 1
+        )
+
+    def _hf_only(self) -> dict[str, bool]:
+        return {
+            "--prefix-cache": self.prefix_cache,
+            "--early-stopping": self.early_stopping,
+            "--constrained-decoding": self.constrained_decoding,
+            "--prompt-store": self.prompt_store,
+            "--token-budget": bool(self.token_budget),
+            "--continuous-batching": self.continuous_batching,
+            "--pipeline": self.pipeline,
+            "--stage-timing": self.stage_timing,
+            "--num-samples": self.num_samples > 1,
+        }
+
+
+DEFAULT_OPTIONS = GenerationOptions()
+
+
+class ChatModel(Protocol):
+    """Interface of the inference backends."""
+
+    def generate_with_chat_template(
+        self,
+        messages: list[dict[str, str]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int,
+    ) -> str: ...
+
+    def iter_generate_with_chat_template(
+        self,
+        chats: list[list[dict[str, str]]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int | list[int],
+        batch_size: int,
+    ) -> Iterator[tuple[list[int], list[str]]]: ...
 
 
 def ttqa(
@@ -16,33 +134,94 @@ def ttqa(
     model_name: str,
     last_token: LastToken,
     output_folder: Path,
-    test_mode: bool = False,
+    options: GenerationOptions = DEFAULT_OPTIONS,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    model: ChatModel | None = None,
 ) -> None:
+    if last_token not in TTQA_LAST_TOKENS:
+        raise ValueError(f"TTQA chats end with the question, they cannot use {last_token}.")
+    options.check(Dataset.ttqa)
     output_folder.mkdir(parents=True, exist_ok=True)
-    dataset = data_loader.load_ttqa(split=split, test_mode=test_mode)
+    output_path = response_path(
+        Dataset.ttqa, split, model_name, prompting, last_token, output_folder
+    )
+    if num_shards > 1:
+        output_path = shard_path(output_path, num_shards, shard_index)
+    response_checkpoint = _open_checkpoint(output_path, options.checkpoint, options.resume)
+    dataset = data_loader.load_ttqa(split=split, test_mode=options.test_mode)
+    if num_shards > 1:
+        dataset = select_shard(dataset, num_shards, shard_index)
     chat_builder = TTQAChatBuilder(prompting=prompting, split=split)
-    hf_model = HFModel(model_name=model_name)
-    responses = []
-    for _, row in tqdm(
-        dataset.iterrows(),
-        desc=f"Inference on TTQA with model: {model_name}, prompting: {prompting}, split: {split}, last token: {last_token}",
-        total=dataset.shape[0]
-    ):
-        question = row["question"]
-        table_context = row["table_context"]
-        chat = chat_builder.build_chat(question, table_context)
-        response = hf_model.generate_with_chat_template(
-            chat,
-            add_generation_prompt=(last_token == LastToken.add_generation_prompt),
-            continue_final_message=(last_token == LastToken.continue_final_message),
-            max_new_tokens=256,
+    loaded_model = None
+    if model is None:
+        model = loaded_model = _load_model(model_name, options)
+    response_cache = _open_response_cache(options.cache, options.cache_max_mb)
+    try:
+        if options.prefix_cache:
+            model.cache_prefix(chat_builder.shared_prefix())
+        stage_timer = _start_stage_timer(model) if options.stage_timing else None
+        max_new_tokens = _max_new_tokens(
+            Dataset.ttqa, model_name, dataset, options.adaptive_max_new_tokens
         )
-        responses.append(response)
-    dataset.loc[:, "response"] = responses
-    output_path = (
-        output_folder / f"ttqa_{split}_{model_name.split('/')[-1]}_{prompting}_{last_token}.csv"
-    )
-    dataset.to_csv(output_path, index=False)
+        chats = _ttqa_chats(chat_builder, dataset)
+        prompts = None
+        if options.prompt_store:
+            prompts = _load_prompts(
+                Dataset.ttqa,
+                split,
+                model_name,
+                prompting,
+                last_token,
+                dataset,
+                chats,
+                max_new_tokens,
+            )
+        generation_params = {
+            "backend": options.backend,
+            "early_stopping": options.early_stopping,
+        }
+        if options.num_samples > 1:
+            generation_params["num_samples"] = options.num_samples
+        responses = _generate_responses(
+            model,
+            chats,
+            list(dataset.index),
+            last_token,
+            max_new_tokens=max_new_tokens,
+            batch_size=options.batch_size,
+            token_budget=options.token_budget,
+            continuous_batching=options.continuous_batching,
+            pipeline=options.pipeline,
+            stage_timer=stage_timer,
+            num_samples=options.num_samples,
+            sequential=options.sequential,
+            response_checkpoint=response_checkpoint,
+            prompts=prompts,
+            response_cache=response_cache,
+            cache_keys=_cache_keys(
+                model_name, model, chats, last_token, generation_params, max_new_tokens
+            )
+            if response_cache
+            else None,
+            stop_when=TTQAResponseParser().is_complete if options.early_stopping else None,
+            desc=f"Inference on TTQA with model: {model_name}, prompting: {prompting}, split: {split}, last token: {last_token}",
+        )
+        dataset = _with_responses(dataset, responses, options.num_samples)
+        dataset.to_csv(output_path, index=False)
+        if options.prefix_cache:
+            _report_prefix_cache(model)
+        if stage_timer:
+            model.stage_timer = None
+            tqdm.write(stage_timer.report())
+        if response_checkpoint:
+            response_checkpoint.remove()
+    finally:
+        # Also prune an interrupted run's cache, which grows the most.
+        if response_cache:
+            _close_response_cache(response_cache)
+        if loaded_model is not None:
+            _close_model(loaded_model)
 
 
 def tot(
@@ -51,30 +230,574 @@ def tot(
     model_name: str,
     last_token: LastToken,
     output_folder: Path,
-    test_mode: bool = False,
+    options: GenerationOptions = DEFAULT_OPTIONS,
+    num_shards: int = 1,
+    shard_index: int = 0,
+    model: ChatModel | None = None,
 ) -> None:
+    options.check(Dataset.tot)
     output_folder.mkdir(parents=True, exist_ok=True)
-    dataset = data_loader.load_tot(split=split, test_mode=test_mode)
+    output_path = response_path(
+        Dataset.tot, split, model_name, prompting, last_token, output_folder
+    )
+    if num_shards > 1:
+        output_path = shard_path(output_path, num_shards, shard_index)
+    response_checkpoint = _open_checkpoint(output_path, options.checkpoint, options.resume)
+    dataset = data_loader.load_tot(split=split, test_mode=options.test_mode)
+    if num_shards > 1:
+        dataset = select_shard(dataset, num_shards, shard_index)
     chat_builder = ToTChatBuilder(prompting=prompting, split=split)
-    hf_model = HFModel(model_name=model_name)
-    responses = []
-    for _, row in tqdm(
-        dataset.iterrows(),
-        desc=f"Inference on ToT with model: {model_name}, prompting: {prompting}, split: {split}, last token: {last_token}",
-        total=dataset.shape[0]
-    ):
-        question = row["question_wo_instruct"]
-        instruction = row["instruction"]
-        chat = chat_builder.build_chat(question, last_token, instruction)
-        response = hf_model.generate_with_chat_template(
+    loaded_model = None
+    if model is None:
+        model = loaded_model = _load_model(model_name, options)
+    response_cache = _open_response_cache(options.cache, options.cache_max_mb)
+    try:
+        if options.prefix_cache:
+            model.cache_prefix(chat_builder.shared_prefix())
+        stage_timer = _start_stage_timer(model) if options.stage_timing else None
+        max_new_tokens = _max_new_tokens(
+            Dataset.tot, model_name, dataset, options.adaptive_max_new_tokens
+        )
+        chats = _tot_chats(chat_builder, dataset, last_token)
+        prompts = None
+        if options.prompt_store:
+            prompts = _load_prompts(
+                Dataset.tot,
+                split,
+                model_name,
+                prompting,
+                last_token,
+                dataset,
+                chats,
+                max_new_tokens,
+            )
+        answer_schemas = None
+        if options.constrained_decoding:
+            answer_schemas = _answer_schemas(dataset["instruction"], last_token)
+        generation_params = {
+            "backend": options.backend,
+            "early_stopping": options.early_stopping,
+            "constrained_decoding": options.constrained_decoding,
+        }
+        if options.num_samples > 1:
+            generation_params["num_samples"] = options.num_samples
+        responses = _generate_responses(
+            model,
+            chats,
+            list(dataset.index),
+            last_token,
+            max_new_tokens=max_new_tokens,
+            batch_size=options.batch_size,
+            token_budget=options.token_budget,
+            continuous_batching=options.continuous_batching,
+            pipeline=options.pipeline,
+            stage_timer=stage_timer,
+            num_samples=options.num_samples,
+            sequential=options.sequential,
+            response_checkpoint=response_checkpoint,
+            prompts=prompts,
+            response_cache=response_cache,
+            cache_keys=_cache_keys(
+                model_name, model, chats, last_token, generation_params, max_new_tokens
+            )
+            if response_cache
+            else None,
+            stop_when=ToTJSONParser(last_token).is_complete if options.early_stopping else None,
+            answer_schemas=answer_schemas,
+            desc=f"Inference on ToT with model: {model_name}, prompting: {prompting}, split: {split}, last token: {last_token}",
+        )
+        dataset = _with_responses(dataset, responses, options.num_samples)
+        dataset.to_csv(output_path, index=False)
+        if options.prefix_cache:
+            _report_prefix_cache(model)
+        if stage_timer:
+            model.stage_timer = None
+            tqdm.write(stage_timer.report())
+        if response_checkpoint:
+            response_checkpoint.remove()
+    finally:
+        # Also prune an interrupted run's cache, which grows the most.
+        if response_cache:
+            _close_response_cache(response_cache)
+        if loaded_model is not None:
+            _close_model(loaded_model)
+
+
+def sweep(
+    dataset: Dataset,
+    model_name: str,
+    output_folder: Path,
+    promptings: list[Prompting],
+    splits: list[ToTSplit] | list[TTQASplit],
+    last_tokens: list[LastToken],
+    options: GenerationOptions = DEFAULT_OPTIONS,
+) -> None:
+    """Run every prompting x split x last token configuration with a single model load.
+
+    Configurations whose response CSV already exists are skipped, as are the last tokens that
+    TTQA chats cannot use.
+    """
+    options.check(dataset)
+    last_tokens = _supported_last_tokens(dataset, last_tokens)
+    run = tot if dataset == Dataset.tot else ttqa
+    model = None
+    try:
+        for prompting, split, last_token in itertools.product(promptings, splits, last_tokens):
+            output_path = response_path(
+                dataset, split, model_name, prompting, last_token, output_folder
+            )
+            if output_path.exists():
+                tqdm.write(f"Skipping {output_path}, it already exists.")
+                continue
+            if model is None:
+                model = _load_model(model_name, options)
+            run(prompting, split, model_name, last_token, output_folder, options, model=model)
+    finally:
+        if model is not None:
+            _close_model(model)
+
+
+def _supported_last_tokens(dataset: Dataset, last_tokens: list[LastToken]) -> list[LastToken]:
+    if dataset == Dataset.tot:
+        return last_tokens
+    for last_token in last_tokens:
+        if last_token not in TTQA_LAST_TOKENS:
+            tqdm.write(f"Skipping {last_token}, TTQA chats end with the question.")
+    return [last_token for last_token in last_tokens if last_token in TTQA_LAST_TOKENS]
+
+
+def compile_prompts(
+    dataset: Dataset,
+    model_name: str,
+    promptings: list[Prompting],
+    splits: list[ToTSplit] | list[TTQASplit],
+    last_tokens: list[LastToken],
+    batch_size: int = 64,
+) -> None:
+    """Render and tokenize the chats of every configuration into a prompt store.
+
+    Reports the prompt lengths and how many prompts leave no room for the generated tokens in
+    the context window of the model.
+    """
+    from transformers import AutoConfig
+
+    last_tokens = _supported_last_tokens(dataset, last_tokens)
+    tokenizer = load_tokenizer(model_name)
+    config = AutoConfig.from_pretrained(model_name, token=os.environ.get("HF_TOKEN"))
+    context_window = getattr(config, "max_position_embeddings", None)
+    max_new_tokens = MAX_NEW_TOKENS[dataset]
+    for prompting, split in itertools.product(promptings, splits):
+        if dataset == Dataset.tot:
+            data = data_loader.load_tot(split=split)
+            chat_builder = ToTChatBuilder(prompting=prompting, split=split)
+        else:
+            data = data_loader.load_ttqa(split=split)
+            chat_builder = TTQAChatBuilder(prompting=prompting, split=split)
+        for last_token in last_tokens:
+            if dataset == Dataset.tot:
+                chats = _tot_chats(chat_builder, data, last_token)
+            else:
+                chats = _ttqa_chats(chat_builder, data)
+            input_ids = []
+            for start in range(0, len(chats), batch_size):
+                input_ids += tokenizer.apply_chat_template(
+                    chats[start : start + batch_size],
+                    tokenize=True,
+                    add_generation_prompt=last_token == LastToken.add_generation_prompt,
+                    continue_final_message=last_token == LastToken.continue_final_message,
+                    return_dict=True,
+                )["input_ids"]
+            path = prompt_store_path(dataset, split, model_name, prompting, last_token)
+            write_prompt_store(
+                path,
+                list(data.index),
+                chats,
+                input_ids,
+                {"model_name": model_name, "context_window": context_window},
+            )
+            lengths = np.array([len(ids) for ids in input_ids])
+            overflows = _count_overflows(lengths, max_new_tokens, context_window)
+            tqdm.write(
+                f"{path.name}: {len(lengths)} prompts, {lengths.mean():.0f} mean and "
+                f"{lengths.max()} max tokens, {overflows} exceed the context window of "
+                f"{context_window} tokens with {max_new_tokens} new tokens."
+            )
+
+
+def learn_max_new_tokens(
+    model_name: str, responses_folder: Path, quantile: float = 0.99, batch_size: int = 256
+) -> None:
+    """Learn a max_new_tokens cap per question type from the past responses of `model_name`.
+
+    Reports, per type, the reserved new tokens the cap saves and how many of the past responses
+    it would have truncated.
+    """
+    tokenizer = load_tokenizer(model_name)
+    caps = {}
+    for dataset, paths in response_files(model_name, responses_folder).items():
+        if not paths:
+            continue
+        data = pd.concat([pd.read_csv(path) for path in paths], ignore_index=True)
+        responses = data["response"].fillna("").astype(str).tolist()
+        lengths = np.array(
+            [
+                len(ids)
+                for start in range(0, len(responses), batch_size)
+                for ids in tokenizer(
+                    responses[start : start + batch_size], add_special_tokens=False
+                )["input_ids"]
+            ]
+        )
+        default = MAX_NEW_TOKENS[dataset]
+        report = learn_caps(data[TYPE_COLUMNS[dataset]], lengths, default, quantile)
+        caps[dataset] = dict(zip(report["type"], report["cap"].tolist()))
+        for row in report.itertuples():
+            tqdm.write(
+                f"{dataset} {row.type}: {row.responses} responses, cap {row.cap} of {default} "
+                f"tokens, saves {row.tokens_saved} reserved tokens, {row.truncated} would have "
+                "been truncated."
+            )
+        tqdm.write(
+            f"{dataset}: saves {report['tokens_saved'].sum()} of "
+            f"{report['responses'].sum() * default} reserved tokens, "
+            f"{report['truncated'].sum()} responses would have been truncated."
+        )
+    if not caps:
+        raise FileNotFoundError(f"No responses of {model_name} in {responses_folder}.")
+    path = profile_path(model_name)
+    write_profile(path, model_name, quantile, caps)
+    tqdm.write(f"Wrote {path}.")
+
+
+def response_path(
+    dataset: Dataset,
+    split: ToTSplit | TTQASplit,
+    model_name: str,
+    prompting: Prompting,
+    last_token: LastToken,
+    output_folder: Path,
+) -> Path:
+    return (
+        output_folder
+        / f"{dataset}_{split}_{model_name.split('/')[-1]}_{prompting}_{last_token}.csv"
+    )
+
+
+def _load_model(model_name: str, options: GenerationOptions) -> ChatModel:
+    if options.backend == Backend.hf:
+        return HFModel(model_name=model_name)
+    elif options.backend == Backend.openai:
+        from temp_answer_qa.openai_model import OpenAIModel
+
+        return OpenAIModel(
+            model_name, api_base=options.api_base, max_concurrency=options.max_concurrency
+        )
+    else:
+        raise ValueError(f"Unknown backend: {options.backend}")
+
+
+def _close_model(model: ChatModel) -> None:
+    # The openai backend holds a connection pool and the thread of its event loop.
+    close = getattr(model, "close", None)
+    if close is not None:
+        close()
+
+
+def _with_responses(dataset, responses: list, num_samples: int):
+    """Add the responses to `dataset`, with one row and a `sample` number per sampled response."""
+    if num_samples == 1:
+        dataset.loc[:, "response"] = responses
+        return dataset
+    return (
+        dataset.assign(response=responses)
+        .explode("response")
+        .assign(sample=lambda df: df.groupby(level=0).cumcount())
+    )
+
+
+def _max_new_tokens(
+    dataset_name: Dataset, model_name: str, dataset, adaptive: bool
+) -> int | list[int]:
+    """The default cap, or with `adaptive` the cap learned for the type of every row."""
+    if not adaptive:
+        return MAX_NEW_TOKENS[dataset_name]
+    caps = load_caps(profile_path(model_name), dataset_name)
+    return max_new_tokens_per_row(dataset_name, dataset, caps)
+
+
+def _start_stage_timer(hf_model: HFModel) -> StageTimer:
+    stage_timer = StageTimer()
+    hf_model.stage_timer = stage_timer
+    return stage_timer
+
+
+def _report_prefix_cache(hf_model: HFModel) -> None:
+    tqdm.write(
+        f"Prefix cache: reused {hf_model.prefill_tokens_saved} prompt tokens, prefilled "
+        f"{hf_model.prefix_tokens_prefilled} shared prefix tokens once, saved "
+        f"{hf_model.prefill_tokens_saved - hf_model.prefix_tokens_prefilled} prefill tokens."
+    )
+
+
+def _ttqa_chats(chat_builder: TTQAChatBuilder, dataset) -> list[list[dict[str, str]]]:
+    tables = data_loader.load_ttqa_tables()
+    return [
+        chat_builder.build_chat(question, tables[table_id])
+        for question, table_id in zip(dataset["question"], dataset["table_id"])
+    ]
+
+
+def _tot_chats(
+    chat_builder: ToTChatBuilder, dataset, last_token: LastToken
+) -> list[list[dict[str, str]]]:
+    return [
+        chat_builder.build_chat(question, last_token, instruction)
+        for question, instruction in zip(dataset["question_wo_instruct"], dataset["instruction"])
+    ]
+
+
+def _load_prompts(
+    dataset_name: Dataset,
+    split: ToTSplit | TTQASplit,
+    model_name: str,
+    prompting: Prompting,
+    last_token: LastToken,
+    dataset,
+    chats: list[list[dict[str, str]]],
+    max_new_tokens: int | list[int],
+) -> TokenizedPrompts:
+    path = prompt_store_path(dataset_name, split, model_name, prompting, last_token)
+    if not path.exists():
+        raise FileNotFoundError(f"No compiled prompts at {path}. Run compile-prompts first.")
+    store = PromptStore(path)
+    if store.metadata["model_name"] != model_name:
+        raise ValueError(f"{path} was compiled for {store.metadata['model_name']}.")
+    prompts = store.prompts(list(dataset.index), chats)
+    context_window = store.metadata["context_window"]
+    overflows = _count_overflows(prompts.lengths, max_new_tokens, context_window)
+    if overflows:
+        tqdm.write(
+            f"Warning: {overflows} prompts exceed the context window of {context_window} "
+            f"tokens with {np.max(max_new_tokens)} new tokens."
+        )
+    return prompts
+
+
+def _count_overflows(
+    lengths: np.ndarray, max_new_tokens: int | list[int], context_window: int | None
+) -> int:
+    if context_window is None:
+        return 0
+    return int((lengths + np.asarray(max_new_tokens) > context_window).sum())
+
+
+def _answer_schemas(instructions, last_token: LastToken) -> list[AnswerSchema | None]:
+    answer_schemas = [
+        AnswerSchema(keys, last_token) if keys else None
+        for keys in map(answer_keys_from_instruction, instructions)
+    ]
+    unconstrained = sum(schema is None for schema in answer_schemas)
+    if unconstrained:
+        tqdm.write(
+            f"Warning: {unconstrained} questions have no flat JSON answer template and are "
+            "generated without constrained decoding."
+        )
+    return answer_schemas
+
+
+def _open_response_cache(cache: bool, cache_max_mb: int) -> ResponseCache | None:
+    return ResponseCache(max_size_bytes=cache_max_mb * 2**20) if cache else None
+
+
+def _cache_keys(
+    model_name: str,
+    model: ChatModel,
+    chats: list[list[dict[str, str]]],
+    last_token: LastToken,
+    generation_params: dict,
+    max_new_tokens: int | list[int],
+) -> list[str]:
+    revision = getattr(model, "revision", None)
+    if isinstance(max_new_tokens, int):
+        max_new_tokens = [max_new_tokens] * len(chats)
+    return [
+        ResponseCache.key(
+            f"{model_name}@{revision}" if revision else model_name,
             chat,
-            add_generation_prompt=(last_token == LastToken.add_generation_prompt),
-            continue_final_message=(last_token == LastToken.continue_final_message),
-            max_new_tokens=512,
+            add_generation_prompt=last_token == LastToken.add_generation_prompt,
+            continue_final_message=last_token == LastToken.continue_final_message,
+            generation_params={**generation_params, "max_new_tokens": row_max_new_tokens},
         )
-        responses.append(response)
-    dataset.loc[:, "response"] = responses
-    output_path = (
-        output_folder / f"tot_{split}_{model_name.split('/')[-1]}_{prompting}_{last_token}.csv"
+        for chat, row_max_new_tokens in zip(chats, max_new_tokens)
+    ]
+
+
+def _close_response_cache(response_cache: ResponseCache) -> None:
+    evicted = response_cache.prune()
+    tqdm.write(
+        f"Response cache: {response_cache.hits} hits, {response_cache.misses} misses, "
+        f"evicted {evicted} entries."
     )
-    dataset.to_csv(output_path, index=False)
+    response_cache.close()
+
+
+def _open_checkpoint(
+    output_path: Path, checkpoint: bool, resume: bool
+) -> ResponseCheckpoint | None:
+    if not (checkpoint or resume):
+        return None
+    response_checkpoint = ResponseCheckpoint(output_path)
+    if response_checkpoint.exists() and not resume:
+        raise FileExistsError(
+            f"Found unfinished run {response_checkpoint.path}. Pass --resume to continue it or "
+            "delete the file to start over."
+        )
+    return response_checkpoint
+
+
+def _generate_responses(
+    model: ChatModel,
+    chats: list[list[dict[str, str]]],
+    row_ids: list[int],
+    last_token: LastToken,
+    max_new_tokens: int | list[int],
+    batch_size: int,
+    desc: str,
+    sequential: bool = False,
+    response_checkpoint: ResponseCheckpoint | None = None,
+    prompts: TokenizedPrompts | None = None,
+    stop_when: Callable[[str], bool] | None = None,
+    answer_schemas: list[AnswerSchema | None] | None = None,
+    response_cache: ResponseCache | None = None,
+    cache_keys: list[str] | None = None,
+    token_budget: int | None = None,
+    continuous_batching: bool = False,
+    pipeline: bool = False,
+    stage_timer: StageTimer | None = None,
+    num_samples: int = 1,
+) -> list[str] | list[list[str]]:
+    """Generate one response per chat, skipping rows that a resumed checkpoint already answered
+    or whose `cache_keys` are found in `response_cache`.
+
+    With `pipeline`, finished rows are written to the checkpoint and the cache by a background
+    thread, so that the next batch does not wait for the disk. With `num_samples` > 1 every
+    response is a list of samples, stored as a JSON list in the cache.
+    """
+    completed = response_checkpoint.load() if response_checkpoint else {}
+    responses = [completed.get(row_id) for row_id in row_ids]
+    if response_cache:
+        cached = response_cache.get_many(
+            [key for key, response in zip(cache_keys, responses) if response is None]
+        )
+        if num_samples > 1:
+            cached = {key: json.loads(response) for key, response in cached.items()}
+        responses = [
+            cached.get(key) if response is None else response
+            for key, response in zip(cache_keys, responses)
+        ]
+    pending = [i for i, response in enumerate(responses) if response is None]
+    progress = tqdm(desc=desc, total=len(chats), initial=len(chats) - len(pending))
+
+    def write(rows: list[int], batch_responses: list[str]) -> None:
+        with stage_timer.time("write") if stage_timer else contextlib.nullcontext():
+            if response_checkpoint:
+                response_checkpoint.append([row_ids[row] for row in rows], batch_responses)
+            if response_cache:
+                response_cache.put_many(
+                    [cache_keys[row] for row in rows],
+                    [json.dumps(r) for r in batch_responses]
+                    if num_samples > 1
+                    else batch_responses,
+                )
+            progress.update(len(rows))
+
+    writer = BackgroundWorker(write, maxsize=PIPELINE_DEPTH) if pipeline else None
+    wall = stage_timer.time("wall") if stage_timer else contextlib.nullcontext()
+    with progress, wall:
+        for indices, batch_responses in _iter_responses(
+            model,
+            [chats[i] for i in pending],
+            last_token,
+            max_new_tokens
+            if isinstance(max_new_tokens, int)
+            else [max_new_tokens[i] for i in pending],
+            batch_size,
+            sequential,
+            prompts.select(pending) if prompts is not None else None,
+            stop_when,
+            [answer_schemas[i] for i in pending] if answer_schemas else None,
+            token_budget,
+            continuous_batching,
+            pipeline,
+            num_samples,
+        ):
+            rows = [pending[i] for i in indices]
+            for row, response in zip(rows, batch_responses):
+                responses[row] = response
+            if writer:
+                writer.submit(rows, batch_responses)
+            else:
+                write(rows, batch_responses)
+        if writer:
+            writer.close()
+    return responses
+
+
+def _iter_responses(
+    model: ChatModel,
+    chats: list[list[dict[str, str]]],
+    last_token: LastToken,
+    max_new_tokens: int | list[int],
+    batch_size: int,
+    sequential: bool,
+    prompts: TokenizedPrompts | None = None,
+    stop_when: Callable[[str], bool] | None = None,
+    answer_schemas: list[AnswerSchema | None] | None = None,
+    token_budget: int | None = None,
+    continuous_batching: bool = False,
+    pipeline: bool = False,
+    num_samples: int = 1,
+) -> Iterator[tuple[list[int], list[str]]]:
+    add_generation_prompt = last_token == LastToken.add_generation_prompt
+    continue_final_message = last_token == LastToken.continue_final_message
+    # Only passed when set, so that backends without these options keep working.
+    options = {"stop_when": stop_when} if stop_when else {}
+    batch_options = dict(options)
+    if answer_schemas:
+        batch_options["answer_schemas"] = answer_schemas
+    if token_budget:
+        batch_options["token_budget"] = token_budget
+    if continuous_batching:
+        batch_options["continuous"] = True
+    if pipeline:
+        batch_options["pipeline"] = True
+    if num_samples > 1:
+        batch_options["num_samples"] = num_samples
+    if prompts is not None:
+        # Compiled prompts skip the chat template; only `HFModel` accepts them.
+        yield from model.iter_generate(
+            prompts, max_new_tokens=max_new_tokens, batch_size=batch_size, **batch_options
+        )
+    elif sequential:
+        for i, chat in enumerate(chats):
+            schema_options = {"answer_schema": answer_schemas[i]} if answer_schemas else {}
+            response = model.generate_with_chat_template(
+                chat,
+                add_generation_prompt=add_generation_prompt,
+                continue_final_message=continue_final_message,
+                max_new_tokens=(
+                    max_new_tokens if isinstance(max_new_tokens, int) else max_new_tokens[i]
+                ),
+                **options,
+                **schema_options,
+            )
+            yield [i], [response]
+    else:
+        yield from model.iter_generate_with_chat_template(
+            chats,
+            add_generation_prompt=add_generation_prompt,
+            continue_final_message=continue_final_message,
+            max_new_tokens=max_new_tokens,
+            batch_size=batch_size,
+            **batch_options,
+        )
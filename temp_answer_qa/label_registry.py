@@ -0,0 +1,53 @@
+import functools
+import hashlib
+import pickle
+from pathlib import Path
+
+import pandas as pd
+
+from temp_answer_qa import DATA_DIR, Dataset
+from temp_answer_qa.question_store import QUESTIONS_DIR
+from temp_answer_qa.response_processing import tot_parse_labels, ttqa_parse_labels
+
+LABEL_REGISTRY_DIR = DATA_DIR / "label_registry"
+# The columns that the labels of each dataset are parsed from, and how.
+LABEL_PARSERS = {
+    Dataset.tot: (["label"], lambda labels: tot_parse_labels(labels["label"])),
+    Dataset.ttqa: (["label", "answer_format"], ttqa_parse_labels),
+}
+
+
+def load_labels(dataset: Dataset) -> pd.DataFrame | None:
+    """The gold labels of `dataset` as its `*_parse_labels` function returns them.
+
+    The labels of the questions CSV are parsed once and pickled to `LABEL_REGISTRY_DIR`; they
+    are parsed again whenever the checksum of the CSV changes. None if there is no CSV, in which
+    case the labels are parsed with the responses. Do not modify the returned frame.
+    """
+    csv_path = QUESTIONS_DIR / f"{dataset}.csv"
+    if not csv_path.exists():
+        return None
+    stat = csv_path.stat()
+    return _load(dataset, csv_path, LABEL_REGISTRY_DIR, stat.st_mtime_ns, stat.st_size)
+
+
+@functools.lru_cache(maxsize=8)
+def _load(
+    dataset: Dataset, csv_path: Path, registry_dir: Path, mtime_ns: int, size: int
+) -> pd.DataFrame:
+    checksum = hashlib.sha256(csv_path.read_bytes()).hexdigest()
+    path = registry_dir / f"{dataset}.pickle"
+    if path.exists():
+        with open(path, "rb") as f:
+            registry = pickle.load(f)
+        if registry["source_sha256"] == checksum:
+            return registry["labels"]
+    columns, parse = LABEL_PARSERS[dataset]
+    # Read as the responses are read, so that the label texts match theirs.
+    labels = parse(pd.read_csv(csv_path, usecols=columns, dtype={"label": str}))
+    registry_dir.mkdir(parents=True, exist_ok=True)
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with open(tmp_path, "wb") as f:
+        pickle.dump({"source_sha256": checksum, "labels": labels}, f)
+    tmp_path.replace(path)
+    return labels
@@ -0,0 +1,74 @@
+import json
+import math
+from pathlib import Path
+
+import numpy as np
+import pandas as pd
+
+from temp_answer_qa import DATA_DIR, Dataset
+
+# Caps used when no profile is applied, and for types a profile does not know.
+MAX_NEW_TOKENS = {Dataset.tot: 512, Dataset.ttqa: 256}
+# The column whose values get a cap of their own.
+TYPE_COLUMNS = {Dataset.tot: "question_type", Dataset.ttqa: "answer_format"}
+PROFILE_DIR = DATA_DIR / "max_new_tokens"
+
+
+def profile_path(model_name: str, folder: Path | None = None) -> Path:
+    folder = folder or PROFILE_DIR
+    return folder / f"{model_name.split('/')[-1]}.json"
+
+
+def response_files(model_name: str, responses_folder: Path) -> dict[Dataset, list[Path]]:
+    """The unsharded response CSVs of `model_name`, per dataset."""
+    model = model_name.split("/")[-1]
+    return {
+        dataset: sorted(
+            path
+            for path in responses_folder.glob(f"{dataset}_*_{model}_*.csv")
+            if ".shard-" not in path.name
+        )
+        for dataset in Dataset
+    }
+
+
+def learn_caps(
+    types: pd.Series, lengths: np.ndarray, default: int, quantile: float
+) -> pd.DataFrame:
+    """Cap the new tokens of every type at the `quantile` of its response lengths.
+
+    Caps are never above `default`. Returns one row per type with the number of responses, the
+    cap, the reserved new tokens it saves and how many responses it would have truncated.
+    """
+    lengths = pd.Series(lengths, index=types.index, name="length")
+    grouped = lengths.groupby(types.rename("type"))
+    report = pd.DataFrame(
+        {
+            "responses": grouped.size(),
+            "cap": grouped.quantile(quantile).map(math.ceil).clip(upper=default).astype(int),
+        }
+    )
+    report["tokens_saved"] = report["responses"] * (default - report["cap"])
+    caps = types.map(report["cap"])
+    report["truncated"] = (lengths > caps).groupby(types.rename("type")).sum()
+    return report.reset_index()
+
+
+def write_profile(path: Path, model_name: str, quantile: float, caps: dict) -> None:
+    path.parent.mkdir(parents=True, exist_ok=True)
+    profile = {"model_name": model_name, "quantile": quantile, "max_new_tokens": caps}
+    path.write_text(json.dumps(profile, indent=2, sort_keys=True) + "\n")
+
+
+def load_caps(path: Path, dataset: Dataset) -> dict[str, int]:
+    if not path.exists():
+        raise FileNotFoundError(
+            f"No max_new_tokens profile at {path}. Run learn-max-new-tokens first."
+        )
+    return json.loads(path.read_text())["max_new_tokens"].get(dataset, {})
+
+
+def max_new_tokens_per_row(dataset: Dataset, data: pd.DataFrame, caps: dict[str, int]) -> list[int]:
+    """The cap of every row of `data`, falling back to the default for unknown types."""
+    default = MAX_NEW_TOKENS[dataset]
+    return [caps.get(value, default) for value in data[TYPE_COLUMNS[dataset]]]
@@ -3,6 +3,53 @@ from datetime import timedelta, datetime
 import numpy as np
 import pandas as pd
 
+from temp_answer_qa.typed_values import (
+    CODES,
+    NAT,
+    VALUE_COLUMNS,
+    Kind,
+    assign_typed,
+    empty_columns,
+    from_typed,
+    get_typed,
+    row_applied_series,
+    to_typed,
+    typed_frame,
+)
+
+# The kind of `predicted - expected` for the kinds that subtract into a typed value.
+ERROR_KINDS = {
+    (Kind.int, Kind.int): Kind.int,
+    (Kind.int, Kind.float): Kind.float,
+    (Kind.float, Kind.int): Kind.float,
+    (Kind.float, Kind.float): Kind.float,
+    (Kind.timedelta, Kind.timedelta): Kind.timedelta,
+    (Kind.timedelta, Kind.Timedelta): Kind.Timedelta,
+    (Kind.Timedelta, Kind.timedelta): Kind.Timedelta,
+    (Kind.Timedelta, Kind.Timedelta): Kind.Timedelta,
+    (Kind.datetime, Kind.timedelta): Kind.datetime,
+    (Kind.datetime, Kind.Timedelta): Kind.datetime,
+    (Kind.Timestamp, Kind.timedelta): Kind.Timestamp,
+    (Kind.Timestamp, Kind.Timedelta): Kind.Timestamp,
+    (Kind.datetime, Kind.datetime): Kind.timedelta,
+    (Kind.datetime, Kind.Timestamp): Kind.Timedelta,
+    (Kind.Timestamp, Kind.datetime): Kind.Timedelta,
+    (Kind.Timestamp, Kind.Timestamp): Kind.Timedelta,
+}
+# Kinds whose subtraction does not raise although it is not in `ERROR_KINDS`: pd.Timedelta turns
+# None and NaN into NaT. They are subtracted one by one, as are values of kind `object`; all
+# other kinds raise a TypeError, so their error is None.
+_SCALAR_ERROR_KINDS = {
+    (Kind.none, Kind.Timedelta),
+    (Kind.Timedelta, Kind.none),
+    (Kind.float, Kind.Timedelta),
+    (Kind.Timedelta, Kind.float),
+}
+
+
+_SECOND = 10**9
+_DAY = 86_400 * _SECOND
+
 
 def try_calc_error(predicted, expected):
     try:
@@ -12,7 +59,82 @@ def try_calc_error(predicted, expected):
         return None
 
 
-def tot_measure_error(responses: pd.DataFrame) -> pd.DataFrame:
+def try_calc_errors(predicted: pd.DataFrame, expected: pd.DataFrame) -> pd.DataFrame:
+    """`try_calc_error` of every row of the typed values `predicted` and `expected`.
+
+    Rows are subtracted as columns per pair of kinds. Differences that overflow the typed
+    columns are left to `try_calc_error`, which gives the same result as for all other rows.
+    """
+    codes = np.full(len(predicted), CODES[Kind.none], dtype=np.int8)
+    errors = empty_columns(len(predicted))
+    scalar_rows = []
+    predicted_codes = predicted["kind"].cat.codes.to_numpy()
+    expected_codes = expected["kind"].cat.codes.to_numpy()
+    pairs = predicted_codes.astype(np.int64) * len(Kind) + expected_codes
+    for pair in np.unique(pairs):
+        rows = np.flatnonzero(pairs == pair)
+        predicted_kind, expected_kind = list(Kind)[pair // len(Kind)], list(Kind)[pair % len(Kind)]
+        error_kind = ERROR_KINDS.get((predicted_kind, expected_kind))
+        if error_kind is None:
+            if Kind.object in (predicted_kind, expected_kind) or (
+                (predicted_kind, expected_kind) in _SCALAR_ERROR_KINDS
+            ):
+                scalar_rows.append(rows)
+            continue
+        if error_kind == Kind.float:
+            errors["float"][rows] = _as_float(predicted, predicted_kind, rows) - _as_float(
+                expected, expected_kind, rows
+            )
+            codes[rows] = CODES[error_kind]
+            continue
+        minuend = _as_int64(predicted, predicted_kind, rows)
+        subtrahend = _as_int64(expected, expected_kind, rows)
+        difference = minuend - subtrahend
+        # Differences that wrap around int64, or hit the NaT of time columns, are exact in Python.
+        overflow = ((minuend ^ subtrahend) & (minuend ^ difference)) < 0
+        if error_kind != Kind.int:
+            overflow |= difference == NAT
+        if overflow.any():
+            scalar_rows.append(rows[overflow])
+            rows, difference = rows[~overflow], difference[~overflow]
+        errors[VALUE_COLUMNS[error_kind]][rows] = difference
+        codes[rows] = CODES[error_kind]
+    if scalar_rows:
+        rows = np.concatenate(scalar_rows)
+        for row, predicted_value, expected_value in zip(
+            rows, from_typed(predicted.iloc[rows]), from_typed(expected.iloc[rows])
+        ):
+            errors["object"][row] = try_calc_error(predicted_value, expected_value)
+        codes[rows] = CODES[Kind.object]
+    return typed_frame(codes, errors)
+
+
+def _as_float(typed: pd.DataFrame, kind: Kind, rows: np.ndarray) -> np.ndarray:
+    if kind == Kind.int:
+        return typed["int"].to_numpy(dtype=np.int64, na_value=0)[rows].astype(np.float64)
+    return typed["float"].to_numpy()[rows]
+
+
+def _as_int64(typed: pd.DataFrame, kind: Kind, rows: np.ndarray) -> np.ndarray:
+    if kind == Kind.int:
+        return typed["int"].to_numpy(dtype=np.int64, na_value=0)[rows]
+    # Nanoseconds of durations and since the epoch.
+    return typed[VALUE_COLUMNS[kind]].to_numpy()[rows].view(np.int64)
+
+
+def tot_measure_error(responses: pd.DataFrame, infer_dtypes: bool = True) -> pd.DataFrame:
+    """Measure the errors of the ToT responses and turn errors and answers into numbers.
+
+    Works on whole columns, split by answer temporal unit and kind of value, and gives the same
+    result as `tot_measure_error_rowwise`. Without `infer_dtypes`, the new columns are object
+    columns of the measured values, whichever rows are measured together. Responses with typed
+    `response_numeric` and `label_numeric`, as `assign_typed` stores them, get a typed `error`.
+    """
+    return _measure_error(responses, ToTErrorMeasurer(), infer_dtypes)
+
+
+def tot_measure_error_rowwise(responses: pd.DataFrame) -> pd.DataFrame:
+    """`tot_measure_error` one row at a time, as a reference for tests and benchmarks."""
     tot_error_measurer = ToTErrorMeasurer()
     return responses.assign(
         error=lambda df: df.apply(
@@ -54,6 +176,25 @@ class ToTErrorMeasurer:
         else:
             return np.nan
 
+    def errors_to_digits(
+        self,
+        errors: pd.Series | None,
+        answer_temporal_units: pd.Series,
+        typed_errors: pd.DataFrame | None = None,
+    ) -> list:
+        """`error_to_digit` of every row, computed on the typed columns of `errors`.
+
+        Without `errors`, the errors are only given as `typed_errors`.
+        """
+        rules = _DigitRules(errors, answer_temporal_units, typed_errors)
+        rules.nan(rules.is_na() | rules.unit_is_na())
+        durations = rules.kind_in(Kind.timedelta, Kind.Timedelta)
+        rules.seconds(rules.unit_in("seconds") & durations, "timedelta")
+        rules.seconds(rules.unit_in("minutes") & durations, "timedelta", per=60)
+        rules.keep(rules.unit_in("days", "months", "years"))
+        rules.days(rules.unit_in("date") & rules.kind_in(Kind.Timedelta))
+        return rules.digits(self.error_to_digit)
+
     def model_response_to_digit(self, response_numeric, answer_temporal_unit: str):
         if pd.isna(answer_temporal_unit):
             return np.nan
@@ -70,8 +211,39 @@ class ToTErrorMeasurer:
         else:
             return np.nan
 
+    def model_responses_to_digits(
+        self,
+        responses_numeric: pd.Series | None,
+        answer_temporal_units: pd.Series,
+        typed_responses: pd.DataFrame | None = None,
+    ) -> list:
+        """`model_response_to_digit` of every row, computed on typed columns.
+
+        Without `responses_numeric`, the answers are only given as `typed_responses`.
+        """
+        rules = _DigitRules(responses_numeric, answer_temporal_units, typed_responses)
+        rules.nan(rules.unit_is_na())
+        durations = rules.kind_in(Kind.timedelta, Kind.Timedelta)
+        rules.seconds(rules.unit_in("seconds") & durations, "timedelta")
+        rules.seconds(rules.unit_in("minutes") & durations, "timedelta", per=60)
+        rules.seconds(rules.unit_in("date") & rules.kind_in(Kind.Timestamp), "datetime")
+        rules.keep(rules.unit_in("days", "months", "years") & rules.kind_in(Kind.int, Kind.float))
+        return rules.digits(self.model_response_to_digit)
+
 
-def ttqa_measure_error(responses: pd.DataFrame) -> pd.DataFrame:
+def ttqa_measure_error(responses: pd.DataFrame, infer_dtypes: bool = True) -> pd.DataFrame:
+    """Measure the errors of the TTQA responses and turn errors and answers into numbers.
+
+    Works on whole columns, split by answer temporal unit and kind of value, and gives the same
+    result as `ttqa_measure_error_rowwise`. Without `infer_dtypes`, the new columns are object
+    columns of the measured values, whichever rows are measured together. Responses with typed
+    `response_numeric` and `label_numeric`, as `assign_typed` stores them, get a typed `error`.
+    """
+    return _measure_error(responses, TTQAMeasurer(), infer_dtypes)
+
+
+def ttqa_measure_error_rowwise(responses: pd.DataFrame) -> pd.DataFrame:
+    """`ttqa_measure_error` one row at a time, as a reference for tests and benchmarks."""
     ttqa_error_measurer = TTQAMeasurer()
     return responses.assign(
         error=lambda df: df.apply(
@@ -111,6 +283,25 @@ class TTQAMeasurer:
         else:
             return np.nan
 
+    def errors_to_digits(
+        self,
+        errors: pd.Series | None,
+        answer_temporal_units: pd.Series,
+        typed_errors: pd.DataFrame | None = None,
+    ) -> list:
+        """`error_to_digit` of every row, computed on the typed columns of `errors`.
+
+        Without `errors`, the errors are only given as `typed_errors`.
+        """
+        rules = _DigitRules(errors, answer_temporal_units, typed_errors)
+        rules.nan(rules.is_na() | rules.unit_is_na())
+        rules.days(rules.unit_in("date") & rules.kind_in(Kind.timedelta, Kind.Timedelta))
+        rules.keep(
+            rules.unit_in("years", "date_years", "days", "months")
+            & rules.kind_in(Kind.int, Kind.float)
+        )
+        return rules.digits(self.error_to_digit)
+
     def model_response_to_digit(self, response_numeric, answer_temporal_unit: str):
         if pd.isna(answer_temporal_unit):
             return np.nan
@@ -124,3 +315,145 @@ class TTQAMeasurer:
             return response_numeric
         else:
             return np.nan
+
+    def model_responses_to_digits(
+        self,
+        responses_numeric: pd.Series | None,
+        answer_temporal_units: pd.Series,
+        typed_responses: pd.DataFrame | None = None,
+    ) -> list:
+        """`model_response_to_digit` of every row, computed on typed columns.
+
+        Without `responses_numeric`, the answers are only given as `typed_responses`.
+        """
+        rules = _DigitRules(responses_numeric, answer_temporal_units, typed_responses)
+        rules.nan(rules.unit_is_na())
+        dates = rules.unit_in("date")
+        rules.seconds(dates & rules.kind_in(Kind.Timestamp), "datetime")
+        # The timestamp of a naive datetime depends on the local time zone.
+        rules.scalar(dates & rules.kind_in(Kind.datetime))
+        rules.keep(
+            rules.unit_in("years", "date_years", "days", "months")
+            & rules.kind_in(Kind.int, Kind.float)
+        )
+        return rules.digits(self.model_response_to_digit)
+
+
+def _measure_error(
+    responses: pd.DataFrame, measurer: ToTErrorMeasurer | TTQAMeasurer, infer_dtypes: bool
+) -> pd.DataFrame:
+    typed_responses = get_typed(responses, "response_numeric")
+    typed_labels = get_typed(responses, "label_numeric")
+    if typed_responses is None:
+        response_values, label_values = responses["response_numeric"], responses["label_numeric"]
+        typed_responses, typed_labels = to_typed(response_values), to_typed(label_values)
+        typed_errors = try_calc_errors(typed_responses, typed_labels)
+        error = row_applied_series(from_typed(typed_errors), responses.index, infer_dtypes)
+        if error.dtype != object:
+            # The column holds the errors as its dtype casts them.
+            typed_errors = None
+        measured = responses.assign(error=error)
+    else:
+        # Python values are only made of the rows that the scalar methods need.
+        response_values = label_values = error = None
+        typed_errors = try_calc_errors(typed_responses, typed_labels)
+        measured = assign_typed(responses, "error", typed_errors)
+    units = responses["answer_temporal_unit"]
+    return measured.assign(
+        error_numeric=row_applied_series(
+            measurer.errors_to_digits(error, units, typed_errors),
+            responses.index,
+            infer_dtypes,
+        ),
+        response_digit=row_applied_series(
+            measurer.model_responses_to_digits(response_values, units, typed_responses),
+            responses.index,
+            infer_dtypes,
+        ),
+        label_digit=row_applied_series(
+            measurer.model_responses_to_digits(label_values, units, typed_labels),
+            responses.index,
+            infer_dtypes,
+        ),
+    )
+
+
+class _DigitRules:
+    """The if/elif chain of a `*_to_digit` method, evaluated on the typed columns of values.
+
+    Each rule decides the rows that it matches and that no earlier rule decided. Rows that no
+    rule decides are NaN; rows of kind `object` and rows left to `scalar` are given to the
+    scalar method. Without `values`, those of the kept and scalar rows are made from `typed`.
+    """
+
+    def __init__(self, values: pd.Series | None, units: pd.Series, typed: pd.DataFrame | None):
+        self.values = None if values is None else values.tolist()
+        self.units = units.reset_index(drop=True)
+        self.typed = to_typed(self.values) if typed is None else typed
+        self.codes = self.typed["kind"].cat.codes.to_numpy()
+        self.results = [np.nan] * len(self.typed)
+        self.undecided = self.codes != CODES[Kind.object]
+        self.scalar_rows = ~self.undecided
+
+    def kind_in(self, *kinds: Kind) -> np.ndarray:
+        return np.isin(self.codes, [CODES[kind] for kind in kinds])
+
+    def unit_in(self, *units: str) -> np.ndarray:
+        return self.units.isin(units).to_numpy()
+
+    def is_na(self) -> np.ndarray:
+        return (self.codes == CODES[Kind.none]) | (
+            (self.codes == CODES[Kind.float]) & np.isnan(self.typed["float"].to_numpy())
+        )
+
+    def unit_is_na(self) -> np.ndarray:
+        return self.units.isna().to_numpy()
+
+    def nan(self, rows: np.ndarray) -> None:
+        self._decide(rows)
+
+    def keep(self, rows: np.ndarray) -> None:
+        rows = self._decide(rows)
+        for row, value in zip(rows, self._values(rows)):
+            self.results[row] = value
+
+    def seconds(self, rows: np.ndarray, column: str, per: int = 1) -> None:
+        """Whole seconds of durations or since the epoch, divided by `per`.
+
+        Fractions of seconds are left to the scalar method, which rounds them its own way.
+        """
+        nanoseconds = self.typed[column].to_numpy().view(np.int64)
+        self.scalar(rows & (nanoseconds % _SECOND != 0))
+        rows = self._decide(rows)
+        self._set(rows, (nanoseconds[rows] // _SECOND).astype(np.float64) / per)
+
+    def days(self, rows: np.ndarray) -> None:
+        """The `days` of durations, which are rounded down."""
+        rows = self._decide(rows)
+        self._set(rows, self.typed["timedelta"].to_numpy().view(np.int64)[rows] // _DAY)
+
+    def scalar(self, rows: np.ndarray) -> None:
+        rows = rows & self.undecided
+        self.scalar_rows |= rows
+        self.undecided &= ~rows
+
+    def digits(self, to_digit) -> list:
+        units = self.units.tolist()
+        rows = np.flatnonzero(self.scalar_rows)
+        for row, value in zip(rows, self._values(rows)):
+            self.results[row] = to_digit(value, units[row])
+        return self.results
+
+    def _values(self, rows: np.ndarray) -> list:
+        if self.values is None:
+            return from_typed(self.typed.iloc[rows])
+        return [self.values[row] for row in rows]
+
+    def _decide(self, rows: np.ndarray) -> np.ndarray:
+        rows = rows & self.undecided
+        self.undecided &= ~rows
+        return np.flatnonzero(rows)
+
+    def _set(self, rows: np.ndarray, values: np.ndarray) -> None:
+        for row, value in zip(rows, values.tolist()):
+            self.results[row] = value
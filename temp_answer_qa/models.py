@@ -1,27 +1,77 @@
+import contextlib
+import copy
 import os
+import queue
+from collections.abc import Callable, Iterator, Sequence
 
-from accelerate.test_utils.testing import get_backend
+import torch
 from dotenv import load_dotenv
-from transformers import AutoModelForCausalLM, AutoTokenizer
+from tqdm import tqdm
+from transformers import (
+    AutoModelForCausalLM,
+    AutoTokenizer,
+    BatchEncoding,
+    LogitsProcessorList,
+    StoppingCriteria,
+    StoppingCriteriaList,
+)
 
-load_dotenv()
-ACCESS_TOKEN = os.environ["HF_TOKEN"]
-DEVICE, _, _ = get_backend()
+from temp_answer_qa.constrained_decoding import (
+    AnswerSchema,
+    AnswerSchemaLogitsProcessor,
+    TokenTrie,
+)
+from temp_answer_qa.continuous_batching import (
+    ContinuousBatcher,
+    may_complete,
+    unsupported_reason,
+)
+from temp_answer_qa.pipeline import BackgroundWorker, StageTimer, prefetch
+
+# Number of batches that are prepared ahead of, or wait for decoding behind, `generate`.
+PIPELINE_DEPTH = 2
 
 
 class HFModel:
     def __init__(self, model_name: str):
-        self.tokenizer = AutoTokenizer.from_pretrained(
-            model_name,
-            use_fast=True,
-            token=ACCESS_TOKEN,
-        )
+        # Imported here because probing the device is slow and only needed to run a model.
+        from accelerate.test_utils.testing import get_backend
+
+        self.device, _, _ = get_backend()
+        self.tokenizer = load_tokenizer(model_name)
         self.model = AutoModelForCausalLM.from_pretrained(
             model_name,
             device_map="auto",
             torch_dtype="auto",
-            token=ACCESS_TOKEN,
+            token=os.environ.get("HF_TOKEN"),
         )
+        # Commit of the checkpoint on the Hub, part of the response cache key.
+        self.revision = getattr(self.model.config, "_commit_hash", None)
+        self._prefix_ids: list[int] | None = None
+        self._prefix_cache = None
+        self.prefix_tokens_prefilled = 0
+        self.prefill_tokens_saved = 0
+        self.oom_splits = 0
+        self._token_trie: TokenTrie | None = None
+        self._schema_masks = {}
+        # Set to a `StageTimer` to measure where the time of a run goes.
+        self.stage_timer: StageTimer | None = None
+
+    def cache_prefix(self, messages: list[dict[str, str]]) -> None:
+        """Enable prefix caching for chats that start with `messages`.
+
+        The key/values of the rendered prefix are computed once and reused by every later
+        generation, so only the question-specific suffix of a chat is prefilled.
+        """
+        if not messages:
+            return
+        self._prefix_ids = self.tokenize_chat(
+            messages, add_generation_prompt=False, continue_final_message=False
+        )
+        input_ids = torch.tensor([self._prefix_ids], device=self.device)
+        with torch.no_grad():
+            self._prefix_cache = self.model(input_ids=input_ids, use_cache=True).past_key_values
+        self.prefix_tokens_prefilled += len(self._prefix_ids)
 
     def generate_with_chat_template(
         self,
@@ -29,20 +79,522 @@ class HFModel:
         add_generation_prompt: bool,
         continue_final_message: bool,
         max_new_tokens: int,
+        stop_when: Callable[[str], bool] | None = None,
+        answer_schema: AnswerSchema | None = None,
     ) -> str:
-        chat = self.tokenizer.apply_chat_template(
+        if self._prefix_ids is not None:
+            with self._stage("tokenize"):
+                prompt = self.tokenize_chat(messages, add_generation_prompt, continue_final_message)
+            return self.generate_batch([prompt], max_new_tokens, stop_when, [answer_schema])[0]
+        with self._stage("tokenize"):
+            chat = self.tokenizer.apply_chat_template(
+                messages,
+                tokenizer=True,
+                add_generation_prompt=add_generation_prompt,
+                continue_final_message=continue_final_message,
+                return_tensors="pt",
+                return_dict=True,
+            ).to(self.device)
+        chat_length = chat["input_ids"].shape[1]
+        with self._stage("generate"):
+            outputs = self.model.generate(
+                **chat,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.eos_token_id,
+                stopping_criteria=self._stopping_criteria(chat_length, stop_when),
+                logits_processor=self._logits_processor(chat_length, [answer_schema]),
+            )
+        with self._stage("decode"):
+            response_str = self.tokenizer.decode(outputs[0][chat_length:], skip_special_tokens=True)
+        return response_str
+
+    def generate_batch_with_chat_template(
+        self,
+        chats: list[list[dict[str, str]]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int,
+        batch_size: int,
+        stop_when: Callable[[str], bool] | None = None,
+        answer_schemas: list[AnswerSchema | None] | None = None,
+        num_samples: int = 1,
+    ) -> list[str] | list[list[str]]:
+        """Generate responses for many chats and return them in the order of `chats`."""
+        responses = [""] * len(chats)
+        for indices, batch_responses in self.iter_generate_with_chat_template(
+            chats,
+            add_generation_prompt=add_generation_prompt,
+            continue_final_message=continue_final_message,
+            max_new_tokens=max_new_tokens,
+            batch_size=batch_size,
+            stop_when=stop_when,
+            answer_schemas=answer_schemas,
+            num_samples=num_samples,
+        ):
+            for i, response in zip(indices, batch_responses):
+                responses[i] = response
+        return responses
+
+    def iter_generate_with_chat_template(
+        self,
+        chats: list[list[dict[str, str]]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int | list[int],
+        batch_size: int,
+        stop_when: Callable[[str], bool] | None = None,
+        answer_schemas: list[AnswerSchema | None] | None = None,
+        token_budget: int | None = None,
+        continuous: bool = False,
+        pipeline: bool = False,
+        num_samples: int = 1,
+    ) -> Iterator[tuple[list[int], list[str]]] | Iterator[tuple[list[int], list[list[str]]]]:
+        """Yield `(indices, responses)` per batch, where `indices` point into `chats`.
+
+        Chats are sorted by prompt length and cut into buckets of `batch_size`, or of at most
+        `token_budget` padded prompt and new tokens, so that each bucket needs little left
+        padding. A bucket that runs out of memory is halved and retried. If given, `stop_when`
+        ends each sequence of a batch as soon as its decoded response satisfies it, and
+        `answer_schemas` constrain each chat to valid JSON of its expected shape.
+        `max_new_tokens` is either one cap for all chats or one per chat; chats with different
+        caps never share a batch.
+
+        With `continuous`, a `ContinuousBatcher` runs up to `batch_size` sequences, or as many as
+        fit into `token_budget`, at a time and starts a new chat whenever one finishes.
+        With `pipeline`, the next batches are padded and the previous ones decoded in background
+        threads while `generate` runs. With `num_samples` > 1, every response is a list of that
+        many sampled responses that share the prefill of their prompt.
+        """
+        with self._stage("tokenize"):
+            prompts = [
+                self.tokenize_chat(chat, add_generation_prompt, continue_final_message)
+                for chat in chats
+            ]
+        yield from self.iter_generate(
+            prompts,
+            max_new_tokens,
+            batch_size,
+            stop_when,
+            answer_schemas,
+            token_budget,
+            continuous,
+            pipeline,
+            num_samples,
+        )
+
+    def iter_generate(
+        self,
+        prompts: Sequence[list[int]],
+        max_new_tokens: int | list[int],
+        batch_size: int,
+        stop_when: Callable[[str], bool] | None = None,
+        answer_schemas: list[AnswerSchema | None] | None = None,
+        token_budget: int | None = None,
+        continuous: bool = False,
+        pipeline: bool = False,
+        num_samples: int = 1,
+    ) -> Iterator[tuple[list[int], list[str]]] | Iterator[tuple[list[int], list[list[str]]]]:
+        """Like `iter_generate_with_chat_template` for prompts that are already tokenized."""
+        if continuous and pipeline:
+            raise ValueError("Continuous batching cannot be combined with the batch pipeline.")
+        if continuous and num_samples > 1:
+            raise ValueError("Continuous batching cannot draw several samples per prompt.")
+        if continuous and (reason := unsupported_reason(self.model)):
+            tqdm.write(f"Continuous batching {reason}, falling back to static batching.")
+            continuous = False
+        if continuous:
+            batcher = ContinuousBatcher(
+                self, max_new_tokens, batch_size, stop_when, answer_schemas, token_budget
+            )
+            yield from batcher.run(prompts)
+            return
+        lengths = [len(prompts[i]) for i in range(len(prompts))]
+        batches = plan_batches(lengths, batch_size, max_new_tokens, token_budget)
+        if pipeline:
+            yield from self._iter_generate_pipelined(
+                prompts, batches, max_new_tokens, stop_when, answer_schemas, num_samples
+            )
+            return
+        for indices in batches:
+            yield from self._generate_splitting_on_oom(
+                prompts,
+                indices,
+                _batch_max_new_tokens(max_new_tokens, indices),
+                stop_when,
+                answer_schemas,
+                num_samples,
+            )
+
+    def _iter_generate_pipelined(
+        self,
+        prompts: Sequence[list[int]],
+        batches: list[list[int]],
+        max_new_tokens: int | list[int],
+        stop_when: Callable[[str], bool] | None,
+        answer_schemas: list[AnswerSchema | None] | None,
+        num_samples: int,
+    ) -> Iterator[tuple[list[int], list[str]]]:
+        def prepare():
+            for indices in batches:
+                with self._stage("prepare"):
+                    batch, past_key_values, _ = self.prepare_batch([prompts[i] for i in indices])
+                yield indices, batch, past_key_values
+
+        decoded = queue.SimpleQueue()
+
+        def decode(indices: list[int], output_ids: torch.Tensor) -> None:
+            with self._stage("decode"):
+                responses = self._decode(output_ids, num_samples)
+            decoded.put((indices, responses))
+
+        decoder = BackgroundWorker(decode, maxsize=PIPELINE_DEPTH)
+        for indices, batch, past_key_values in prefetch(prepare(), maxsize=PIPELINE_DEPTH):
+            batch_schemas = [answer_schemas[i] for i in indices] if answer_schemas else None
+            batch_max_new_tokens = _batch_max_new_tokens(max_new_tokens, indices)
+            try:
+                output_ids = self._generate_ids(
+                    batch.to(self.device),
+                    past_key_values,
+                    batch_max_new_tokens,
+                    stop_when,
+                    batch_schemas,
+                    num_samples,
+                )
+            except torch.OutOfMemoryError:
+                if len(indices) == 1:
+                    raise
+                yield from self._retry_in_halves(
+                    prompts, indices, batch_max_new_tokens, stop_when, answer_schemas, num_samples
+                )
+                continue
+            decoder.submit(indices, output_ids)
+            while not decoded.empty():
+                yield decoded.get()
+        decoder.close()
+        while not decoded.empty():
+            yield decoded.get()
+
+    def _generate_splitting_on_oom(
+        self,
+        prompts: Sequence[list[int]],
+        indices: list[int],
+        max_new_tokens: int,
+        stop_when: Callable[[str], bool] | None,
+        answer_schemas: list[AnswerSchema | None] | None,
+        num_samples: int = 1,
+    ) -> Iterator[tuple[list[int], list[str]]]:
+        batch_schemas = [answer_schemas[i] for i in indices] if answer_schemas else None
+        try:
+            responses = self.generate_batch(
+                [prompts[i] for i in indices], max_new_tokens, stop_when, batch_schemas, num_samples
+            )
+        except torch.OutOfMemoryError:
+            if len(indices) == 1:
+                raise
+            yield from self._retry_in_halves(
+                prompts, indices, max_new_tokens, stop_when, answer_schemas, num_samples
+            )
+            return
+        yield indices, responses
+
+    def _retry_in_halves(
+        self,
+        prompts: Sequence[list[int]],
+        indices: list[int],
+        max_new_tokens: int,
+        stop_when: Callable[[str], bool] | None,
+        answer_schemas: list[AnswerSchema | None] | None,
+        num_samples: int,
+    ) -> Iterator[tuple[list[int], list[str]]]:
+        torch.cuda.empty_cache()
+        self.oom_splits += 1
+        tqdm.write(f"A batch of {len(indices)} prompts ran out of memory, retrying in halves.")
+        half = len(indices) // 2
+        for part in (indices[:half], indices[half:]):
+            yield from self._generate_splitting_on_oom(
+                prompts, part, max_new_tokens, stop_when, answer_schemas, num_samples
+            )
+
+    def tokenize_chat(
+        self,
+        messages: list[dict[str, str]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+    ) -> list[int]:
+        return self.tokenizer.apply_chat_template(
             messages,
-            tokenizer=True,
+            tokenize=True,
             add_generation_prompt=add_generation_prompt,
             continue_final_message=continue_final_message,
-            return_tensors="pt",
             return_dict=True,
-        ).to(DEVICE)
-        chat_length = chat["input_ids"].shape[1]
-        outputs = self.model.generate(
-            **chat,
-            max_new_tokens=max_new_tokens,
-            pad_token_id=self.tokenizer.eos_token_id,
+        )["input_ids"]
+
+    def generate_batch(
+        self,
+        prompts: list[list[int]],
+        max_new_tokens: int,
+        stop_when: Callable[[str], bool] | None = None,
+        answer_schemas: list[AnswerSchema | None] | None = None,
+        num_samples: int = 1,
+    ) -> list[str] | list[list[str]]:
+        with self._stage("prepare"):
+            batch, past_key_values, _ = self.prepare_batch(prompts)
+        output_ids = self._generate_ids(
+            batch.to(self.device),
+            past_key_values,
+            max_new_tokens,
+            stop_when,
+            answer_schemas,
+            num_samples,
         )
-        response_str = self.tokenizer.decode(outputs[0][chat_length:], skip_special_tokens=True)
-        return response_str
+        with self._stage("decode"):
+            return self._decode(output_ids, num_samples)
+
+    def _decode(self, output_ids: torch.Tensor, num_samples: int) -> list[str] | list[list[str]]:
+        responses = self.tokenizer.batch_decode(output_ids, skip_special_tokens=True)
+        if num_samples == 1:
+            return responses
+        return [responses[i : i + num_samples] for i in range(0, len(responses), num_samples)]
+
+    def _generate_ids(
+        self,
+        batch: BatchEncoding,
+        past_key_values,
+        max_new_tokens: int,
+        stop_when: Callable[[str], bool] | None,
+        answer_schemas: list[AnswerSchema | None] | None,
+        num_samples: int = 1,
+    ) -> torch.Tensor:
+        """Run `generate` on a padded batch and return the new tokens of every row on the CPU.
+
+        With `num_samples` > 1, each prompt is prefilled once and its key/values are copied for
+        every sample; the samples of a prompt are adjacent rows of the result.
+        """
+        batch_length = batch["input_ids"].shape[1]
+        sampling = {}
+        if num_samples > 1:
+            with self._stage("prefill"):
+                past_key_values = self._prefill_for_samples(batch, past_key_values, num_samples)
+            batch = BatchEncoding(
+                {key: value.repeat_interleave(num_samples, dim=0) for key, value in batch.items()}
+            )
+            if answer_schemas:
+                answer_schemas = [schema for schema in answer_schemas for _ in range(num_samples)]
+            sampling = {"do_sample": True}
+        with self._stage("generate"):
+            outputs = self.model.generate(
+                **batch,
+                past_key_values=past_key_values,
+                max_new_tokens=max_new_tokens,
+                pad_token_id=self.tokenizer.eos_token_id,
+                stopping_criteria=self._stopping_criteria(batch_length, stop_when),
+                logits_processor=self._logits_processor(batch_length, answer_schemas),
+                **sampling,
+            )
+            return outputs[:, batch_length:].cpu()
+
+    def _prefill_for_samples(self, batch: BatchEncoding, past_key_values, num_samples: int):
+        """Prefill all but the last prompt token and repeat the key/values for every sample.
+
+        `generate` then only has to process the last token of each of the repeated prompts.
+        """
+        cached_length = past_key_values.get_seq_length() if past_key_values is not None else 0
+        input_ids = batch["input_ids"]
+        if input_ids.shape[1] - cached_length > 1:
+            attention_mask = batch["attention_mask"]
+            position_ids = attention_mask.long().cumsum(-1) - 1
+            position_ids.masked_fill_(attention_mask == 0, 1)
+            with torch.no_grad():
+                past_key_values = self.model(
+                    input_ids=input_ids[:, cached_length:-1],
+                    attention_mask=attention_mask[:, :-1],
+                    position_ids=position_ids[:, cached_length:-1],
+                    past_key_values=past_key_values,
+                    use_cache=True,
+                    logits_to_keep=1,
+                ).past_key_values
+        if past_key_values is not None:
+            past_key_values.batch_repeat_interleave(num_samples)
+        return past_key_values
+
+    def prepare_batch(self, prompts: list[list[int]]) -> tuple[BatchEncoding, object, int]:
+        """Pad `prompts` and return them with a copy of the cached key/values of their shared
+        prefix and its length, which is 0 without prefix caching.
+        """
+        prefix_length = self._shared_prefix_length(prompts)
+        if prefix_length == 0:
+            batch = self.tokenizer.pad({"input_ids": prompts}, padding=True, return_tensors="pt")
+            return batch, None, 0
+        batch = self._pad_after_prefix(prompts, prefix_length)
+        past_key_values = self._copy_prefix_cache(prefix_length, len(prompts))
+        self.prefill_tokens_saved += prefix_length * len(prompts)
+        return batch, past_key_values, prefix_length
+
+    def _stage(self, stage: str):
+        if self.stage_timer is None:
+            return contextlib.nullcontext()
+        return self.stage_timer.time(stage)
+
+    def eos_token_ids(self) -> list[int]:
+        eos_token_ids = self.model.generation_config.eos_token_id
+        if eos_token_ids is None:
+            eos_token_ids = self.tokenizer.eos_token_id
+        if isinstance(eos_token_ids, int):
+            eos_token_ids = [eos_token_ids]
+        return eos_token_ids
+
+    def _stopping_criteria(
+        self, prompt_length: int, stop_when: Callable[[str], bool] | None
+    ) -> StoppingCriteriaList | None:
+        if stop_when is None:
+            return None
+        return StoppingCriteriaList(
+            [ResponseCompleteCriteria(self.tokenizer, prompt_length, stop_when)]
+        )
+
+    def _logits_processor(
+        self, prompt_length: int, answer_schemas: list[AnswerSchema | None] | None
+    ) -> LogitsProcessorList | None:
+        if not answer_schemas or all(schema is None for schema in answer_schemas):
+            return None
+        if self._token_trie is None:
+            self._token_trie = TokenTrie(self.tokenizer)
+        return LogitsProcessorList(
+            [
+                AnswerSchemaLogitsProcessor(
+                    self._token_trie,
+                    answer_schemas,
+                    prompt_length,
+                    self.eos_token_ids(),
+                    self._schema_masks,
+                )
+            ]
+        )
+
+    def _shared_prefix_length(self, prompts: list[list[int]]) -> int:
+        if self._prefix_ids is None:
+            return 0
+        # At least one token per prompt must be left to prefill.
+        return min(
+            min(_common_prefix_length(self._prefix_ids, prompt), len(prompt) - 1)
+            for prompt in prompts
+        )
+
+    def _pad_after_prefix(self, prompts: list[list[int]], prefix_length: int) -> BatchEncoding:
+        # Padding goes between the cached prefix and the suffixes, so that the prefix keeps the
+        # positions it was cached with.
+        suffixes = [prompt[prefix_length:] for prompt in prompts]
+        width = max(len(suffix) for suffix in suffixes)
+        prefix = prompts[0][:prefix_length]
+        pad_token_id = self.tokenizer.pad_token_id
+        return BatchEncoding(
+            {
+                "input_ids": [
+                    prefix + [pad_token_id] * (width - len(suffix)) + suffix for suffix in suffixes
+                ],
+                "attention_mask": [
+                    [1] * prefix_length + [0] * (width - len(suffix)) + [1] * len(suffix)
+                    for suffix in suffixes
+                ],
+            },
+            tensor_type="pt",
+        )
+
+    def _copy_prefix_cache(self, prefix_length: int, batch_size: int):
+        past_key_values = copy.deepcopy(self._prefix_cache)
+        if prefix_length < len(self._prefix_ids):
+            # The chat template can merge the last prefix tokens with the suffix.
+            past_key_values.crop(prefix_length - len(self._prefix_ids))
+        if batch_size > 1:
+            past_key_values.batch_repeat_interleave(batch_size)
+        return past_key_values
+
+
+class ResponseCompleteCriteria(StoppingCriteria):
+    """Stop every sequence of a batch once its decoded response satisfies `stop_when`.
+
+    Only unfinished sequences are decoded, and only after a token that `may_complete` them.
+    """
+
+    def __init__(self, tokenizer, prompt_length: int, stop_when: Callable[[str], bool]):
+        self.tokenizer = tokenizer
+        self.prompt_length = prompt_length
+        self.stop_when = stop_when
+        self.finished: torch.Tensor | None = None
+
+    def __call__(self, input_ids: torch.LongTensor, scores: torch.FloatTensor, **kwargs):
+        if self.finished is None:
+            self.finished = torch.zeros(len(input_ids), dtype=torch.bool, device=input_ids.device)
+        decode = self.tokenizer.decode
+        for row in (~self.finished).nonzero()[:, 0].tolist():
+            tokens = input_ids[row, self.prompt_length :]
+            last_token = decode(tokens[-1:], skip_special_tokens=True)
+            if may_complete(self.stop_when, last_token) and self.stop_when(
+                decode(tokens, skip_special_tokens=True)
+            ):
+                self.finished[row] = True
+        return self.finished.clone()
+
+
+def plan_batches(
+    lengths: list[int],
+    batch_size: int,
+    max_new_tokens: int | list[int],
+    token_budget: int | None = None,
+) -> list[list[int]]:
+    """Sort the prompt indices by length and cut them into batches.
+
+    Without a `token_budget` every batch has `batch_size` prompts. With it, a batch grows as long
+    as its rows, left-padded to the longest prompt, plus `max_new_tokens` fit into the budget.
+    With one `max_new_tokens` per prompt, the prompts of each cap are planned separately.
+    """
+    if isinstance(max_new_tokens, list):
+        batches = []
+        for cap in sorted(set(max_new_tokens)):
+            group = [i for i, row_cap in enumerate(max_new_tokens) if row_cap == cap]
+            group_batches = plan_batches([lengths[i] for i in group], batch_size, cap, token_budget)
+            batches += [[group[j] for j in batch] for batch in group_batches]
+        return batches
+    order = sorted(range(len(lengths)), key=lengths.__getitem__)
+    if token_budget is None:
+        return [order[start : start + batch_size] for start in range(0, len(order), batch_size)]
+    batches = []
+    batch = []
+    for i in order:
+        # Prompts are sorted, so the new prompt is the longest one of the batch.
+        if batch and (len(batch) + 1) * (lengths[i] + max_new_tokens) > token_budget:
+            batches.append(batch)
+            batch = []
+        batch.append(i)
+    if batch:
+        batches.append(batch)
+    return batches
+
+
+def _batch_max_new_tokens(max_new_tokens: int | list[int], indices: list[int]) -> int:
+    if isinstance(max_new_tokens, int):
+        return max_new_tokens
+    return max(max_new_tokens[i] for i in indices)
+
+
+def load_tokenizer(model_name: str):
+    load_dotenv()
+    tokenizer = AutoTokenizer.from_pretrained(
+        model_name,
+        use_fast=True,
+        token=os.environ.get("HF_TOKEN"),
+    )
+    # Batched generation needs left padding so that all prompts end at the same position.
+    tokenizer.padding_side = "left"
+    if tokenizer.pad_token is None:
+        tokenizer.pad_token = tokenizer.eos_token
+    return tokenizer
+
+
+def _common_prefix_length(a: list[int], b: list[int]) -> int:
+    length = 0
+    for x, y in zip(a, b):
+        if x != y:
+            break
+        length += 1
+    return length
@@ -0,0 +1,159 @@
+import asyncio
+import os
+import random
+import threading
+from collections.abc import Iterator
+
+import httpx
+
+RETRY_STATUS_CODES = {408, 429, 500, 502, 503, 504}
+
+
+class OpenAIModel:
+    """Chat model served by an OpenAI-compatible chat-completions endpoint (e.g. vLLM or TGI).
+
+    Requests go through one pooled keep-alive connection pool and at most `max_concurrency` of
+    them are in flight at the same time. The client lives on a background event loop, so the
+    synchronous interface of `HFModel` can be offered on top of it.
+    """
+
+    def __init__(
+        self,
+        model_name: str,
+        api_base: str,
+        max_concurrency: int = 8,
+        max_retries: int = 5,
+        backoff_seconds: float = 1.0,
+        timeout_seconds: float = 600.0,
+    ):
+        self.model_name = model_name
+        self.max_concurrency = max_concurrency
+        self.max_retries = max_retries
+        self.backoff_seconds = backoff_seconds
+        api_key = os.environ.get("OPENAI_API_KEY")
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever, daemon=True)
+        self._thread.start()
+        self._client = self._run(
+            self._create_client(api_base, api_key, max_concurrency, timeout_seconds)
+        )
+        self._semaphore = self._run(self._create_semaphore(max_concurrency))
+
+    def generate_with_chat_template(
+        self,
+        messages: list[dict[str, str]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int,
+    ) -> str:
+        return self._run(
+            self._complete(messages, add_generation_prompt, continue_final_message, max_new_tokens)
+        )
+
+    def generate_batch_with_chat_template(
+        self,
+        chats: list[list[dict[str, str]]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int,
+        batch_size: int,
+    ) -> list[str]:
+        """Generate responses for many chats and return them in the order of `chats`."""
+        responses = []
+        for _, batch_responses in self.iter_generate_with_chat_template(
+            chats, add_generation_prompt, continue_final_message, max_new_tokens, batch_size
+        ):
+            responses.extend(batch_responses)
+        return responses
+
+    def iter_generate_with_chat_template(
+        self,
+        chats: list[list[dict[str, str]]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int | list[int],
+        batch_size: int,
+    ) -> Iterator[tuple[list[int], list[str]]]:
+        """Yield `(indices, responses)` for consecutive chunks of `batch_size` chats.
+
+        All requests are submitted at once and the connection limit keeps `max_concurrency` of
+        them in flight, so the server stays busy while earlier chunks are yielded in order.
+        `max_new_tokens` is either one cap for all chats or one per chat.
+        """
+        if isinstance(max_new_tokens, int):
+            max_new_tokens = [max_new_tokens] * len(chats)
+        futures = [
+            asyncio.run_coroutine_threadsafe(
+                self._complete(chat, add_generation_prompt, continue_final_message, max_tokens),
+                self._loop,
+            )
+            for chat, max_tokens in zip(chats, max_new_tokens)
+        ]
+        try:
+            for start in range(0, len(futures), batch_size):
+                indices = list(range(start, min(start + batch_size, len(futures))))
+                yield indices, [futures[i].result() for i in indices]
+        finally:
+            for future in futures:
+                future.cancel()
+
+    def close(self) -> None:
+        self._run(self._client.aclose())
+        self._loop.call_soon_threadsafe(self._loop.stop)
+        self._thread.join()
+
+    def _run(self, coroutine):
+        return asyncio.run_coroutine_threadsafe(coroutine, self._loop).result()
+
+    async def _create_client(
+        self, api_base: str, api_key: str | None, max_concurrency: int, timeout_seconds: float
+    ) -> httpx.AsyncClient:
+        return httpx.AsyncClient(
+            base_url=api_base,
+            headers={"Authorization": f"Bearer {api_key}"} if api_key else None,
+            limits=httpx.Limits(
+                max_connections=max_concurrency, max_keepalive_connections=max_concurrency
+            ),
+            timeout=timeout_seconds,
+        )
+
+    async def _create_semaphore(self, max_concurrency: int) -> asyncio.Semaphore:
+        return asyncio.Semaphore(max_concurrency)
+
+    async def _complete(
+        self,
+        messages: list[dict[str, str]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        max_new_tokens: int,
+    ) -> str:
+        payload = {
+            "model": self.model_name,
+            "messages": messages,
+            "max_tokens": max_new_tokens,
+            # vLLM extensions that mirror `apply_chat_template`, needed for the assistant prefill.
+            "add_generation_prompt": add_generation_prompt,
+            "continue_final_message": continue_final_message,
+        }
+        async with self._semaphore:
+            response = await self._post_with_retries("chat/completions", payload)
+        return response["choices"][0]["message"]["content"] or ""
+
+    async def _post_with_retries(self, url: str, payload: dict) -> dict:
+        for attempt in range(self.max_retries + 1):
+            try:
+                response = await self._client.post(url, json=payload)
+                if response.status_code not in RETRY_STATUS_CODES:
+                    response.raise_for_status()
+                    return response.json()
+                error = httpx.HTTPStatusError(
+                    f"Server returned {response.status_code}",
+                    request=response.request,
+                    response=response,
+                )
+            except httpx.TransportError as e:
+                error = e
+            if attempt == self.max_retries:
+                raise error
+            delay = self.backoff_seconds * 2**attempt
+            await asyncio.sleep(delay + random.uniform(0, delay))
@@ -0,0 +1,104 @@
+import queue
+import threading
+import time
+from collections import defaultdict
+from collections.abc import Callable, Iterator
+from contextlib import contextmanager
+
+_DONE = object()
+
+
+class StageTimer:
+    """Busy seconds per stage of a generation run, summed over the threads that run it.
+
+    The `wall` stage spans the whole run; the time in it that is not spent in `generate` is time
+    in which the accelerator waited for the CPU.
+    """
+
+    def __init__(self):
+        self.seconds = defaultdict(float)
+        self._lock = threading.Lock()
+
+    @contextmanager
+    def time(self, stage: str):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.seconds[stage] += time.perf_counter() - start
+
+    def report(self) -> str:
+        stages = ", ".join(
+            f"{stage} {seconds:.2f}s" for stage, seconds in self.seconds.items() if stage != "wall"
+        )
+        wall = self.seconds["wall"]
+        idle = max(wall - self.seconds["generate"], 0.0)
+        return f"Stage times: {stages}. Generation was idle for {idle:.2f}s of {wall:.2f}s."
+
+
+def prefetch(items: Iterator, maxsize: int) -> Iterator:
+    """Produce `items` in a background thread, at most `maxsize` ahead of the consumer."""
+    buffer = queue.Queue(maxsize=maxsize)
+    stop = threading.Event()
+
+    def produce():
+        try:
+            for item in items:
+                while not stop.is_set():
+                    try:
+                        buffer.put(item, timeout=0.1)
+                        break
+                    except queue.Full:
+                        continue
+                if stop.is_set():
+                    return
+            buffer.put(_DONE)
+        except BaseException as error:  # noqa: BLE001, re-raised by the consumer
+            buffer.put(error)
+
+    thread = threading.Thread(target=produce, daemon=True)
+    thread.start()
+    try:
+        while (item := buffer.get()) is not _DONE:
+            if isinstance(item, BaseException):
+                raise item
+            yield item
+    finally:
+        stop.set()
+
+
+class BackgroundWorker:
+    """Call `function` on submitted arguments in a background thread, in submission order.
+
+    At most `maxsize` calls wait in the queue, so that a slow worker throttles the producer
+    instead of buffering without bound. Errors are raised by the next `submit` or by `close`.
+    """
+
+    def __init__(self, function: Callable, maxsize: int):
+        self.function = function
+        self.queue = queue.Queue(maxsize=maxsize)
+        self.error: BaseException | None = None
+        self.thread = threading.Thread(target=self._work, daemon=True)
+        self.thread.start()
+
+    def submit(self, *args) -> None:
+        if self.error is not None:
+            raise self.error
+        self.queue.put(args)
+
+    def close(self) -> None:
+        self.queue.put(_DONE)
+        self.thread.join()
+        if self.error is not None:
+            raise self.error
+
+    def _work(self) -> None:
+        while (args := self.queue.get()) is not _DONE:
+            if self.error is not None:
+                # Keep draining, so that `submit` never blocks on a dead worker.
+                continue
+            try:
+                self.function(*args)
+            except BaseException as error:  # noqa: BLE001, re-raised by `submit` or `close`
+                self.error = error
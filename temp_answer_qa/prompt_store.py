@@ -0,0 +1,100 @@
+import hashlib
+import json
+from collections.abc import Sequence
+from pathlib import Path
+
+import numpy as np
+import pyarrow as pa
+
+from temp_answer_qa import DATA_DIR, Dataset, LastToken, Prompting, ToTSplit, TTQASplit
+
+PROMPT_STORE_DIR = DATA_DIR / "prompt_store"
+
+
+def prompt_store_path(
+    dataset: Dataset,
+    split: ToTSplit | TTQASplit,
+    model_name: str,
+    prompting: Prompting,
+    last_token: LastToken,
+    folder: Path | None = None,
+) -> Path:
+    folder = folder or PROMPT_STORE_DIR
+    return folder / f"{dataset}_{split}_{model_name.split('/')[-1]}_{prompting}_{last_token}.arrow"
+
+
+def chat_hash(chat: list[dict[str, str]]) -> str:
+    return hashlib.sha256(json.dumps(chat, sort_keys=True).encode()).hexdigest()
+
+
+def write_prompt_store(
+    path: Path,
+    rows: list[int],
+    chats: list[list[dict[str, str]]],
+    input_ids: list[list[int]],
+    metadata: dict,
+) -> None:
+    """Write tokenized chats to an Arrow IPC file with one record per dataset row."""
+    table = pa.table(
+        {
+            "row": pa.array(rows, type=pa.int64()),
+            "chat_hash": [chat_hash(chat) for chat in chats],
+            "input_ids": pa.array(input_ids, type=pa.list_(pa.int32())),
+            "length": pa.array([len(ids) for ids in input_ids], type=pa.int32()),
+        }
+    ).replace_schema_metadata({"prompt_store": json.dumps(metadata)})
+    path.parent.mkdir(parents=True, exist_ok=True)
+    # Written next to the target first, so that readers never map a half-written file.
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    with pa.OSFile(str(tmp_path), "wb") as sink, pa.ipc.new_file(sink, table.schema) as writer:
+        writer.write_table(table)
+    tmp_path.replace(path)
+
+
+class PromptStore:
+    """Memory-mapped view of a file written by `write_prompt_store`."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        with pa.memory_map(str(path)) as source:
+            self.table = pa.ipc.open_file(source).read_all()
+        self.metadata = json.loads(self.table.schema.metadata[b"prompt_store"])
+
+    def prompts(self, rows: list[int], chats: list[list[dict[str, str]]]) -> "TokenizedPrompts":
+        """Return the token ids of `rows`, checking that they were compiled from `chats`."""
+        positions = {row: i for i, row in enumerate(self.table["row"].to_pylist())}
+        hashes = self.table["chat_hash"].to_pylist()
+        selected = []
+        for row, chat in zip(rows, chats):
+            position = positions.get(int(row))
+            if position is None or hashes[position] != chat_hash(chat):
+                raise ValueError(
+                    f"{self.path} is stale: row {row} was not compiled from the current chat. "
+                    "Run compile-prompts again."
+                )
+            selected.append(position)
+        return TokenizedPrompts(
+            self.table["input_ids"].combine_chunks(), np.array(selected, dtype=np.int64)
+        )
+
+
+class TokenizedPrompts(Sequence):
+    """Token ids of selected rows, converted to lists only when a row is accessed."""
+
+    def __init__(self, input_ids: pa.ListArray, positions: np.ndarray):
+        self.input_ids = input_ids
+        self.positions = positions
+
+    def __len__(self) -> int:
+        return len(self.positions)
+
+    def __getitem__(self, i: int) -> list[int]:
+        return self.input_ids[int(self.positions[i])].values.to_numpy().tolist()
+
+    def select(self, indices: list[int]) -> "TokenizedPrompts":
+        return TokenizedPrompts(self.input_ids, self.positions[indices])
+
+    @property
+    def lengths(self) -> np.ndarray:
+        offsets = self.input_ids.offsets.to_numpy()
+        return offsets[self.positions + 1] - offsets[self.positions]
@@ -0,0 +1,127 @@
+import functools
+import hashlib
+from pathlib import Path
+
+import pandas as pd
+import pyarrow as pa
+import pyarrow.parquet as pq
+
+from temp_answer_qa import DATA_DIR, Dataset
+
+QUESTIONS_DIR = DATA_DIR / "questions"
+QUESTION_STORE_DIR = DATA_DIR / "question_store"
+CHECKSUM_KEY = b"source_sha256"
+# TTQA rows repeat the text of their Wikipedia table; it is stored once per table id.
+TABLE_ID_COLUMN = "table_id"
+TABLE_COLUMN = "table_context"
+
+
+def load_questions(
+    dataset: Dataset, split: str | None = None, columns: list[str] | None = None
+) -> pd.DataFrame:
+    """Read the questions of `dataset` from its Parquet store, keeping the CSV row numbers.
+
+    Only the rows of `split` and only `columns` are read. Table texts are not part of the
+    questions; `load_tables` maps their `table_id` to them. The store is rebuilt whenever the
+    checksum of the CSV changes, and loads are cached until the CSV is modified.
+    """
+    questions = _read(
+        *_store(dataset),
+        str(split) if split else None,
+        tuple(columns) if columns else None,
+    )
+    # Callers add columns to the frame, so the cached one is never handed out.
+    return questions.copy()
+
+
+def load_tables(dataset: Dataset) -> pd.Series:
+    """The text of every table of `dataset`, indexed by `table_id`. Do not modify it."""
+    return _read_tables(*_store(dataset))
+
+
+def _store(dataset: Dataset) -> tuple[Path, Path, int, int]:
+    csv_path = QUESTIONS_DIR / f"{dataset}.csv"
+    stat = csv_path.stat()
+    return csv_path, QUESTION_STORE_DIR / dataset, stat.st_mtime_ns, stat.st_size
+
+
+@functools.lru_cache(maxsize=32)
+def _read(
+    csv_path: Path,
+    store_dir: Path,
+    mtime_ns: int,
+    size: int,
+    split: str | None,
+    columns: tuple[str, ...] | None,
+) -> pd.DataFrame:
+    _build_store(csv_path, store_dir, mtime_ns, size)
+    table = pq.read_table(
+        store_dir / "questions.parquet",
+        columns=list(columns) if columns else None,
+        filters=[("split", "==", split)] if split else None,
+        memory_map=True,
+        use_pandas_metadata=True,
+    )
+    return table.to_pandas()
+
+
+@functools.lru_cache(maxsize=8)
+def _read_tables(csv_path: Path, store_dir: Path, mtime_ns: int, size: int) -> pd.Series:
+    _build_store(csv_path, store_dir, mtime_ns, size)
+    tables_path = store_dir / "tables.parquet"
+    if not tables_path.exists():
+        return pd.Series(dtype=object, name=TABLE_COLUMN)
+    tables = pq.read_table(tables_path, memory_map=True).to_pandas()
+    return tables.set_index(TABLE_ID_COLUMN)[TABLE_COLUMN]
+
+
+@functools.lru_cache(maxsize=8)
+def _build_store(csv_path: Path, store_dir: Path, mtime_ns: int, size: int) -> None:
+    """Convert `csv_path` into `store_dir` unless the store was built from the same content."""
+    checksum = hashlib.sha256(csv_path.read_bytes()).hexdigest().encode()
+    questions_path = store_dir / "questions.parquet"
+    if (
+        questions_path.exists()
+        and (pq.read_schema(questions_path).metadata or {}).get(CHECKSUM_KEY) == checksum
+    ):
+        return
+    questions = pd.read_csv(csv_path)
+    tables = None
+    if TABLE_COLUMN in questions:
+        tables = questions[[TABLE_ID_COLUMN, TABLE_COLUMN]].drop_duplicates()
+        if tables[TABLE_ID_COLUMN].duplicated().any():
+            raise ValueError(f"{csv_path} has different texts for the same {TABLE_ID_COLUMN}.")
+        questions = questions.drop(columns=TABLE_COLUMN)
+    store_dir.mkdir(parents=True, exist_ok=True)
+    if tables is not None:
+        _write(pa.Table.from_pandas(tables, preserve_index=False), store_dir / "tables.parquet")
+    # The index is stored as a column, so that filtered reads keep the CSV row numbers. The
+    # questions are written last, since their checksum marks the store as complete.
+    table = pa.Table.from_pandas(questions, preserve_index=True)
+    _write(
+        table.replace_schema_metadata({**table.schema.metadata, CHECKSUM_KEY: checksum}),
+        questions_path,
+    )
+
+
+def _write(table: pa.Table, path: Path) -> None:
+    tmp_path = path.with_name(f"{path.name}.tmp")
+    pq.write_table(table, tmp_path)
+    tmp_path.replace(path)
+
+
+def drop_table_texts(path: Path, tables: pd.Series) -> bool:
+    """Remove the table texts from the response CSV `path`, keeping their `table_id`.
+
+    Returns whether the file had table texts. Files whose texts differ from `tables` are left
+    unchanged and raise, so that no text is lost.
+    """
+    # Read every field as text, so that the other columns are written back byte for byte.
+    responses = pd.read_csv(path, dtype=str, keep_default_na=False)
+    if TABLE_COLUMN not in responses:
+        return False
+    expected = responses[TABLE_ID_COLUMN].astype(int).map(tables)
+    if not (responses[TABLE_COLUMN] == expected).all():
+        raise ValueError(f"{path} has table texts that differ from the question store.")
+    responses.drop(columns=TABLE_COLUMN).to_csv(path, index=False)
+    return True
@@ -0,0 +1,122 @@
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from pathlib import Path
+
+from temp_answer_qa import DATA_DIR
+
+CACHE_PATH = DATA_DIR / "cache/responses.sqlite"
+DEFAULT_MAX_SIZE_MB = 1024
+# Stay below SQLite's limit on the number of query parameters.
+QUERY_CHUNK_SIZE = 500
+
+
+class ResponseCache:
+    """On-disk cache of model responses, addressed by a hash of everything that shapes them.
+
+    Entries are evicted least recently used first once the stored responses exceed
+    `max_size_bytes`. Several processes, e.g. the workers of a sharded run, can share one cache.
+    One connection serves all threads, e.g. the background writer of a `--pipeline` run, one
+    call at a time.
+    """
+
+    def __init__(self, path: Path | None = None, max_size_bytes: int = DEFAULT_MAX_SIZE_MB * 2**20):
+        self.path = path or CACHE_PATH
+        self.max_size_bytes = max_size_bytes
+        self.hits = 0
+        self.misses = 0
+        self.path.parent.mkdir(parents=True, exist_ok=True)
+        self.connection = sqlite3.connect(self.path, timeout=60, check_same_thread=False)
+        self._lock = threading.Lock()
+        with self.connection:
+            self.connection.execute(
+                "CREATE TABLE IF NOT EXISTS responses ("
+                "key TEXT PRIMARY KEY, response TEXT NOT NULL, size INTEGER NOT NULL, "
+                "last_used REAL NOT NULL)"
+            )
+            self.connection.execute(
+                "CREATE INDEX IF NOT EXISTS responses_last_used ON responses (last_used)"
+            )
+
+    @staticmethod
+    def key(
+        model: str,
+        chat: list[dict[str, str]],
+        add_generation_prompt: bool,
+        continue_final_message: bool,
+        generation_params: dict,
+    ) -> str:
+        payload = json.dumps(
+            {
+                "model": model,
+                "chat": chat,
+                "add_generation_prompt": add_generation_prompt,
+                "continue_final_message": continue_final_message,
+                "generation_params": generation_params,
+            },
+            sort_keys=True,
+        )
+        return hashlib.sha256(payload.encode()).hexdigest()
+
+    def get_many(self, keys: list[str]) -> dict[str, str]:
+        """Return the cached responses of `keys` and mark them as recently used."""
+        found = {}
+        with self._lock:
+            for start in range(0, len(keys), QUERY_CHUNK_SIZE):
+                chunk = keys[start : start + QUERY_CHUNK_SIZE]
+                placeholders = ",".join("?" * len(chunk))
+                rows = self.connection.execute(
+                    f"SELECT key, response FROM responses WHERE key IN ({placeholders})", chunk
+                )
+                found.update(rows)
+            with self.connection:
+                self.connection.executemany(
+                    "UPDATE responses SET last_used = ? WHERE key = ?",
+                    [(time.time(), key) for key in found],
+                )
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def put_many(self, keys: list[str], responses: list[str]) -> None:
+        now = time.time()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT OR REPLACE INTO responses (key, response, size, last_used) "
+                "VALUES (?, ?, ?, ?)",
+                [
+                    (key, response, len(key) + len(response.encode()), now)
+                    for key, response in zip(keys, responses)
+                ],
+            )
+
+    def size_bytes(self) -> int:
+        with self._lock:
+            return self.connection.execute(
+                "SELECT COALESCE(SUM(size), 0) FROM responses"
+            ).fetchone()[0]
+
+    def prune(self, max_size_bytes: int | None = None) -> int:
+        """Evict the least recently used entries until the cache fits; return how many."""
+        if max_size_bytes is None:
+            max_size_bytes = self.max_size_bytes
+        excess = self.size_bytes() - max_size_bytes
+        evicted = []
+        with self._lock:
+            if excess > 0:
+                for key, size in self.connection.execute(
+                    "SELECT key, size FROM responses ORDER BY last_used, key"
+                ):
+                    if excess <= 0:
+                        break
+                    evicted.append((key,))
+                    excess -= size
+            with self.connection:
+                self.connection.executemany("DELETE FROM responses WHERE key = ?", evicted)
+        return len(evicted)
+
+    def close(self) -> None:
+        with self._lock:
+            self.connection.close()
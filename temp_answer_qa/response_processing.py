@@ -2,15 +2,140 @@ import ast
 import json
 import re
 import warnings
+from collections import defaultdict
 from datetime import timedelta
 
-import datefinder
+import numpy as np
 import pandas as pd
 
 from temp_answer_qa import LastToken
+from temp_answer_qa.date_extraction import find_first_dates, first_date
+from temp_answer_qa.typed_values import assign_typed, row_applied_series, to_typed
+
+try:
+    import orjson
+except ImportError:  # Optional, see the `fast` extra.
+    orjson = None
+
+# Marks values that a batched cast does not cover; they are cast one by one.
+_FALLBACK = object()
+# Integers that `int` parses and that cannot overflow a timedelta of hours.
+_SMALL_INT_REGEX = re.compile(r"[+-]?[0-9]{1,9}")
+_DIGITS_REGEX = re.compile(r"[0-9]+")
+_ERA_REGEX = re.compile(r"([0-9]+) ?(AD|BC)")
+# orjson reads integers beyond 64 bits as floats, `json` keeps them exact.
+_LONG_NUMBER_REGEX = re.compile(r"[0-9]{19}")
+# Decimal strings that fit into an int64.
+_INT64_REGEX = re.compile(r"[0-9]{1,18}")
+# Date shapes and the formats that `pd.to_datetime` infers for them with `dayfirst=False`, in the
+# order it prefers them. Values that match none of their formats are parsed one by one.
+_DATE_FORMATS = {
+    re.compile(r"[0-9]{2}/[0-9]{2}/[0-9]{4}"): ["%m/%d/%Y", "%d/%m/%Y"],
+    re.compile(r"[0-9]{2}-[0-9]{2}-[0-9]{4}"): ["%m-%d-%Y", "%d-%m-%Y"],
+    re.compile(r"[0-9]{4}-[0-9]{2}-[0-9]{2}"): ["%Y-%m-%d"],
+    re.compile(r"[A-Z][a-z]+ [0-9]{1,2}, [0-9]{4}"): ["%B %d, %Y", "%b %d, %Y"],
+    re.compile(r"[0-9]{1,2} [A-Z][a-z]+, [0-9]{4}"): ["%d %B, %Y", "%d %b, %Y"],
+}
+_SECONDS = {"days": 86400, "hours": 3600, "minutes": 60, "seconds": 1}
+
+
+def _completes_on(chars: str):
+    """Mark an `is_complete` method whose response can only become complete with a token that
+    contains one of `chars`; generation then only checks it after such tokens."""
+
+    def decorate(is_complete):
+        is_complete.completes_on = chars
+        return is_complete
+
+    return decorate
+
+
+def tot_process_response(
+    responses: pd.DataFrame,
+    last_token: LastToken,
+    labels: pd.DataFrame | None = None,
+    infer_dtypes: bool = True,
+    typed: bool = False,
+) -> pd.DataFrame:
+    """Parse the ToT responses and labels and cast them to time-aware numeric objects.
+
+    Works on whole columns and gives the same result as `tot_process_response_rowwise`. Labels
+    are taken from `labels`, as `tot_parse_labels` returns them; those it lacks are parsed here.
+    Without `infer_dtypes`, the new columns are object columns of the parsed values, whichever
+    rows are processed together. With `typed`, `response_numeric` and `label_numeric` are
+    typed values, as `assign_typed` stores them.
+    """
+    tot_json_parser = ToTJSONParser(last_token=last_token)
+    tot_resp2num = ToTResponseToNumericObj()
+    response_json = tot_json_parser.model_responses_to_json(responses["response"])
+    response_json_wo_explanation = [
+        tot_json_parser.remove_explanation_from_json(response) for response in response_json
+    ]
+    parsed_labels = _lookup_labels(responses["label"], labels, tot_parse_labels)
+    return responses.assign(
+        response_json=_applied_series(response_json, responses.index, infer_dtypes),
+        response_json_wo_explanation=_applied_series(
+            response_json_wo_explanation, responses.index, infer_dtypes
+        ),
+        label_json=_applied_series(parsed_labels["label_json"], responses.index, infer_dtypes),
+    ).pipe(
+        _assign_numeric,
+        typed,
+        response_numeric=_applied_series(
+            tot_resp2num.cast_responses_to_numeric(response_json_wo_explanation),
+            responses.index,
+            infer_dtypes,
+        ),
+        label_numeric=_applied_series(
+            parsed_labels["label_numeric"], responses.index, infer_dtypes
+        ),
+    )
+
+
+def tot_parse_labels(labels: pd.Series) -> pd.DataFrame:
+    """The `label_json` and `label_numeric` of every distinct ToT label, indexed by the label."""
+    labels = labels.drop_duplicates()
+    label_json = [ast.literal_eval(label) for label in labels]
+    return pd.DataFrame(
+        {
+            "label_json": pd.Series(label_json, dtype=object),
+            "label_numeric": pd.Series(
+                ToTResponseToNumericObj().cast_responses_to_numeric(label_json), dtype=object
+            ),
+        }
+    ).set_axis(pd.Index(labels, name="label"))
+
+
+def _lookup_labels(
+    keys: pd.Series | pd.DataFrame, labels: pd.DataFrame | None, parse
+) -> dict[str, list]:
+    """The columns of `labels` for every row of `keys`, parsing the keys that it lacks."""
+    if labels is None:
+        labels = parse(keys)
+    key_index = pd.MultiIndex.from_frame(keys) if isinstance(keys, pd.DataFrame) else keys
+    positions = labels.index.get_indexer(key_index)
+    if (positions < 0).any():
+        labels = pd.concat([labels, parse(keys[positions < 0])])
+        positions = labels.index.get_indexer(key_index)
+    return {column: labels[column].to_numpy()[positions].tolist() for column in labels}
+
 
+def _assign_numeric(responses: pd.DataFrame, typed: bool, **columns: pd.Series) -> pd.DataFrame:
+    if not typed:
+        return responses.assign(**columns)
+    for name, values in columns.items():
+        responses = assign_typed(responses, name, to_typed(values))
+    return responses
 
-def tot_process_response(responses: pd.DataFrame, last_token: LastToken) -> pd.DataFrame:
+
+def _applied_series(values: list, index: pd.Index, infer_dtype: bool = True) -> pd.Series:
+    # With the dtype that `Series.apply` infers for the same values.
+    series = pd.Series(values, index=index, dtype=object)
+    return series.infer_objects() if infer_dtype else series
+
+
+def tot_process_response_rowwise(responses: pd.DataFrame, last_token: LastToken) -> pd.DataFrame:
+    """`tot_process_response` one row at a time, as a reference for tests and benchmarks."""
     tot_json_parser = ToTJSONParser(last_token=last_token)
     tot_resp2num = ToTResponseToNumericObj()
     return responses.assign(
@@ -32,6 +157,39 @@ class ToTJSONParser:
     def __init__(self, last_token: LastToken):
         self.last_token = last_token
         self.json_regex = re.compile(r"({\"explanation\"\s*:.*})", flags=re.DOTALL)
+        self.json_start_regex = re.compile(r"{\"explanation\"\s*:")
+
+    @_completes_on("}")
+    def is_complete(self, model_response: str) -> bool:
+        """Whether the JSON object that `json_regex` extracts has been closed.
+
+        Used to stop generation early; braces inside JSON strings are ignored.
+        """
+        if self.last_token == LastToken.continue_final_message:
+            model_response = self._restore_json_in_model_response(model_response)
+        match = self.json_start_regex.search(model_response)
+        if not match:
+            return False
+        depth = 0
+        in_string = False
+        escaped = False
+        for char in model_response[match.start() :]:
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif char == "\\":
+                    escaped = True
+                elif char == '"':
+                    in_string = False
+            elif char == '"':
+                in_string = True
+            elif char == "{":
+                depth += 1
+            elif char == "}":
+                depth -= 1
+                if depth == 0:
+                    return True
+        return False
 
     def label_to_json(self, label: str) -> dict:
         return ast.literal_eval(label)
@@ -43,6 +201,15 @@ class ToTJSONParser:
         else:
             return None
 
+    def model_responses_to_json(self, model_responses: pd.Series) -> list[dict | None]:
+        """`model_response_to_json` for a whole column of responses."""
+        if self.last_token == LastToken.continue_final_message:
+            model_responses = ('{"explanation":' + model_responses).str.strip()
+        extracted = model_responses.str.replace("\n", " ", regex=False).str.extract(
+            self.json_regex, expand=False
+        )
+        return [_loads(text) if isinstance(text, str) else None for text in extracted]
+
     def _fix_model_response(self, model_response: str) -> str | None:
         if self.last_token == LastToken.continue_final_message:
             model_response = self._restore_json_in_model_response(model_response)
@@ -79,33 +246,110 @@ class ToTJSONParser:
 
 
 class ToTResponseToNumericObj:
+    def answer_schema(self, keys) -> str | None:
+        """The kind of answer that a response with `keys` holds."""
+        if "age" in keys:
+            return "age"
+        elif "date" in keys:
+            return "date"
+        elif "answer" in keys:
+            return "answer"
+        elif (
+            {"A", "B", "C"} == keys
+            or {"X", "Y", "Z"} == keys
+            or {"H", "M", "S"} == keys
+            or {"hours", "minutes", "seconds"}.issuperset(keys)
+        ):
+            return "seconds"
+        elif {"time", "day"}.issubset(keys) or {"days", "hours", "minutes", "seconds"}.issubset(
+            keys
+        ):
+            return "timezone"
+        else:
+            return None
+
     def cast_response_to_numeric(self, response: dict):
         try:
-            if {"age"}.issubset(response.keys()):
+            schema = self.answer_schema(response.keys())
+            if schema == "age":
                 return self._cast_age_response(response["age"])
-            elif {"date"}.issubset(response.keys()):
+            elif schema == "date":
                 return self._cast_date_response(response["date"])
-            elif {"answer"}.issubset(response.keys()):
+            elif schema == "answer":
                 return self._cast_unspecified_response(response["answer"])
-            elif (
-                {"A", "B", "C"} == response.keys()
-                or {"X", "Y", "Z"} == response.keys()
-                or {"H", "M", "S"} == response.keys()
-                or {"hours", "minutes", "seconds"}.issuperset(response.keys())
-            ):
+            elif schema == "seconds":
                 return self._cast_seconds_response(response)
-            elif {"time", "day"}.issubset(response.keys()) or {
-                "days",
-                "hours",
-                "minutes",
-                "seconds",
-            }.issubset(response.keys()):
+            elif schema == "timezone":
                 return self._cast_timezone(response)
             else:
-                None
+                return None
         except (pd._libs.tslibs.parsing.DateParseError, ValueError, AttributeError):
             return None
 
+    def cast_responses_to_numeric(self, responses: list) -> list:
+        """`cast_response_to_numeric` for many responses.
+
+        Responses with the same keys are cast together, dates with one `pd.to_datetime` call per
+        format. Values that these batched casts do not cover are cast one by one.
+        """
+        numeric = [None] * len(responses)
+        groups = defaultdict(list)
+        for position, response in enumerate(responses):
+            if isinstance(response, dict):
+                groups[tuple(response)].append(position)
+        for keys, positions in groups.items():
+            group = [responses[position] for position in positions]
+            cast = self._cast_batch(self.answer_schema(set(keys)), keys, group)
+            for position, value in zip(positions, cast):
+                numeric[position] = (
+                    self.cast_response_to_numeric(responses[position])
+                    if value is _FALLBACK
+                    else value
+                )
+        return numeric
+
+    def _cast_batch(self, schema: str | None, keys: tuple, group: list[dict]) -> list:
+        if schema == "age":
+            return [_small_int(response["age"]) for response in group]
+        elif schema == "date":
+            return _cast_dates([response["date"] for response in group])
+        elif schema == "answer":
+            return self._cast_unspecified_responses([response["answer"] for response in group])
+        elif schema == "seconds":
+            # Values are taken as hours, minutes and seconds in the order of their keys.
+            units = ["hours", "minutes", "seconds"][: len(keys)]
+            return _cast_timedeltas([list(response.values()) for response in group], units)
+        elif schema == "timezone" and "time" in keys and "day" in keys:
+            rows = []
+            for response in group:
+                day = str(response["day"]).replace("same_day", "0").replace("previous_day", "-1")
+                time = response["time"].split(":") if isinstance(response["time"], str) else []
+                # Missing minutes and seconds are zero.
+                rows.append([day, *time, *["0"] * (3 - len(time))] if time else [_FALLBACK])
+            return _cast_timedeltas(rows, ["days", "hours", "minutes", "seconds"])
+        elif schema == "timezone" and set(keys) == _SECONDS.keys():
+            return _cast_timedeltas([list(response.values()) for response in group], list(keys))
+        elif schema is None:
+            return [None] * len(group)
+        return [_FALLBACK] * len(group)
+
+    def _cast_unspecified_responses(self, responses: list) -> list:
+        numeric = [_FALLBACK] * len(responses)
+        dates = []
+        for position, response in enumerate(responses):
+            if type(response) is int:
+                numeric[position] = response
+            elif isinstance(response, str) and _DIGITS_REGEX.fullmatch(response):
+                numeric[position] = int(response)
+            elif isinstance(response, str) and (match := _ERA_REGEX.fullmatch(response)):
+                year = int(match[1])
+                numeric[position] = -year if match[2] == "BC" else year
+            elif isinstance(response, str):
+                dates.append(position)
+        for position, date in zip(dates, _cast_dates([responses[i] for i in dates])):
+            numeric[position] = date
+        return numeric
+
     def _cast_age_response(self, response):
         return int(response)
 
@@ -149,7 +393,131 @@ class ToTResponseToNumericObj:
             return timedelta(**response_mapped)
 
 
-def ttqa_process_response(responses: pd.DataFrame) -> pd.DataFrame:
+def _loads(text: str) -> dict | None:
+    if orjson is not None and not _LONG_NUMBER_REGEX.search(text):
+        try:
+            return orjson.loads(text)
+        except orjson.JSONDecodeError:
+            # `json` is more lenient, e.g. with NaN, Infinity and lone surrogates.
+            pass
+    try:
+        return json.loads(text)
+    except json.JSONDecodeError:
+        return None
+
+
+def _small_int(value):
+    if type(value) in (int, float) and abs(value) < 10**9:
+        return int(value)
+    if isinstance(value, str) and _SMALL_INT_REGEX.fullmatch(value):
+        return int(value)
+    return _FALLBACK
+
+
+def _cast_dates(values: list) -> list:
+    """`pd.to_datetime` of the values of known shapes, in one call per format."""
+    dates = [_FALLBACK] * len(values)
+    positions_by_shape = defaultdict(list)
+    for position, value in enumerate(values):
+        if isinstance(value, str):
+            for regex in _DATE_FORMATS:
+                if regex.fullmatch(value):
+                    positions_by_shape[regex].append(position)
+                    break
+    for regex, positions in positions_by_shape.items():
+        for date_format in _DATE_FORMATS[regex]:
+            parsed = pd.to_datetime(
+                [values[position] for position in positions], format=date_format, errors="coerce"
+            )
+            unparsed = []
+            for position, date in zip(positions, parsed):
+                if pd.isna(date):
+                    unparsed.append(position)
+                else:
+                    dates[position] = date
+            positions = unparsed
+            if not positions:
+                break
+    # Values that no format parses are left to the fallback, which handles their errors.
+    return dates
+
+
+def _cast_ints(values: list) -> list:
+    """`int` of the decimal strings among `values`, in one conversion."""
+    ints = [_FALLBACK] * len(values)
+    positions = [
+        position
+        for position, value in enumerate(values)
+        if isinstance(value, str) and _INT64_REGEX.fullmatch(value)
+    ]
+    converted = np.array([values[position] for position in positions], dtype=str).astype(np.int64)
+    for position, value in zip(positions, converted.tolist()):
+        ints[position] = value
+    return ints
+
+
+def _cast_timedeltas(rows: list[list], units: list[str]) -> list:
+    """A timedelta of the integer values of every row, each in the unit at its position."""
+    values = [[_small_int(value) for value in row] for row in rows]
+    castable = [len(row) == len(units) and _FALLBACK not in row for row in values]
+    castable_values = [row for row, ok in zip(values, castable) if ok]
+    seconds = np.array(castable_values, dtype=np.int64).reshape(
+        len(castable_values), len(units)
+    ) @ np.array([_SECONDS[unit] for unit in units])
+    deltas = iter(seconds.tolist())
+    return [timedelta(seconds=next(deltas)) if ok else _FALLBACK for ok in castable]
+
+
+def ttqa_process_response(
+    responses: pd.DataFrame,
+    labels: pd.DataFrame | None = None,
+    infer_dtypes: bool = True,
+    typed: bool = False,
+) -> pd.DataFrame:
+    """Extract the TTQA answers and cast them and the labels to numeric objects.
+
+    Works on the rows of every answer format at once and gives the same result as
+    `ttqa_process_response_rowwise`. Labels are taken from `labels`, as `ttqa_parse_labels`
+    returns them; those it lacks are cast here. Without `infer_dtypes`, the new columns are
+    object columns of the extracted and cast values, whichever rows are processed together.
+    With `typed`, `response_numeric` and `label_numeric` are typed values, as `assign_typed`
+    stores them.
+    """
+    ttqa_json_parser = TTQAResponseParser()
+    ttqa_resp2num = TTQAResponseToNumericObj()
+    response_extracted = row_applied_series(
+        ttqa_json_parser.extract_responses(responses["response"], responses["answer_format"]),
+        responses.index,
+        infer_dtypes,
+    )
+    # The row-wise path casts the extracted answers as a row of the frame holds them.
+    response_numeric = ttqa_resp2num.cast_responses_to_numeric(
+        list(response_extracted.astype(object)), list(responses["answer_format"])
+    )
+    parsed_labels = _lookup_labels(responses[["label", "answer_format"]], labels, ttqa_parse_labels)
+    return responses.assign(response_extracted=response_extracted).pipe(
+        _assign_numeric,
+        typed,
+        response_numeric=row_applied_series(response_numeric, responses.index, infer_dtypes),
+        label_numeric=row_applied_series(
+            parsed_labels["label_numeric"], responses.index, infer_dtypes
+        ),
+    )
+
+
+def ttqa_parse_labels(labels: pd.DataFrame) -> pd.DataFrame:
+    """The `label_numeric` of every distinct TTQA `label` and `answer_format`, indexed by both."""
+    labels = labels[["label", "answer_format"]].drop_duplicates()
+    label_numeric = TTQAResponseToNumericObj().cast_responses_to_numeric(
+        list(labels["label"]), list(labels["answer_format"])
+    )
+    return pd.DataFrame({"label_numeric": pd.Series(label_numeric, dtype=object)}).set_axis(
+        pd.MultiIndex.from_frame(labels)
+    )
+
+
+def ttqa_process_response_rowwise(responses: pd.DataFrame) -> pd.DataFrame:
+    """`ttqa_process_response` one row at a time, as a reference for tests and benchmarks."""
     ttqa_json_parser = TTQAResponseParser()
     ttqa_resp2num = TTQAResponseToNumericObj()
     return responses.assign(
@@ -172,6 +540,7 @@ def ttqa_process_response(responses: pd.DataFrame) -> pd.DataFrame:
 
 class TTQAResponseParser:
     def __init__(self):
+        self.final_answer_line_regex = re.compile(r"Final Answer:[^\n]*\S[^\n]*\n")
         self._EXTRACTION_FUNCTIONS = {
             "<num_years>": self._extract_num_years,
             "yyyy": self._extract_yyyy,
@@ -179,6 +548,17 @@ class TTQAResponseParser:
             "<num_days>": self._extract_num_days,
             "<num_months>": self._extract_num_months,
         }
+        self.final_answer_int_regex = re.compile(r"Final Answer:.*?(\d+)")
+        self.final_answer_yyyy_regex = re.compile(r"Final Answer:.*?(\d{4})")
+        self.final_answer_regex = re.compile("Final Answer:(.*)")
+        # Kernels that extract the answers of a whole column of responses.
+        self._COLUMN_EXTRACTION_FUNCTIONS = {
+            "<num_years>": self._extract_int_column,
+            "yyyy": self._extract_yyyy_column,
+            "%B %d, %Y": self._extract_date_column,
+            "<num_days>": self._extract_int_column,
+            "<num_months>": self._extract_int_column,
+        }
 
     def extract_response(self, model_response, answer_format):
         if pd.isna(model_response) or pd.isna(answer_format):
@@ -188,6 +568,31 @@ class TTQAResponseParser:
         func = self._EXTRACTION_FUNCTIONS.get(answer_format)
         return func(model_response)
 
+    def extract_responses(self, model_responses: pd.Series, answer_formats: pd.Series) -> list:
+        """`extract_response` for whole columns, with one kernel call per answer format."""
+        formats = answer_formats.to_numpy()
+        valid = (model_responses.notna() & answer_formats.notna()).to_numpy()
+        unknown = valid & ~answer_formats.isin(self._COLUMN_EXTRACTION_FUNCTIONS.keys()).to_numpy()
+        if unknown.any():
+            raise ValueError(
+                f"No extraction function defined for format: {formats[unknown.argmax()]}"
+            )
+        extracted = [None] * len(model_responses)
+        for answer_format in pd.unique(formats[valid]):
+            positions = np.flatnonzero(valid & (formats == answer_format))
+            kernel = self._COLUMN_EXTRACTION_FUNCTIONS[answer_format]
+            for position, value in zip(positions, kernel(model_responses.iloc[positions])):
+                extracted[position] = value
+        return extracted
+
+    @_completes_on("\n")
+    def is_complete(self, model_response: str) -> bool:
+        """Whether the response contains a finished, non-empty `Final Answer:` line.
+
+        Used to stop generation early; the extraction only looks at that line.
+        """
+        return self.final_answer_line_regex.search(model_response) is not None
+
     def _try_extract_int_after_final_answer(self, model_response):
         match = re.search(r"Final Answer:.*?(\d+)", model_response)
         if match:
@@ -215,11 +620,19 @@ class TTQAResponseParser:
         match = re.search("Final Answer:(.*)", model_response)
         if not match:
             return None
-        final_answer = match[1]
-        try:
-            return next(datefinder.find_dates(final_answer))
-        except StopIteration:
-            return None
+        return first_date(match[1])
+
+    def _extract_int_column(self, model_responses: pd.Series) -> list:
+        extracted = model_responses.str.extract(self.final_answer_int_regex, expand=False)
+        return [answer if isinstance(answer, str) else None for answer in extracted]
+
+    def _extract_yyyy_column(self, model_responses: pd.Series) -> list:
+        extracted = model_responses.str.extract(self.final_answer_yyyy_regex, expand=False)
+        return [answer if isinstance(answer, str) else None for answer in extracted]
+
+    def _extract_date_column(self, model_responses: pd.Series) -> list:
+        final_answers = model_responses.str.extract(self.final_answer_regex, expand=False)
+        return find_first_dates(final_answers)
 
 
 class TTQAResponseToNumericObj:
@@ -240,6 +653,34 @@ class TTQAResponseToNumericObj:
         except pd.errors.OutOfBoundsDatetime:
             return None
 
+    def cast_responses_to_numeric(self, responses: list, answer_formats: list) -> list:
+        """`cast_response_to_numeric` for many responses, in one batch per answer format.
+
+        Values that the batched casts do not cover are cast one by one.
+        """
+        numeric = [None] * len(responses)
+        positions_by_format = defaultdict(list)
+        for position, (response, answer_format) in enumerate(zip(responses, answer_formats)):
+            if not (pd.isna(response) or pd.isna(answer_format)):
+                positions_by_format[answer_format].append(position)
+        for answer_format, positions in positions_by_format.items():
+            group = [responses[position] for position in positions]
+            if ("<num_" in answer_format) or (answer_format == "yyyy"):
+                cast = _cast_ints(group)
+            elif answer_format == r"%B %d, %Y":
+                # Datefinder already returns datetime objects, which are kept.
+                dates = iter(_cast_dates([value for value in group if isinstance(value, str)]))
+                cast = [next(dates) if isinstance(value, str) else value for value in group]
+            else:
+                cast = [None] * len(group)
+            for position, value in zip(positions, cast):
+                numeric[position] = (
+                    self.cast_response_to_numeric(responses[position], answer_format)
+                    if value is _FALLBACK
+                    else value
+                )
+        return numeric
+
     def _cast_numeric_response(self, response: str):
         if response:
             try:
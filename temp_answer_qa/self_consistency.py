@@ -0,0 +1,56 @@
+from collections.abc import Callable
+
+import pandas as pd
+
+from temp_answer_qa import Aggregation
+
+
+def aggregate_samples(
+    responses: pd.DataFrame,
+    response_to_digit: Callable | None = None,
+    aggregation: Aggregation = Aggregation.majority,
+) -> pd.DataFrame:
+    """Keep one sampled response per question, chosen by its numeric answer.
+
+    `responses` holds the processed responses of a `--num-samples` run: the samples of a question
+    are consecutive rows numbered by `sample` from 0. Answers are compared as the numbers that
+    `response_to_digit` maps them to, e.g. seconds for durations and timestamps for dates, or as
+    the `response_digit` of measured responses without it.
+    `majority` keeps a sample with the most frequent answer, `median` the sample closest to the
+    median answer; ties go to the lowest sample number. Samples without a numeric answer only
+    win when no sample of the question has one. The result has the columns of `responses`
+    without `sample`, so it can go straight into the error measurement.
+    """
+    samples = responses.reset_index(drop=True).assign(
+        _question=lambda df: (df["sample"] == 0).cumsum(),
+        _digit=lambda df: pd.to_numeric(_digits(df, response_to_digit), errors="coerce"),
+    )
+    if aggregation == Aggregation.majority:
+        votes = samples.groupby(["_question", "_digit"])["_digit"].transform("size")
+        # Sorting by negated votes keeps missing answers, which have no votes, last.
+        samples = samples.assign(_rank=-votes)
+    elif aggregation == Aggregation.median:
+        median = samples.groupby("_question")["_digit"].transform("median")
+        samples = samples.assign(_rank=(samples["_digit"] - median).abs())
+    else:
+        raise ValueError(f"Unknown aggregation: {aggregation}")
+    return (
+        samples.sort_values(["_question", "_rank", "sample"], na_position="last", kind="stable")
+        .drop_duplicates("_question")
+        .sort_values("_question")
+        .drop(columns=["_question", "_digit", "_rank", "sample"])
+        .reset_index(drop=True)
+    )
+
+
+def _digits(samples: pd.DataFrame, response_to_digit: Callable | None) -> pd.Series:
+    if response_to_digit is None:
+        return samples["response_digit"].astype(object)
+    return pd.Series(
+        [
+            response_to_digit(response, unit)
+            for response, unit in zip(samples["response_numeric"], samples["answer_temporal_unit"])
+        ],
+        index=samples.index,
+        dtype=object,
+    )
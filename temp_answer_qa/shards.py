@@ -0,0 +1,67 @@
+import re
+from pathlib import Path
+
+import pandas as pd
+
+ROW_COLUMN = "row"
+SAMPLE_COLUMN = "sample"
+
+
+def shard_path(output_path: Path, num_shards: int, shard_index: int) -> Path:
+    return output_path.with_name(f"{output_path.stem}.shard-{shard_index}-of-{num_shards}.csv")
+
+
+def select_shard(dataset: pd.DataFrame, num_shards: int, shard_index: int) -> pd.DataFrame:
+    """Return every `num_shards`-th row starting at `shard_index`, tagged with its position.
+
+    Interleaving keeps the prompt length distribution of all shards alike.
+    """
+    if not 0 <= shard_index < num_shards:
+        raise ValueError(f"Shard index {shard_index} is not in [0, {num_shards}).")
+    dataset = dataset.copy()
+    dataset.insert(0, ROW_COLUMN, range(len(dataset)))
+    return dataset.iloc[shard_index::num_shards]
+
+
+def merge_shards(output_path: Path) -> pd.DataFrame:
+    """Combine the shard files of `output_path` into the canonical response CSV."""
+    pattern = re.compile(rf"{re.escape(output_path.stem)}\.shard-(\d+)-of-(\d+)\.csv")
+    shards = {}
+    for path in output_path.parent.glob(f"{output_path.stem}.shard-*-of-*.csv"):
+        match = pattern.fullmatch(path.name)
+        if match:
+            shards[(int(match[1]), int(match[2]))] = path
+    if not shards:
+        raise FileNotFoundError(f"No shards found for {output_path}")
+    shard_counts = {num_shards for _, num_shards in shards}
+    if len(shard_counts) > 1:
+        raise ValueError(
+            f"Shards of {output_path} disagree on the number of shards: {shard_counts}"
+        )
+    num_shards = shard_counts.pop()
+    missing = [i for i in range(num_shards) if (i, num_shards) not in shards]
+    if missing:
+        raise FileNotFoundError(f"Missing shards {missing} of {num_shards} for {output_path}")
+
+    # Read every field as text, so that the merged file matches an unsharded run byte for byte.
+    merged = pd.concat(
+        [
+            pd.read_csv(shards[(i, num_shards)], dtype=str, keep_default_na=False)
+            for i in range(num_shards)
+        ],
+        ignore_index=True,
+    )
+    # Runs with --num-samples write one line per sample of a row.
+    keys = pd.DataFrame(
+        {
+            ROW_COLUMN: merged[ROW_COLUMN].astype(int),
+            SAMPLE_COLUMN: merged[SAMPLE_COLUMN].astype(int) if SAMPLE_COLUMN in merged else 0,
+        }
+    )
+    merged = merged.iloc[keys.sort_values([ROW_COLUMN, SAMPLE_COLUMN], kind="stable").index]
+    rows = keys[ROW_COLUMN]
+    if sorted(set(rows)) != list(range(rows.nunique())) or keys.duplicated().any():
+        raise ValueError(f"Shards of {output_path} do not cover every row exactly once.")
+    merged = merged.drop(columns=ROW_COLUMN)
+    merged.to_csv(output_path, index=False)
+    return merged
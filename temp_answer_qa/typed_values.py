@@ -0,0 +1,213 @@
+import datetime as dt
+from collections.abc import Iterable
+from enum import StrEnum
+
+import numpy as np
+import pandas as pd
+
+
+class Kind(StrEnum):
+    """The type of a numeric answer; pandas and Python time types are told apart."""
+
+    none = "none"
+    int = "int"
+    float = "float"
+    timedelta = "timedelta"
+    Timedelta = "Timedelta"
+    datetime = "datetime"
+    Timestamp = "Timestamp"
+    # Anything else, e.g. lists, dicts, NaT and values beyond the typed columns, kept as is.
+    object = "object"
+
+
+KINDS = {
+    type(None): Kind.none,
+    int: Kind.int,
+    float: Kind.float,
+    dt.timedelta: Kind.timedelta,
+    pd.Timedelta: Kind.Timedelta,
+    dt.datetime: Kind.datetime,
+    pd.Timestamp: Kind.Timestamp,
+}
+KIND_DTYPE = pd.CategoricalDtype(list(Kind))
+# The codes of the kinds in `KIND_DTYPE`, on which the typed columns are split.
+CODES = {kind: code for code, kind in enumerate(Kind)}
+_TYPE_CODES = {value_type: CODES[kind] for value_type, kind in KINDS.items()}
+# The column that holds the values of each kind.
+VALUE_COLUMNS = {
+    Kind.int: "int",
+    Kind.float: "float",
+    Kind.timedelta: "timedelta",
+    Kind.Timedelta: "timedelta",
+    Kind.datetime: "datetime",
+    Kind.Timestamp: "datetime",
+    Kind.object: "object",
+}
+# The columns of `to_typed`, which a frame holds as `<name>.<field>` for typed values of `name`.
+TYPED_FIELDS = ["kind", "int", "float", "timedelta", "datetime", "object"]
+NAT = np.iinfo(np.int64).min
+_INT64_BOUNDS = (NAT, np.iinfo(np.int64).max)
+# The whole microseconds that nanosecond columns hold; Python time types have no nanoseconds.
+_TIMEDELTA_BOUNDS = (
+    pd.Timedelta.min.ceil("us").to_pytimedelta(),
+    pd.Timedelta.max.floor("us").to_pytimedelta(),
+)
+_DATETIME_BOUNDS = (
+    pd.Timestamp.min.ceil("us").to_pydatetime(),
+    pd.Timestamp.max.floor("us").to_pydatetime(),
+)
+_MICROSECOND = dt.timedelta(microseconds=1)
+# Whether a value of a kind fits into its typed column. pandas values of other units than
+# nanoseconds behave differently beyond the nanosecond range, so they are kept as objects.
+_FITS = {
+    Kind.int: lambda value: _INT64_BOUNDS[0] <= value <= _INT64_BOUNDS[1],
+    Kind.float: lambda value: True,
+    Kind.timedelta: lambda value: _TIMEDELTA_BOUNDS[0] <= value <= _TIMEDELTA_BOUNDS[1],
+    Kind.Timedelta: lambda value: value.unit == "ns" and value.nanoseconds == 0,
+    Kind.datetime: lambda value: (
+        value.tzinfo is None and _DATETIME_BOUNDS[0] <= value <= _DATETIME_BOUNDS[1]
+    ),
+    Kind.Timestamp: lambda value: (
+        value.unit == "ns" and value.tzinfo is None and value.nanosecond == 0
+    ),
+}
+# The values of a kind in its typed column; time columns are given as int64 nanoseconds.
+_CONVERTERS = {
+    Kind.int: lambda values: np.array(values, dtype=np.int64),
+    Kind.float: lambda values: np.array(values, dtype=np.float64),
+    Kind.timedelta: lambda values: (
+        np.array([value // _MICROSECOND for value in values], dtype=np.int64) * 1000
+    ),
+    Kind.Timedelta: lambda values: np.array([value.value for value in values], dtype=np.int64),
+    Kind.datetime: lambda values: pd.DatetimeIndex(values).asi8,
+    Kind.Timestamp: lambda values: np.array([value.value for value in values], dtype=np.int64),
+}
+
+
+def to_typed(values: Iterable) -> pd.DataFrame:
+    """Split numeric answers into a `kind` column and one column of values per type.
+
+    The `int`, `float`, `timedelta` and `datetime` columns are nullable int64, float64,
+    timedelta64[ns] and datetime64[ns]; `object` holds the values of kind `object`. A row has a
+    value only in the column of its kind. `from_typed` turns the rows back into equal values
+    of the same types.
+    """
+    values = list(values)
+    object_code = CODES[Kind.object]
+    codes = np.array([_TYPE_CODES.get(type(value), object_code) for value in values], dtype=np.int8)
+    columns = empty_columns(len(values))
+    for kind, convert in _CONVERTERS.items():
+        rows = np.flatnonzero(codes == CODES[kind])
+        value_fits = _FITS[kind]
+        fits = np.array([value_fits(values[row]) for row in rows], dtype=bool)
+        codes[rows[~fits]] = object_code
+        if fits.any():
+            rows = rows[fits]
+            columns[VALUE_COLUMNS[kind]][rows] = convert([values[row] for row in rows])
+    for row in np.flatnonzero(codes == object_code):
+        columns["object"][row] = values[row]
+    return typed_frame(codes, columns)
+
+
+def empty_columns(length: int) -> dict[str, np.ndarray]:
+    """Columns of `length` rows for `typed_frame`, with time columns as int64 nanoseconds."""
+    return {
+        "int": np.zeros(length, dtype=np.int64),
+        "float": np.full(length, np.nan),
+        "timedelta": np.full(length, NAT, dtype=np.int64),
+        "datetime": np.full(length, NAT, dtype=np.int64),
+        "object": np.full(length, None, dtype=object),
+    }
+
+
+def typed_frame(codes: np.ndarray, columns: dict[str, np.ndarray]) -> pd.DataFrame:
+    """The typed values of the kinds `codes` and `columns`, as `to_typed` returns them."""
+    return pd.DataFrame(
+        {
+            "kind": pd.Categorical.from_codes(codes, dtype=KIND_DTYPE),
+            "int": pd.arrays.IntegerArray(columns["int"], codes != CODES[Kind.int]),
+            "float": columns["float"],
+            "timedelta": columns["timedelta"].view("timedelta64[ns]"),
+            "datetime": columns["datetime"].view("datetime64[ns]"),
+            # Without the dtype, pandas would infer datetimes from objects.
+            "object": pd.Series(columns["object"], dtype=object),
+        }
+    )
+
+
+def from_typed(typed: pd.DataFrame) -> list:
+    """The values of the rows of `typed`, as `to_typed` got them."""
+    values = [None] * len(typed)
+    codes = typed["kind"].cat.codes.to_numpy()
+    for kind, column in VALUE_COLUMNS.items():
+        rows = np.flatnonzero(codes == CODES[kind])
+        if len(rows):
+            for row, value in zip(rows, _materialize(kind, _values(typed, column)[rows])):
+                values[row] = value
+    return values
+
+
+def typed_columns(name: str) -> list[str]:
+    """The columns of a frame that hold the typed values of `name`."""
+    return [f"{name}.{field}" for field in TYPED_FIELDS]
+
+
+def assign_typed(df: pd.DataFrame, name: str, typed: pd.DataFrame) -> pd.DataFrame:
+    """`df` with the typed values `typed` of its rows as the columns of `name`."""
+    return df.assign(
+        **{
+            column: typed[field].set_axis(df.index)
+            for column, field in zip(typed_columns(name), TYPED_FIELDS)
+        }
+    )
+
+
+def get_typed(df: pd.DataFrame, name: str) -> pd.DataFrame | None:
+    """The typed values of `name` in `df`, or None if `df` has none."""
+    columns = typed_columns(name)
+    if columns[0] not in df:
+        return None
+    return df[columns].set_axis(TYPED_FIELDS, axis=1).reset_index(drop=True)
+
+
+def untyped(df: pd.DataFrame) -> pd.DataFrame:
+    """`df` with the typed values of each name as one object column of their values.
+
+    The column takes the place of the typed columns.
+    """
+    suffix = f".{TYPED_FIELDS[0]}"
+    names = [column.removesuffix(suffix) for column in df.columns if column.endswith(suffix)]
+    for name in names:
+        values = pd.Series(from_typed(get_typed(df, name)), index=df.index, dtype=object)
+        position = df.columns.get_loc(typed_columns(name)[0])
+        df = df.drop(columns=typed_columns(name))
+        df.insert(position, name, values)
+    return df
+
+
+def row_applied_series(values: list, index: pd.Index, infer_dtype: bool = True) -> pd.Series:
+    """`values` with the dtype that `DataFrame.apply(axis=1)` infers for them.
+
+    Without `infer_dtype`, the values are kept as they are in an object column.
+    """
+    if not infer_dtype:
+        return pd.Series(values, index=index, dtype=object)
+    return pd.Series(values, index=index, dtype=None if values else np.float64)
+
+
+def _values(typed: pd.DataFrame, column: str) -> np.ndarray:
+    if column == "int":
+        return typed["int"].to_numpy(dtype=np.int64, na_value=0)
+    return typed[column].to_numpy()
+
+
+def _materialize(kind: Kind, values: np.ndarray) -> list:
+    if kind == Kind.timedelta:
+        return values.astype("timedelta64[us]").astype(object).tolist()
+    if kind == Kind.Timedelta:
+        return pd.TimedeltaIndex(values).tolist()
+    if kind == Kind.datetime:
+        return values.astype("datetime64[us]").astype(object).tolist()
+    if kind == Kind.Timestamp:
+        return pd.DatetimeIndex(values).tolist()
+    return values.tolist()
@@ -168,3 +168,20 @@ def test_wrong_prompting():
             question="some question",
             table_context="some table",
         )
+
+
+def test_shared_prefix(shared_datadir):
+    tot_builder = ToTChatBuilder(prompting=Prompting.few_shot, split=ToTSplit.arithmetic)
+    chat = tot_builder.build_chat("Q", LastToken.add_generation_prompt, "I")
+    prefix = tot_builder.shared_prefix()
+    assert prefix == load_chat_template(DATA_DIR / "prompts/tot_arithmetic_few_shot.json")
+    assert chat[: len(prefix)] == prefix
+    assert ToTChatBuilder(prompting=Prompting.zero_shot).shared_prefix() == []
+
+    table = (shared_datadir / "ttqa_table_formatted.txt").read_text()
+    for prompting in Prompting:
+        ttqa_builder = TTQAChatBuilder(prompting=prompting)
+        chat = ttqa_builder.build_chat("Q", table)
+        prefix = ttqa_builder.shared_prefix()
+        assert len(prefix) > 0
+        assert chat[: len(prefix)] == prefix
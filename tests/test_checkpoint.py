@@ -0,0 +1,29 @@
+from temp_answer_qa.checkpoint import ResponseCheckpoint
+
+
+def test_checkpoint_roundtrip(tmp_path):
+    checkpoint = ResponseCheckpoint(
+        tmp_path / "tot_arithmetic_model_few-shot_add_generation_prompt.csv"
+    )
+    assert (
+        checkpoint.path.name == "tot_arithmetic_model_few-shot_add_generation_prompt.partial.jsonl"
+    )
+    assert checkpoint.load() == {}
+
+    checkpoint.append([3, 1], ['{"answer": 1}', "line\nbreak"])
+    checkpoint.append([7], [""])
+    assert checkpoint.load() == {3: '{"answer": 1}', 1: "line\nbreak", 7: ""}
+
+    checkpoint.remove()
+    assert not checkpoint.exists()
+
+
+def test_checkpoint_drops_truncated_line(tmp_path):
+    checkpoint = ResponseCheckpoint(tmp_path / "out.csv")
+    checkpoint.append([0], ["first"])
+    with open(checkpoint.path, "a") as f:
+        f.write('{"row": 1, "respo')
+
+    assert checkpoint.load() == {0: "first"}
+    checkpoint.append([1], ["second"])
+    assert checkpoint.load() == {0: "first", 1: "second"}
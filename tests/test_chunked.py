@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+from temp_answer_qa.chunked import SpilledFrame, iter_response_chunks
+
+
+def test_chunks_keep_samples_of_a_question_together(tmp_path):
+    path = tmp_path / "responses.csv"
+    pd.DataFrame(
+        {
+            "question": ["Q1"] * 3 + ["Q2"] * 3 + ["Q3"] * 3,
+            "sample": [0, 1, 2] * 3,
+            "label": ["1", "0", "2"] * 3,
+            "response": ["R"] * 9,
+        }
+    ).to_csv(path, index=False)
+
+    chunks = list(iter_response_chunks(path, chunk_size=4))
+
+    assert [chunk["question"].unique().tolist() for chunk in chunks] == [["Q1"], ["Q2"], ["Q3"]]
+    assert pd.concat(chunks)["label"].tolist() == ["1", "0", "2"] * 3
+
+
+def test_spilled_frame_writes_like_concatenated_frame(tmp_path):
+    chunks = [
+        pd.DataFrame({"a": [1.5, np.nan], "text": ['x, "y"', "line\nbreak"], "metric": [1, 2]}),
+        pd.DataFrame({"a": [3.0], "extra": [True], "metric": [3]}),
+    ]
+    expected = pd.concat(chunks, ignore_index=True).assign(score=lambda df: df["metric"] * 2)
+
+    with SpilledFrame(tmp_path, ["metric"]) as spilled:
+        for chunk in chunks:
+            spilled.append(chunk)
+        resident = spilled.resident().assign(score=lambda df: df["metric"] * 2)
+        spilled.write_csv(
+            tmp_path / "out.csv",
+            list(expected.columns),
+            np.arange(len(resident)),
+            resident,
+            chunk_size=2,
+        )
+
+    assert (tmp_path / "out.csv").read_text() == expected.to_csv(index=False)
+    assert [path.name for path in tmp_path.iterdir()] == ["out.csv"]
+
+
+def test_spilled_frame_writes_selected_rows(tmp_path):
+    with SpilledFrame(tmp_path, ["metric"], key_columns=["key"]) as spilled:
+        spilled.append(pd.DataFrame({"key": ["a", "b", "c"], "metric": [1, 2, 3]}))
+        spilled.write_csv(
+            tmp_path / "out.csv",
+            ["key", "metric"],
+            np.array([2, -1, 0]),
+            pd.DataFrame({"metric": [3.0, np.nan, 1.0]}),
+            chunk_size=10,
+        )
+        assert spilled.resident()["_key"].nunique() == 3
+
+    assert (tmp_path / "out.csv").read_text() == "key,metric\nc,3.0\n,\na,1.0\n"
@@ -0,0 +1,162 @@
+import pytest
+import torch
+
+from temp_answer_qa import LastToken, Prompting, ToTSplit
+from temp_answer_qa.chat_builder import ToTChatBuilder
+from temp_answer_qa.constrained_decoding import (
+    AnswerSchema,
+    AnswerSchemaLogitsProcessor,
+    TokenTrie,
+    answer_keys_from_instruction,
+)
+from temp_answer_qa.models import HFModel
+
+
+@pytest.mark.parametrize(
+    "instruction,expected_keys",
+    [
+        (
+            'Answer in JSON like: JSON = {"explanation": <>, "answer" : "<>"}.',
+            ("answer",),
+        ),
+        (
+            "JSON: JSON = {'explanation': <>, 'day': '-x/same_day/+x', 'time': 'HH:MM:SS' }",
+            ("day", "time"),
+        ),
+        (
+            'Report H, M and S as a json of the form {"explanation": <your step by step solution>, "H": H, "M": M, "S": S}.',
+            ("H", "M", "S"),
+        ),
+        ("Answer with a number.", None),
+    ],
+)
+def test_answer_keys_from_instruction(instruction, expected_keys):
+    assert answer_keys_from_instruction(instruction) == expected_keys
+
+
+@pytest.mark.parametrize(
+    "response,valid",
+    [
+        (' "Add \\"3\\" \\u00e9", "answer": 12}', True),
+        (' "Add","answer":-0.5 }', True),
+        (' "Add", "answer": "2020-01-01"}', True),
+        (' "Add", "answer": 012}', False),
+        (' "Add\n"', False),
+        (' "Add",  "answer": 1}', False),
+        (' "Add", "age": 1}', False),
+        (' "Add", "answer": 1} ', False),
+    ],
+)
+def test_answer_schema_accepts_only_valid_json(response, valid):
+    schema = AnswerSchema(("answer",), LastToken.continue_final_message)
+    assert (schema.advance(schema.initial_state, response) is not None) == valid
+
+
+def test_answer_schema_done_state():
+    schema = AnswerSchema(("day", "time"), LastToken.add_generation_prompt)
+    response = '{"explanation": "Add", "day": "same_day", "time": "13:04:13"}'
+    assert schema.advance(schema.initial_state, response[:-1]) != schema.done
+    assert schema.advance(schema.initial_state, response) == schema.done
+
+
+@pytest.fixture(scope="module")
+def sentencepiece_tokenizer():
+    """A BPE tokenizer with the normalizer and decoder of Llama's SentencePiece `tokenizer.json`."""
+    from tokenizers import Tokenizer, decoders, models, normalizers
+    from transformers import PreTrainedTokenizerFast
+
+    pieces = ["<unk>", "<s>", "</s>", "<0x20>", "▁", '"', '▁"', "a", "b", "ab", "▁ab"]
+    merges = [("▁", '"'), ("a", "b"), ("▁", "ab")]
+    tokenizer_object = Tokenizer(
+        models.BPE(
+            vocab={piece: i for i, piece in enumerate(pieces)},
+            merges=merges,
+            unk_token="<unk>",
+            byte_fallback=True,
+        )
+    )
+    tokenizer_object.normalizer = normalizers.Sequence(
+        [normalizers.Prepend("▁"), normalizers.Replace(" ", "▁")]
+    )
+    tokenizer_object.decoder = decoders.Sequence(
+        [
+            decoders.Replace("▁", " "),
+            decoders.ByteFallback(),
+            decoders.Fuse(),
+            decoders.Strip(" ", 1, 0),
+        ]
+    )
+    return PreTrainedTokenizerFast(
+        tokenizer_object=tokenizer_object, bos_token="<s>", eos_token="</s>", unk_token="<unk>"
+    )
+
+
+def test_token_trie_keeps_leading_space_of_sentencepiece_tokens(sentencepiece_tokenizer):
+    tokenizer = sentencepiece_tokenizer
+    token_trie = TokenTrie(tokenizer)
+    ids = tokenizer.convert_tokens_to_ids(['▁"', "▁ab", "<0x20>", "ab"])
+    # Decoding these tokens on their own drops their space.
+    assert tokenizer.decode(ids[:1]) == '"'
+    assert [token_trie.texts[i] for i in ids] == [' "', " ab", " ", "ab"]
+
+    schema = AnswerSchema(("answer",), LastToken.add_generation_prompt)
+    # After the one space allowed before the string only the quote itself may follow.
+    state = schema.advance(schema.initial_state, '{"explanation": ')
+    allowed = tokenizer.convert_ids_to_tokens(token_trie.allowed_tokens(schema, state))
+    assert allowed == ['"']
+
+
+@pytest.fixture(scope="module")
+def hf_model(tiny_model_dir):
+    return HFModel(model_name=str(tiny_model_dir))
+
+
+def test_logits_processor_masks_tokens_outside_schema(hf_model):
+    tokenizer = hf_model.tokenizer
+    schema = AnswerSchema(("answer",), LastToken.continue_final_message)
+    prompt = tokenizer.encode("<prompt>", add_special_tokens=False)
+    processor = AnswerSchemaLogitsProcessor(
+        TokenTrie(tokenizer), [schema], len(prompt), [tokenizer.eos_token_id], {}
+    )
+    vocab_size = len(tokenizer)
+
+    input_ids = torch.tensor([prompt + tokenizer.encode(' "Add"', add_special_tokens=False)])
+    scores = processor(input_ids, torch.zeros(1, vocab_size))
+    allowed = torch.isfinite(scores[0]).nonzero().flatten().tolist()
+    assert sorted(tokenizer.decode([i]) for i in allowed) == [" ", ","]
+
+    closed = tokenizer.encode(', "answer": 3}', add_special_tokens=False)
+    scores = processor(
+        torch.cat([input_ids, torch.tensor([closed])], dim=1), torch.zeros(1, vocab_size)
+    )
+    assert torch.isfinite(scores[0]).nonzero().flatten().tolist() == [tokenizer.eos_token_id]
+
+
+@pytest.mark.parametrize(
+    "last_token", [LastToken.add_generation_prompt, LastToken.continue_final_message]
+)
+def test_constrained_generation_stays_in_schema(hf_model, last_token):
+    builder = ToTChatBuilder(prompting=Prompting.zero_shot, split=ToTSplit.arithmetic)
+    instruction = (
+        'Report H, M and S as a json of the form {"explanation": <>, "H": H, "M": M, "S": S}.'
+    )
+    questions = ["Add 17:35:53 and 22:04:10.", "What is 3 + 4?", "When was 2005-04-14?"]
+    chats = [builder.build_chat(question, last_token, instruction) for question in questions]
+    schema = AnswerSchema(answer_keys_from_instruction(instruction), last_token)
+
+    responses = hf_model.generate_batch_with_chat_template(
+        chats,
+        add_generation_prompt=last_token == LastToken.add_generation_prompt,
+        continue_final_message=last_token == LastToken.continue_final_message,
+        max_new_tokens=40,
+        batch_size=2,
+        answer_schemas=[schema, None, schema],
+    )
+
+    for response in (responses[0], responses[2]):
+        assert len(response) == 40
+        assert schema.advance(schema.initial_state, response) is not None
+    # The row without a schema is not constrained.
+    assert schema.advance(schema.initial_state, responses[1]) is None
+    if last_token == LastToken.add_generation_prompt:
+        assert responses[0].lstrip().startswith("{")
@@ -0,0 +1,46 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from temp_answer_qa.date_extraction import find_first_dates, first_date, parse_dates
+
+DATES = [
+    (" February 17, 1837", datetime.datetime(1837, 2, 17)),
+    ("Feb. 17th 1837.", datetime.datetime(1837, 2, 17)),
+    ("17 February, 1837", datetime.datetime(1837, 2, 17)),
+    ("17th of February 1837", datetime.datetime(1837, 2, 17)),
+    ("1837-02-17", datetime.datetime(1837, 2, 17)),
+    ("February 29, 2000", datetime.datetime(2000, 2, 29)),
+]
+# Left to datefinder: not only a date, spellings that its versions read differently, and
+# dates that do not exist.
+NOT_PARSED = [
+    "He was born on February 17, 1837.",
+    "February 17",
+    "february 17, 1837",
+    "17 Feb, 1837",
+    "Sept 17, 1837",
+    "February 17, 0999",
+    "February 29, 1900",
+    "February 32, 1837",
+    "1837-13-01",
+    np.nan,
+]
+
+
+@pytest.mark.parametrize("text, expected", DATES)
+def test_parse_dates(text, expected):
+    assert parse_dates(pd.Series([text])) == [expected]
+    assert first_date(text) == expected
+
+
+def test_parse_dates_leaves_other_texts():
+    assert parse_dates(pd.Series(NOT_PARSED)) == [None] * len(NOT_PARSED)
+
+
+def test_find_first_dates_matches_datefinder():
+    texts = pd.Series([text for text, _ in DATES] + NOT_PARSED)
+    expected = [first_date(text) if isinstance(text, str) else None for text in texts]
+    assert find_first_dates(texts) == expected
@@ -1,9 +1,19 @@
-from datetime import timedelta
+import itertools
+from datetime import datetime, timedelta
 
 import numpy as np
 import pandas as pd
+import pytest
 
-from temp_answer_qa.measure_error import tot_measure_error, ttqa_measure_error
+from temp_answer_qa.measure_error import (
+    tot_measure_error,
+    tot_measure_error_rowwise,
+    try_calc_error,
+    try_calc_errors,
+    ttqa_measure_error,
+    ttqa_measure_error_rowwise,
+)
+from temp_answer_qa.typed_values import assign_typed, from_typed, to_typed, untyped
 
 
 def test_tot_error_measurement():
@@ -110,3 +120,133 @@ def test_ttqa_error_measurement():
         label_digit=[1, 2, 3, 1998, pd.Timestamp("2022-01-02 00:00:00").timestamp()],
     )
     pd.testing.assert_frame_equal(ttqa_measure_error(test_df_ttqa), expected_df)
+
+
+def test_try_calc_errors_matches_try_calc_error():
+    values = [
+        None,
+        3,
+        -(2**63),
+        2**63 - 1,
+        2.5,
+        np.nan,
+        timedelta(days=1),
+        timedelta(days=-106_000),
+        pd.Timedelta("18:48:28"),
+        datetime(1837, 2, 17),
+        datetime(2262, 1, 1),
+        pd.to_datetime("10/01/2015"),
+        pd.to_datetime("2262-01-01"),
+        pd.Timestamp("2022-01-02"),
+        [1],
+        True,
+        pd.NaT,
+    ]
+    predicted, expected = zip(*itertools.product(values, values))
+
+    errors = from_typed(try_calc_errors(to_typed(predicted), to_typed(expected)))
+
+    expected_errors = [try_calc_error(p, e) for p, e in zip(predicted, expected)]
+    assert [type(error) for error in errors] == [type(error) for error in expected_errors]
+    assert pd.Series(errors, dtype=object).equals(pd.Series(expected_errors, dtype=object))
+
+
+MEASURE_VALUES = [
+    None,
+    3,
+    1999,
+    2.5,
+    np.nan,
+    timedelta(seconds=90),
+    timedelta(days=-3, microseconds=5),
+    pd.Timedelta("18:48:28"),
+    pd.Timedelta("-1 days +23:50:00.5"),
+    datetime(1837, 2, 17),
+    pd.Timestamp("2022-01-02"),
+    pd.to_datetime("10/01/2015"),
+    pd.to_datetime("1837-02-17 00:00:00.25"),
+    [1],
+    True,
+]
+UNITS = ["seconds", "minutes", "days", "months", "years", "date", "date_years", "foo", np.nan]
+
+
+@pytest.mark.parametrize(
+    "measure_error, measure_error_rowwise",
+    [
+        (tot_measure_error, tot_measure_error_rowwise),
+        (ttqa_measure_error, ttqa_measure_error_rowwise),
+    ],
+)
+@pytest.mark.parametrize("rows", [slice(None), slice(0, 0), slice(1, 2), slice(15, 20)])
+def test_measure_error_matches_rowwise(measure_error, measure_error_rowwise, rows):
+    predicted, expected, units = zip(*itertools.product(MEASURE_VALUES, MEASURE_VALUES, UNITS))
+    responses = pd.DataFrame(
+        {
+            "response_numeric": pd.Series(predicted, dtype=object),
+            "label_numeric": pd.Series(expected, dtype=object),
+            "answer_temporal_unit": units,
+        }
+    ).iloc[rows]
+    responses.index = responses.index[::-1]
+
+    result = measure_error(responses)
+
+    expected_result = measure_error_rowwise(responses)
+    pd.testing.assert_frame_equal(result, expected_result)
+    for column in ["error", "error_numeric", "response_digit", "label_digit"]:
+        assert [type(value) for value in result[column]] == [
+            type(value) for value in expected_result[column]
+        ]
+
+
+@pytest.mark.parametrize(
+    "response_numeric, label_numeric",
+    [
+        ([1, 2, None], [1, 2, 3]),
+        ([1.5, 2.0, np.nan], [1, 2, 3]),
+        (pd.to_datetime(["2020", "2021", "2022"]), pd.to_datetime(["2019", "2020", "2021"])),
+        ([timedelta(1), None, timedelta(seconds=5)], [timedelta(2), timedelta(0), timedelta(0)]),
+    ],
+)
+def test_measure_error_matches_rowwise_on_typed_columns(response_numeric, label_numeric):
+    responses = pd.DataFrame(
+        {
+            "response_numeric": response_numeric,
+            "label_numeric": label_numeric,
+            "answer_temporal_unit": ["date", "days", "seconds"],
+        }
+    )
+    pd.testing.assert_frame_equal(
+        tot_measure_error(responses), tot_measure_error_rowwise(responses)
+    )
+    pd.testing.assert_frame_equal(
+        ttqa_measure_error(responses), ttqa_measure_error_rowwise(responses)
+    )
+
+
+@pytest.mark.parametrize("measure_error", [tot_measure_error, ttqa_measure_error])
+def test_measure_error_of_typed_values_matches_values(measure_error):
+    predicted, expected, units = zip(*itertools.product(MEASURE_VALUES, MEASURE_VALUES, UNITS))
+    responses = pd.DataFrame(
+        {
+            "response_numeric": pd.Series(predicted, dtype=object),
+            "label_numeric": pd.Series(expected, dtype=object),
+            "answer_temporal_unit": units,
+        }
+    )
+    responses.index = responses.index[::-1]
+    typed_responses = (
+        responses[["answer_temporal_unit"]]
+        .pipe(assign_typed, "response_numeric", to_typed(predicted))
+        .pipe(assign_typed, "label_numeric", to_typed(expected))
+    )
+
+    result = measure_error(typed_responses, infer_dtypes=False).pipe(untyped)
+
+    expected_result = measure_error(responses, infer_dtypes=False)
+    pd.testing.assert_frame_equal(result, expected_result[result.columns])
+    for column in result:
+        assert [type(value) for value in result[column]] == [
+            type(value) for value in expected_result[column]
+        ]
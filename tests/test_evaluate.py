@@ -0,0 +1,32 @@
+import pandas as pd
+import pytest
+
+from temp_answer_qa import LastToken
+from temp_answer_qa.evaluate import eval_ttqa
+
+RESPONSES_PATH = "data/responses/ttqa_head_Phi-4_zero-shot_add_generation_prompt.csv"
+
+
+@pytest.fixture
+def results_folder(tmp_path):
+    responses = pd.read_csv(RESPONSES_PATH, dtype=str, keep_default_na=False)
+    folder = tmp_path / "responses"
+    folder.mkdir()
+    # Answers of every format, so that small chunks hold only ints, only dates or a mix.
+    responses.groupby("answer_format").head(12).to_csv(
+        folder / "ttqa_head_Phi-4_zero-shot_add_generation_prompt.csv", index=False
+    )
+    return folder
+
+
+def test_eval_ttqa_output_does_not_depend_on_chunk_size(results_folder, tmp_path):
+    outputs = []
+    for chunk_size in (5, 1000):
+        output_folder = tmp_path / f"chunk_size_{chunk_size}"
+        output_folder.mkdir()
+        eval_ttqa(
+            results_folder, LastToken.add_generation_prompt, output_folder, chunk_size=chunk_size
+        )
+        outputs.append((output_folder / "ttqa_add_generation_prompt_evaluated.csv").read_text())
+
+    assert outputs[0] == outputs[1]
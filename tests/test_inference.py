@@ -4,8 +4,22 @@ from unittest.mock import patch, MagicMock
 import pandas as pd
 import pytest
 
-from temp_answer_qa import ToTSplit
-from temp_answer_qa.inference import Prompting, TTQASplit, LastToken, ttqa, tot
+from temp_answer_qa import Backend, Dataset, ToTSplit
+from temp_answer_qa.checkpoint import ResponseCheckpoint
+from temp_answer_qa.response_cache import ResponseCache
+from temp_answer_qa.inference import (
+    Prompting,
+    TTQASplit,
+    LastToken,
+    GenerationOptions,
+    compile_prompts,
+    learn_max_new_tokens,
+    sweep,
+    ttqa,
+    tot,
+)
+
+TABLES = pd.Series({1: "T1", 2: "T2", 3: "T3"})
 
 
 @pytest.mark.parametrize(
@@ -14,12 +28,12 @@ from temp_answer_qa.inference import Prompting, TTQASplit, LastToken, ttqa, tot
         (
             TTQASplit.head,
             ("Q1", "T1"),
-            pd.DataFrame({"question": ["Q1"], "table_context": ["T1"], "split": ["head"]}),
+            pd.DataFrame({"question": ["Q1"], "table_id": [1], "split": ["head"]}),
         ),
         (
             TTQASplit.tail,
             ("Q2", "T2"),
-            pd.DataFrame({"question": ["Q2"], "table_context": ["T2"], "split": ["tail"]}),
+            pd.DataFrame({"question": ["Q2"], "table_id": [2], "split": ["tail"]}),
         ),
     ],
 )
@@ -36,6 +50,7 @@ def test_ttqa(
     mock_df,
 ):
     mock_data_loader.load_ttqa.return_value = mock_df
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
 
     mock_chat_builder = MagicMock()
     mock_chat_builder.build_chat.return_value = [
@@ -54,8 +69,8 @@ def test_ttqa(
         split=split,
         model_name="test-model",
         last_token=LastToken.add_generation_prompt,
-        test_mode=True,
         output_folder=tmp_path,
+        options=GenerationOptions(test_mode=True),
     )
 
     # Assertions
@@ -127,8 +142,8 @@ def test_tot(
         split=split,
         model_name="test-model",
         last_token=LastToken.add_generation_prompt,
-        test_mode=True,
         output_folder=tmp_path,
+        options=GenerationOptions(test_mode=True),
     )
 
     # Assertions
@@ -146,3 +161,572 @@ def test_tot(
     )
     expected_filename = f"tot_{split}_test-model_zero-shot_add_generation_prompt.csv"
     assert (tmp_path / expected_filename).exists()
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_ttqa_batched_keeps_row_order(mock_HFModel, mock_data_loader, tmp_path):
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {
+            "question": ["Q1", "Q2", "Q3"],
+            "table_id": [1, 2, 3],
+            "split": ["head", "head", "head"],
+        }
+    )
+    mock_model = MagicMock()
+    # Buckets come back sorted by prompt length, not in row order.
+    mock_model.iter_generate_with_chat_template.return_value = iter(
+        [([2, 0], ["R3", "R1"]), ([1], ["R2"])]
+    )
+    mock_HFModel.return_value = mock_model
+
+    ttqa(
+        prompting=Prompting.zero_shot,
+        split=TTQASplit.head,
+        model_name="test-model",
+        last_token=LastToken.add_generation_prompt,
+        output_folder=tmp_path,
+        options=GenerationOptions(test_mode=True, batch_size=2),
+    )
+
+    mock_model.generate_with_chat_template.assert_not_called()
+    _, kwargs = mock_model.iter_generate_with_chat_template.call_args
+    assert kwargs["batch_size"] == 2
+    assert kwargs["max_new_tokens"] == 256
+    output = pd.read_csv(tmp_path / "ttqa_head_test-model_zero-shot_add_generation_prompt.csv")
+    assert output["response"].tolist() == ["R1", "R2", "R3"]
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_tot_continuous_batching_is_passed_to_model(mock_HFModel, mock_data_loader, tmp_path):
+    mock_data_loader.load_tot.return_value = pd.DataFrame(
+        {
+            "question_wo_instruct": ["Q1", "Q2"],
+            "instruction": ["I1", "I2"],
+            "split": ["arithmetic", "arithmetic"],
+        }
+    )
+    mock_model = MagicMock()
+    # Continuous batching yields rows as they finish.
+    mock_model.iter_generate_with_chat_template.return_value = iter([([1], ["R2"]), ([0], ["R1"])])
+    mock_HFModel.return_value = mock_model
+
+    tot(
+        prompting=Prompting.zero_shot,
+        split=ToTSplit.arithmetic,
+        model_name="test-model",
+        last_token=LastToken.add_generation_prompt,
+        output_folder=tmp_path,
+        options=GenerationOptions(continuous_batching=True),
+    )
+
+    mock_model.generate_with_chat_template.assert_not_called()
+    _, kwargs = mock_model.iter_generate_with_chat_template.call_args
+    assert kwargs["continuous"] is True
+    output = pd.read_csv(tmp_path / "tot_arithmetic_test-model_zero-shot_add_generation_prompt.csv")
+    assert output["response"].tolist() == ["R1", "R2"]
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_tot_constrained_decoding_reports_unconstrained_questions(
+    mock_HFModel, mock_data_loader, tmp_path, capsys
+):
+    mock_data_loader.load_tot.return_value = pd.DataFrame(
+        {
+            "question_wo_instruct": ["Q1", "Q2"],
+            "instruction": [
+                'JSON = {"explanation": <>, "answer": <>}',
+                'JSON = {"explanation": <>, "answer": {"H": H, "M": M}}',
+            ],
+            "split": ["arithmetic", "arithmetic"],
+        }
+    )
+    mock_model = MagicMock()
+    mock_model.iter_generate_with_chat_template.return_value = iter([([0, 1], ["R1", "R2"])])
+    mock_HFModel.return_value = mock_model
+
+    tot(
+        prompting=Prompting.zero_shot,
+        split=ToTSplit.arithmetic,
+        model_name="test-model",
+        last_token=LastToken.add_generation_prompt,
+        output_folder=tmp_path,
+        options=GenerationOptions(batch_size=2, constrained_decoding=True),
+    )
+
+    _, kwargs = mock_model.iter_generate_with_chat_template.call_args
+    assert kwargs["answer_schemas"][0].keys == ("answer",)
+    assert kwargs["answer_schemas"][1] is None
+    assert "Warning: 1 questions have no flat JSON answer template" in capsys.readouterr().out
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_ttqa_adaptive_max_new_tokens_uses_learned_caps(
+    mock_HFModel, mock_data_loader, tiny_model_dir, tmp_path, capsys
+):
+    model_name = str(tiny_model_dir)
+    responses_folder = tmp_path / "responses"
+    responses_folder.mkdir()
+    pd.DataFrame(
+        {
+            "answer_format": ["<num_years>"] * 3 + ["yyyy"] * 2,
+            "response": ["12", "345", "7", "It was 2019", None],
+        }
+    ).to_csv(
+        responses_folder / f"ttqa_head_{tiny_model_dir.name}_zero-shot_add_generation_prompt.csv",
+        index=False,
+    )
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {
+            "question": ["Q1", "Q2", "Q3"],
+            "table_id": [1, 2, 3],
+            "answer_format": ["yyyy", "<num_years>", "%B %d, %Y"],
+            "split": ["head"] * 3,
+        }
+    )
+    mock_model = MagicMock()
+    mock_model.iter_generate_with_chat_template.return_value = iter([([0, 1, 2], ["A", "B", "C"])])
+    mock_HFModel.return_value = mock_model
+
+    with patch("temp_answer_qa.length_profile.PROFILE_DIR", tmp_path / "profiles"):
+        learn_max_new_tokens(model_name, responses_folder, quantile=1.0)
+        ttqa(
+            prompting=Prompting.zero_shot,
+            split=TTQASplit.head,
+            model_name=model_name,
+            last_token=LastToken.add_generation_prompt,
+            output_folder=tmp_path,
+            options=GenerationOptions(batch_size=4, adaptive_max_new_tokens=True),
+        )
+
+    # The tiny tokenizer has one token per character; unknown formats keep the default cap.
+    _, kwargs = mock_model.iter_generate_with_chat_template.call_args
+    assert kwargs["max_new_tokens"] == [11, 3, 256]
+    out = capsys.readouterr().out
+    assert "ttqa <num_years>: 3 responses, cap 3 of 256 tokens, saves 759 reserved tokens" in out
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_ttqa_pipeline_writes_checkpoint_in_background(
+    mock_HFModel, mock_data_loader, tmp_path, capsys
+):
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {
+            "question": ["Q1", "Q2", "Q3"],
+            "table_id": [1, 2, 3],
+            "split": ["head", "head", "head"],
+        }
+    )
+    mock_model = MagicMock()
+    mock_model.iter_generate_with_chat_template.return_value = iter(
+        [([2, 0], ["R3", "R1"]), ([1], ["R2"])]
+    )
+    mock_HFModel.return_value = mock_model
+    written = []
+
+    with patch.object(
+        ResponseCheckpoint, "append", side_effect=lambda rows, rs: written.extend(rows)
+    ):
+        ttqa(
+            prompting=Prompting.zero_shot,
+            split=TTQASplit.head,
+            model_name="test-model",
+            last_token=LastToken.add_generation_prompt,
+            output_folder=tmp_path,
+            options=GenerationOptions(checkpoint=True, pipeline=True, stage_timing=True),
+        )
+
+    _, kwargs = mock_model.iter_generate_with_chat_template.call_args
+    assert kwargs["pipeline"] is True
+    assert written == [2, 0, 1]
+    output = pd.read_csv(tmp_path / "ttqa_head_test-model_zero-shot_add_generation_prompt.csv")
+    assert output["response"].tolist() == ["R1", "R2", "R3"]
+    assert "Stage times: write" in capsys.readouterr().out
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_tot_num_samples_writes_one_row_per_sample(mock_HFModel, mock_data_loader, tmp_path):
+    mock_data_loader.load_tot.return_value = pd.DataFrame(
+        {
+            "question_wo_instruct": ["Q1", "Q2"],
+            "instruction": ["I1", "I2"],
+            "split": ["arithmetic", "arithmetic"],
+        }
+    )
+    mock_model = MagicMock()
+    mock_model.iter_generate_with_chat_template.return_value = iter(
+        [([1, 0], [["R2a", "R2b"], ["R1a", "R1b"]])]
+    )
+    mock_HFModel.return_value = mock_model
+
+    tot(
+        prompting=Prompting.zero_shot,
+        split=ToTSplit.arithmetic,
+        model_name="test-model",
+        last_token=LastToken.add_generation_prompt,
+        output_folder=tmp_path,
+        options=GenerationOptions(num_samples=2),
+    )
+
+    mock_model.generate_with_chat_template.assert_not_called()
+    _, kwargs = mock_model.iter_generate_with_chat_template.call_args
+    assert kwargs["num_samples"] == 2
+    output = pd.read_csv(tmp_path / "tot_arithmetic_test-model_zero-shot_add_generation_prompt.csv")
+    assert output["question_wo_instruct"].tolist() == ["Q1", "Q1", "Q2", "Q2"]
+    assert output["sample"].tolist() == [0, 1, 0, 1]
+    assert output["response"].tolist() == ["R1a", "R1b", "R2a", "R2b"]
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_tot_resume_skips_answered_rows(mock_HFModel, mock_data_loader, tmp_path):
+    mock_data_loader.load_tot.return_value = pd.DataFrame(
+        {
+            "question_wo_instruct": ["Q1", "Q2", "Q3"],
+            "instruction": ["I1", "I2", "I3"],
+            "split": ["arithmetic", "arithmetic", "arithmetic"],
+        },
+        index=[10, 11, 12],
+    )
+    mock_model = MagicMock()
+    mock_model.generate_with_chat_template.return_value = "new"
+    mock_HFModel.return_value = mock_model
+    partial_path = (
+        tmp_path / "tot_arithmetic_test-model_zero-shot_add_generation_prompt.partial.jsonl"
+    )
+    partial_path.write_text('{"row": 11, "response": "old"}\n{"row": 12, "resp')
+
+    tot(
+        prompting=Prompting.zero_shot,
+        split=ToTSplit.arithmetic,
+        model_name="test-model",
+        last_token=LastToken.add_generation_prompt,
+        output_folder=tmp_path,
+        options=GenerationOptions(resume=True),
+    )
+
+    assert mock_model.generate_with_chat_template.call_count == 2
+    output = pd.read_csv(tmp_path / "tot_arithmetic_test-model_zero-shot_add_generation_prompt.csv")
+    assert output["response"].tolist() == ["new", "old", "new"]
+    assert not partial_path.exists()
+
+
+def test_checkpoint_refuses_to_overwrite_unfinished_run(tmp_path):
+    partial_path = (
+        tmp_path / "tot_arithmetic_test-model_zero-shot_add_generation_prompt.partial.jsonl"
+    )
+    partial_path.write_text('{"row": 0, "response": "old"}\n')
+    with pytest.raises(FileExistsError):
+        tot(
+            prompting=Prompting.zero_shot,
+            split=ToTSplit.arithmetic,
+            model_name="test-model",
+            last_token=LastToken.add_generation_prompt,
+            output_folder=tmp_path,
+            options=GenerationOptions(checkpoint=True),
+        )
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.openai_model.OpenAIModel")
+def test_ttqa_openai_backend_streams_all_rows(mock_OpenAIModel, mock_data_loader, tmp_path):
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {"question": ["Q1", "Q2"], "table_id": [1, 2], "split": ["head", "head"]}
+    )
+    mock_model = MagicMock()
+    mock_model.iter_generate_with_chat_template.return_value = iter([([0, 1], ["R1", "R2"])])
+    mock_OpenAIModel.return_value = mock_model
+
+    ttqa(
+        prompting=Prompting.zero_shot,
+        split=TTQASplit.head,
+        model_name="org/test-model",
+        last_token=LastToken.add_generation_prompt,
+        output_folder=tmp_path,
+        options=GenerationOptions(
+            backend=Backend.openai, api_base="http://localhost:8000/v1", max_concurrency=4
+        ),
+    )
+
+    mock_OpenAIModel.assert_called_once_with(
+        "org/test-model", api_base="http://localhost:8000/v1", max_concurrency=4
+    )
+    mock_model.generate_with_chat_template.assert_not_called()
+    output = pd.read_csv(tmp_path / "ttqa_head_test-model_zero-shot_add_generation_prompt.csv")
+    assert output["response"].tolist() == ["R1", "R2"]
+    mock_model.close.assert_called_once()
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.openai_model.OpenAIModel")
+def test_ttqa_openai_backend_closes_client_when_generation_fails(
+    mock_OpenAIModel, mock_data_loader, tmp_path
+):
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {"question": ["Q1"], "table_id": [1], "split": ["head"]}
+    )
+    mock_model = MagicMock()
+    mock_model.iter_generate_with_chat_template.side_effect = RuntimeError("server down")
+    mock_OpenAIModel.return_value = mock_model
+
+    with pytest.raises(RuntimeError, match="server down"):
+        ttqa(
+            prompting=Prompting.zero_shot,
+            split=TTQASplit.head,
+            model_name="org/test-model",
+            last_token=LastToken.add_generation_prompt,
+            output_folder=tmp_path,
+            options=GenerationOptions(backend=Backend.openai, api_base="http://localhost:8000/v1"),
+        )
+
+    mock_model.close.assert_called_once()
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_sweep_loads_model_once_and_skips_existing_outputs(
+    mock_HFModel, mock_data_loader, tmp_path
+):
+    mock_data_loader.load_tot.side_effect = lambda split, test_mode: pd.DataFrame(
+        {"question_wo_instruct": ["Q1"], "instruction": ["I1"], "split": [split]}
+    )
+    mock_model = MagicMock()
+    mock_model.generate_with_chat_template.return_value = "R1"
+    mock_HFModel.return_value = mock_model
+    existing = tmp_path / "tot_semantic_test-model_few-shot_add_generation_prompt.csv"
+    existing.write_text("response\nold\n")
+
+    sweep(
+        Dataset.tot,
+        model_name="org/test-model",
+        output_folder=tmp_path,
+        promptings=list(Prompting),
+        splits=list(ToTSplit),
+        last_tokens=[LastToken.add_generation_prompt],
+    )
+
+    mock_HFModel.assert_called_once_with(model_name="org/test-model")
+    assert mock_model.generate_with_chat_template.call_count == 3
+    # The model is shared by the runs and closed once after the last one.
+    mock_model.close.assert_called_once()
+    assert sorted(path.name for path in tmp_path.iterdir()) == [
+        "tot_arithmetic_test-model_few-shot_add_generation_prompt.csv",
+        "tot_arithmetic_test-model_zero-shot_add_generation_prompt.csv",
+        "tot_semantic_test-model_few-shot_add_generation_prompt.csv",
+        "tot_semantic_test-model_zero-shot_add_generation_prompt.csv",
+    ]
+    assert existing.read_text() == "response\nold\n"
+
+
+@patch("temp_answer_qa.inference.HFModel")
+def test_sweep_does_not_load_model_when_all_outputs_exist(mock_HFModel, tmp_path):
+    (tmp_path / "ttqa_head_test-model_zero-shot_add_generation_prompt.csv").write_text("")
+
+    sweep(
+        Dataset.ttqa,
+        model_name="test-model",
+        output_folder=tmp_path,
+        promptings=[Prompting.zero_shot],
+        splits=[TTQASplit.head],
+        last_tokens=[LastToken.add_generation_prompt],
+    )
+
+    mock_HFModel.assert_not_called()
+
+
+@patch("temp_answer_qa.inference.HFModel")
+def test_sweep_skips_last_tokens_that_ttqa_chats_cannot_use(mock_HFModel, tmp_path, capsys):
+    (tmp_path / "ttqa_head_test-model_zero-shot_add_generation_prompt.csv").write_text("")
+
+    sweep(
+        Dataset.ttqa,
+        model_name="test-model",
+        output_folder=tmp_path,
+        promptings=[Prompting.zero_shot],
+        splits=[TTQASplit.head],
+        last_tokens=list(LastToken),
+    )
+
+    mock_HFModel.assert_not_called()
+    assert "Skipping continue_final_message, TTQA chats end with the question." in (
+        capsys.readouterr().out
+    )
+
+
+@pytest.mark.parametrize(
+    "last_token, options, message",
+    [
+        (LastToken.continue_final_message, GenerationOptions(), "cannot use"),
+        (
+            LastToken.add_generation_prompt,
+            GenerationOptions(constrained_decoding=True),
+            "only available for ToT",
+        ),
+        (LastToken.add_generation_prompt, GenerationOptions(backend=Backend.openai), "--api-base"),
+        (
+            LastToken.add_generation_prompt,
+            GenerationOptions(
+                backend=Backend.openai, api_base="http://localhost:8000/v1", num_samples=2
+            ),
+            "--num-samples: only available for the hf backend",
+        ),
+    ],
+)
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_ttqa_rejects_unsupported_options_up_front(
+    mock_HFModel, mock_data_loader, last_token, options, message, tmp_path
+):
+    with pytest.raises(ValueError, match=message):
+        ttqa(
+            prompting=Prompting.zero_shot,
+            split=TTQASplit.head,
+            model_name="test-model",
+            last_token=last_token,
+            output_folder=tmp_path,
+            options=options,
+        )
+
+    mock_data_loader.load_ttqa.assert_not_called()
+    mock_HFModel.assert_not_called()
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_ttqa_cache_only_generates_changed_prompts(mock_HFModel, mock_data_loader, tmp_path):
+    mock_model = MagicMock(revision="abc")
+    mock_model.generate_with_chat_template.side_effect = lambda chat, **kwargs: chat[-1]["content"]
+    mock_HFModel.return_value = mock_model
+    output_path = tmp_path / "ttqa_head_test-model_zero-shot_add_generation_prompt.csv"
+
+    with patch("temp_answer_qa.response_cache.CACHE_PATH", tmp_path / "cache.sqlite"):
+        for questions in (["Q1", "Q2", "Q3"], ["Q1", "Q2 edited", "Q3"]):
+            mock_data_loader.load_ttqa_tables.return_value = TABLES
+            mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+                {"question": questions, "table_id": [1] * 3, "split": ["head"] * 3}
+            )
+            ttqa(
+                prompting=Prompting.zero_shot,
+                split=TTQASplit.head,
+                model_name="test-model",
+                last_token=LastToken.add_generation_prompt,
+                output_folder=tmp_path,
+                options=GenerationOptions(cache=True),
+            )
+
+    assert mock_model.generate_with_chat_template.call_count == 4
+    responses = pd.read_csv(output_path)["response"].tolist()
+    assert all(question in response for question, response in zip(questions, responses))
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_ttqa_pipeline_writes_cache_in_background(mock_HFModel, mock_data_loader, tmp_path):
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {"question": ["Q1", "Q2", "Q3"], "table_id": [1] * 3, "split": ["head"] * 3}
+    )
+    mock_model = MagicMock(revision="abc")
+    mock_model.iter_generate_with_chat_template.return_value = iter(
+        [([2, 0], ["R3", "R1"]), ([1], ["R2"])]
+    )
+    mock_HFModel.return_value = mock_model
+    cache_path = tmp_path / "cache.sqlite"
+
+    with patch("temp_answer_qa.response_cache.CACHE_PATH", cache_path):
+        ttqa(
+            prompting=Prompting.zero_shot,
+            split=TTQASplit.head,
+            model_name="test-model",
+            last_token=LastToken.add_generation_prompt,
+            output_folder=tmp_path,
+            options=GenerationOptions(cache=True, pipeline=True),
+        )
+
+    response_cache = ResponseCache(cache_path)
+    responses = response_cache.connection.execute("SELECT response FROM responses").fetchall()
+    response_cache.close()
+    assert sorted(response for (response,) in responses) == ["R1", "R2", "R3"]
+
+
+@patch("temp_answer_qa.inference.data_loader")
+@patch("temp_answer_qa.inference.HFModel")
+def test_ttqa_cache_is_pruned_and_closed_when_generation_fails(
+    mock_HFModel, mock_data_loader, tmp_path
+):
+    mock_data_loader.load_ttqa_tables.return_value = TABLES
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {"question": ["Q1", "Q2"], "table_id": [1] * 2, "split": ["head"] * 2}
+    )
+    mock_model = MagicMock(revision="abc")
+    mock_model.generate_with_chat_template.side_effect = ["R1", KeyboardInterrupt]
+    mock_HFModel.return_value = mock_model
+
+    with (
+        patch("temp_answer_qa.response_cache.CACHE_PATH", tmp_path / "cache.sqlite"),
+        patch.object(ResponseCache, "prune", autospec=True, return_value=0) as prune,
+        patch.object(ResponseCache, "close", autospec=True) as close,
+        pytest.raises(KeyboardInterrupt),
+    ):
+        ttqa(
+            prompting=Prompting.zero_shot,
+            split=TTQASplit.head,
+            model_name="test-model",
+            last_token=LastToken.add_generation_prompt,
+            output_folder=tmp_path,
+            options=GenerationOptions(cache=True),
+        )
+
+    prune.assert_called_once()
+    close.assert_called_once()
+
+
+@patch("temp_answer_qa.inference.data_loader")
+def test_ttqa_prompt_store_matches_chat_template(mock_data_loader, tiny_model_dir, tmp_path):
+    mock_data_loader.load_ttqa_tables.return_value = pd.Series(
+        {1: "Born: 1835", 2: "Year: 2019", 3: "2018: 3.1%, 2021: 3.3%"}
+    )
+    mock_data_loader.load_ttqa.return_value = pd.DataFrame(
+        {
+            "question": ["How old was he?", "When?", "Which year had the highest GDP growth?"],
+            "table_id": [1, 2, 3],
+            "split": ["head"] * 3,
+        },
+        index=[4, 8, 15],
+    )
+    run = {
+        "prompting": Prompting.zero_shot,
+        "split": TTQASplit.head,
+        "model_name": str(tiny_model_dir),
+        "last_token": LastToken.add_generation_prompt,
+    }
+    output_name = f"ttqa_head_{tiny_model_dir.name}_zero-shot_add_generation_prompt.csv"
+
+    with patch("temp_answer_qa.prompt_store.PROMPT_STORE_DIR", tmp_path / "store"):
+        compile_prompts(
+            Dataset.ttqa,
+            str(tiny_model_dir),
+            [Prompting.zero_shot],
+            [TTQASplit.head],
+            [LastToken.add_generation_prompt],
+        )
+        ttqa(
+            output_folder=tmp_path / "stored",
+            options=GenerationOptions(batch_size=2, prompt_store=True),
+            **run,
+        )
+    ttqa(output_folder=tmp_path / "templated", options=GenerationOptions(batch_size=2), **run)
+
+    stored = pd.read_csv(tmp_path / "stored" / output_name)
+    templated = pd.read_csv(tmp_path / "templated" / output_name)
+    pd.testing.assert_frame_equal(stored, templated)
@@ -0,0 +1,84 @@
+import os
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from temp_answer_qa import Dataset
+from temp_answer_qa.label_registry import LABEL_PARSERS, load_labels
+from temp_answer_qa.response_processing import ttqa_process_response, ttqa_process_response_rowwise
+
+QUESTIONS = pd.DataFrame(
+    {
+        "question": ["Q1", "Q2", "Q3", "Q4"],
+        "label": ["33", "February 17, 1837", "33", "2021"],
+        "answer_format": ["<num_years>", "%B %d, %Y", "<num_years>", "yyyy"],
+        "split": ["head", "tail", "head", "tail"],
+    }
+)
+
+
+@pytest.fixture
+def folders(tmp_path):
+    questions_dir = tmp_path / "questions"
+    questions_dir.mkdir()
+    QUESTIONS.to_csv(questions_dir / "ttqa.csv", index=False)
+    with (
+        patch("temp_answer_qa.label_registry.QUESTIONS_DIR", questions_dir),
+        patch("temp_answer_qa.label_registry.LABEL_REGISTRY_DIR", tmp_path / "registry"),
+    ):
+        yield questions_dir, tmp_path / "registry"
+
+
+def test_labels_are_parsed_once_per_label(folders):
+    _, registry_dir = folders
+
+    labels = load_labels(Dataset.ttqa)
+
+    assert (registry_dir / "ttqa.pickle").exists()
+    assert labels.index.tolist() == [
+        ("33", "<num_years>"),
+        ("February 17, 1837", "%B %d, %Y"),
+        ("2021", "yyyy"),
+    ]
+
+
+def test_persisted_labels_are_reused(folders):
+    questions_dir, _ = folders
+    expected = load_labels(Dataset.ttqa)
+    # A new mtime without new content, as after a checkout.
+    os.utime(questions_dir / "ttqa.csv", ns=(0, 0))
+
+    with patch.dict(LABEL_PARSERS, {Dataset.ttqa: (["label", "answer_format"], None)}):
+        pd.testing.assert_frame_equal(load_labels(Dataset.ttqa), expected)
+
+
+def test_labels_are_parsed_again_when_csv_changes(folders):
+    questions_dir, _ = folders
+    load_labels(Dataset.ttqa)
+    QUESTIONS.assign(label=["1", "May 9, 1931", "1", "1999"]).to_csv(
+        questions_dir / "ttqa.csv", index=False
+    )
+
+    assert load_labels(Dataset.ttqa).index.get_level_values("label").tolist() == [
+        "1",
+        "May 9, 1931",
+        "1999",
+    ]
+
+
+def test_no_labels_without_questions(folders):
+    assert load_labels(Dataset.tot) is None
+
+
+def test_process_response_with_registry_matches_rowwise(folders):
+    responses = QUESTIONS.assign(
+        response=["Final Answer: 33 years", "Final Answer: 17 February 1837", "no answer", "bla"]
+    )
+    # Labels that are not in the registry are cast with the responses.
+    responses.loc[3, "label"] = "1999"
+
+    pd.testing.assert_frame_equal(
+        ttqa_process_response(responses, load_labels(Dataset.ttqa)),
+        ttqa_process_response_rowwise(responses),
+    )
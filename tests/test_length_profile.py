@@ -0,0 +1,45 @@
+import numpy as np
+import pandas as pd
+
+from temp_answer_qa import Dataset
+from temp_answer_qa.length_profile import learn_caps, max_new_tokens_per_row, response_files
+
+
+def test_learn_caps_takes_quantile_per_type():
+    types = pd.Series(["years"] * 4 + ["date"] * 2)
+    lengths = np.array([3, 4, 5, 40, 300, 400])
+
+    report = learn_caps(types, lengths, default=256, quantile=0.5).set_index("type")
+
+    # The median of 3, 4, 5, 40 is 4.5, rounded up; 350 is above the default.
+    assert report.loc["years", "cap"] == 5
+    assert report.loc["date", "cap"] == 256
+    assert report.loc["years", "tokens_saved"] == 4 * (256 - 5)
+    assert report.loc["date", "tokens_saved"] == 0
+    assert report.loc["years", "truncated"] == 1
+    assert report.loc["date", "truncated"] == 2
+
+
+def test_max_new_tokens_per_row_falls_back_to_default():
+    data = pd.DataFrame({"answer_format": ["years", "unseen", None]})
+
+    assert max_new_tokens_per_row(Dataset.ttqa, data, {"years": 8}) == [8, 256, 256]
+
+
+def test_response_files_skip_shards_and_other_models(tmp_path):
+    for name in (
+        "ttqa_head_Phi-4_zero-shot_add_generation_prompt.csv",
+        "ttqa_head_Phi-4_zero-shot_add_generation_prompt.shard-0-of-2.csv",
+        "ttqa_head_Phi-4-mini-instruct_zero-shot_add_generation_prompt.csv",
+        "tot_arithmetic_Phi-4_few-shot_continue_final_message.csv",
+    ):
+        (tmp_path / name).touch()
+
+    files = response_files("microsoft/Phi-4", tmp_path)
+
+    assert [path.name for path in files[Dataset.ttqa]] == [
+        "ttqa_head_Phi-4_zero-shot_add_generation_prompt.csv"
+    ]
+    assert [path.name for path in files[Dataset.tot]] == [
+        "tot_arithmetic_Phi-4_few-shot_continue_final_message.csv"
+    ]
@@ -0,0 +1,135 @@
+import enum
+import inspect
+import os
+import subprocess
+import sys
+import types
+import typing
+from dataclasses import fields
+from pathlib import Path
+from unittest.mock import patch
+
+import pytest
+from typer.testing import CliRunner
+
+import main
+from temp_answer_qa import Dataset, TTQASplit
+from temp_answer_qa.inference import GenerationOptions
+
+ROOT = Path(__file__).parent.parent
+
+
+@pytest.mark.parametrize(
+    "statement", ["import main", "import temp_answer_qa.evaluate", "import temp_answer_qa.shards"]
+)
+def test_cli_and_evaluation_do_not_load_inference_dependencies(statement):
+    env = {k: v for k, v in os.environ.items() if k != "HF_TOKEN"}
+    check = (
+        f"import sys; {statement}; "
+        "print([m for m in ('torch', 'transformers', 'accelerate', 'dotenv') if m in sys.modules])"
+    )
+    output = subprocess.run(
+        [sys.executable, "-c", check], cwd=ROOT, env=env, capture_output=True, text=True, check=True
+    )
+    assert output.stdout.strip() == "[]"
+
+
+def test_help_without_hf_token():
+    env = {k: v for k, v in os.environ.items() if k != "HF_TOKEN"}
+    output = subprocess.run(
+        [sys.executable, "main.py", "--help"],
+        cwd=ROOT,
+        env=env,
+        capture_output=True,
+        text=True,
+        check=False,
+    )
+    assert output.returncode == 0
+    assert "evaluate-ttqa" in output.stdout
+
+
+# Every flag is set to a bit of its number, so that any two flags differ in one of the runs.
+FLAG_BITS = range(5)
+
+
+def _cli_values(command, tmp_path, bit: int) -> tuple[list[str], dict]:
+    """CLI arguments that give every parameter of `command` its own value."""
+    args, values = [], {}
+    parameters = inspect.signature(command).parameters
+    assert sum(p.annotation is bool for p in parameters.values()) <= 2 ** len(FLAG_BITS)
+    flags = 0
+    for i, (name, parameter) in enumerate(parameters.items()):
+        annotation = parameter.annotation
+        if isinstance(annotation, types.UnionType):
+            annotation = next(a for a in typing.get_args(annotation) if a is not type(None))
+        is_list = typing.get_origin(annotation) is list
+        if is_list:
+            annotation = typing.get_args(annotation)[0]
+        if annotation is bool:
+            values[name] = bool(flags >> bit & 1)
+            args.append(f"--{'' if values[name] else 'no-'}{name.replace('_', '-')}")
+            flags += 1
+            continue
+        if name == "dataset":
+            value = Dataset.ttqa
+        elif name == "split" and is_list:
+            value = TTQASplit.tail.value
+        elif isinstance(annotation, type) and issubclass(annotation, enum.Enum):
+            value = list(annotation)[-1]
+        elif annotation is int:
+            value = 100 + i
+        elif annotation is Path:
+            value = tmp_path / name
+        else:
+            value = f"value-{i}"
+        text = value.value if isinstance(value, enum.Enum) else str(value)
+        if parameter.default is inspect.Parameter.empty:
+            args.append(text)
+        else:
+            args += [f"--{name.replace('_', '-')}", text]
+        values[name] = [value] if is_list else value
+    return args, values
+
+
+def _with_options(values: dict) -> dict:
+    """`values` with those of the generation options passed as one `GenerationOptions`."""
+    names = {field.name for field in fields(GenerationOptions)}
+    options = GenerationOptions(**{name: values[name] for name in names if name in values})
+    return {name: value for name, value in values.items() if name not in names} | {
+        "options": options
+    }
+
+
+@pytest.mark.parametrize("bit", FLAG_BITS)
+@pytest.mark.parametrize(
+    "command, target",
+    [
+        (main.inference_tot, "temp_answer_qa.inference.tot"),
+        (main.inference_ttqa, "temp_answer_qa.inference.ttqa"),
+    ],
+)
+def test_inference_commands_pass_every_option_by_keyword(command, target, bit, tmp_path):
+    args, values = _cli_values(command, tmp_path, bit)
+    expected = _with_options(values)
+
+    with patch(target) as run:
+        result = CliRunner().invoke(main.app, [command.__name__.replace("_", "-"), *args])
+
+    assert result.exit_code == 0, result.output
+    assert run.call_args.args == ()
+    assert run.call_args.kwargs == expected
+
+
+@pytest.mark.parametrize("bit", FLAG_BITS)
+def test_sweep_passes_every_option_by_keyword(bit, tmp_path):
+    args, values = _cli_values(main.sweep, tmp_path, bit)
+    renamed = {"prompting": "promptings", "split": "splits", "last_token": "last_tokens"}
+    expected = {renamed.get(name, name): value for name, value in _with_options(values).items()}
+    expected["splits"] = [TTQASplit(split) for split in expected["splits"]]
+
+    with patch("temp_answer_qa.inference.sweep") as run:
+        result = CliRunner().invoke(main.app, ["sweep", *args])
+
+    assert result.exit_code == 0, result.output
+    assert run.call_args.args == ()
+    assert run.call_args.kwargs == expected
@@ -0,0 +1,328 @@
+import os
+from unittest.mock import patch
+
+import pytest
+import torch
+
+from temp_answer_qa import LastToken, Prompting, ToTSplit, continuous_batching
+from temp_answer_qa.chat_builder import ToTChatBuilder
+from temp_answer_qa.constrained_decoding import AnswerSchema
+from temp_answer_qa.models import HFModel, ResponseCompleteCriteria, plan_batches
+from temp_answer_qa.pipeline import StageTimer
+
+QUESTIONS = [
+    "How many days are between 2004-Feb-18 and 2004-Dec-30?",
+    "What is 3 + 4?",
+    "Natalie and Chris were born on 2004-Feb-18 and 2004-Dec-30 respectively. When Chris was 991 days old, how old was Natalie in days?",
+    "When was 2005-04-14 minus one week?",
+    "Add 17:35:53 and 22:04:10.",
+]
+# How the chats of a test end, as keyword arguments of the `HFModel` generate methods.
+CONTINUE_FINAL_MESSAGE = {"add_generation_prompt": False, "continue_final_message": True}
+ADD_GENERATION_PROMPT = {"add_generation_prompt": True, "continue_final_message": False}
+INSTRUCTION = 'Return your answer as a JSON like: JSON = {"explanation": <your step by step solution>, "answer": <num_days>}.'
+
+
+@pytest.fixture(scope="module")
+def hf_model(tiny_model_dir):
+    return HFModel(model_name=str(tiny_model_dir))
+
+
+@pytest.fixture(scope="module")
+def chats():
+    builder = ToTChatBuilder(prompting=Prompting.zero_shot, split=ToTSplit.arithmetic)
+    return [
+        builder.build_chat(question, LastToken.continue_final_message, INSTRUCTION)
+        for question in QUESTIONS
+    ]
+
+
+def test_batched_generation_matches_sequential(hf_model, chats):
+    sequential = [
+        hf_model.generate_with_chat_template(
+            chat, add_generation_prompt=False, continue_final_message=True, max_new_tokens=12
+        )
+        for chat in chats
+    ]
+    batched = hf_model.generate_batch_with_chat_template(
+        chats,
+        add_generation_prompt=False,
+        continue_final_message=True,
+        max_new_tokens=12,
+        batch_size=2,
+    )
+    assert batched == sequential
+
+
+def test_iter_generate_buckets_by_prompt_length(hf_model, chats):
+    batches = list(
+        hf_model.iter_generate_with_chat_template(
+            chats,
+            add_generation_prompt=False,
+            continue_final_message=True,
+            max_new_tokens=2,
+            batch_size=2,
+        )
+    )
+    indices = [i for batch_indices, _ in batches for i in batch_indices]
+    assert [len(batch_indices) for batch_indices, _ in batches] == [2, 2, 1]
+    assert sorted(indices) == list(range(len(chats)))
+    lengths = [len(hf_model.tokenize_chat(chats[i], False, True)) for i in indices]
+    assert lengths == sorted(lengths)
+
+
+def test_prefix_cache_matches_uncached_generation(tiny_model_dir):
+    builder = ToTChatBuilder(prompting=Prompting.zero_shot, split=ToTSplit.arithmetic)
+    chats = [builder.build_chat(q, LastToken.add_generation_prompt, INSTRUCTION) for q in QUESTIONS]
+    kwargs = {**ADD_GENERATION_PROMPT, "max_new_tokens": 8}
+    uncached = HFModel(model_name=str(tiny_model_dir))
+    expected = [uncached.generate_with_chat_template(chat, **kwargs) for chat in chats]
+
+    cached = HFModel(model_name=str(tiny_model_dir))
+    cached.cache_prefix([{"role": "system", "content": INSTRUCTION}])
+    assert [cached.generate_with_chat_template(chat, **kwargs) for chat in chats] == expected
+    assert cached.generate_batch_with_chat_template(chats, batch_size=2, **kwargs) == expected
+
+    prefix_length = len(
+        cached.tokenize_chat([{"role": "system", "content": INSTRUCTION}], False, False)
+    )
+    assert cached.prefix_tokens_prefilled == prefix_length
+    assert cached.prefill_tokens_saved == 2 * len(chats) * prefix_length
+
+
+def test_stop_when_ends_each_sequence_separately(hf_model, chats):
+    full = hf_model.generate_batch_with_chat_template(
+        chats,
+        add_generation_prompt=False,
+        continue_final_message=True,
+        max_new_tokens=12,
+        batch_size=len(chats),
+    )
+    # Stop only the sequence whose response is the first to differ from the others.
+    shared = len(os.path.commonprefix(full))
+    stop_row = next(i for i, response in enumerate(full) if full.count(response) == 1)
+    stop_at = full[stop_row][: shared + 1]
+    stopped = hf_model.generate_batch_with_chat_template(
+        chats,
+        add_generation_prompt=False,
+        continue_final_message=True,
+        max_new_tokens=12,
+        batch_size=len(chats),
+        stop_when=lambda response: response == stop_at,
+    )
+    assert stopped[stop_row] == stop_at
+    assert stopped[:stop_row] + stopped[stop_row + 1 :] == full[:stop_row] + full[stop_row + 1 :]
+
+
+def test_response_complete_criteria_decodes_only_rows_that_may_complete(hf_model):
+    checked = []
+
+    def stop_when(response):
+        checked.append(response)
+        return response.endswith("}")
+
+    stop_when.completes_on = "}"
+    criteria = ResponseCompleteCriteria(hf_model.tokenizer, 1, stop_when)
+    rows = ["Xa}}", "Xab}"]
+    finished = []
+    for step in range(2, 5):
+        input_ids = torch.tensor(
+            [hf_model.tokenizer.convert_tokens_to_ids(list(row[:step])) for row in rows]
+        )
+        finished.append(criteria(input_ids, None).tolist())
+
+    assert finished == [[False, False], [True, False], [True, True]]
+    # The finished first row is not decoded again, and "a" or "b" cannot close a response.
+    assert checked == ["a}", "ab}"]
+
+
+def test_plan_batches_fills_token_budget():
+    lengths = [50, 10, 30, 20, 40]
+    assert plan_batches(lengths, batch_size=2, max_new_tokens=10) == [[1, 3], [2, 4], [0]]
+    # Two rows of 20 + 10 tokens fit into 64 tokens, a third would need 3 * (30 + 10).
+    assert plan_batches(lengths, batch_size=1, max_new_tokens=10, token_budget=64) == [
+        [1, 3],
+        [2],
+        [4],
+        [0],
+    ]
+    # A prompt that exceeds the budget on its own still gets a batch.
+    assert plan_batches([100], batch_size=1, max_new_tokens=10, token_budget=64) == [[0]]
+
+
+def test_plan_batches_groups_prompts_by_max_new_tokens():
+    lengths = [50, 10, 30, 20]
+    assert plan_batches(lengths, batch_size=2, max_new_tokens=[8, 4, 4, 8]) == [[1, 2], [3, 0]]
+
+
+def test_out_of_memory_batches_are_halved(hf_model, chats):
+    expected = hf_model.generate_batch_with_chat_template(
+        chats,
+        add_generation_prompt=False,
+        continue_final_message=True,
+        max_new_tokens=4,
+        batch_size=1,
+    )
+    generate_batch = hf_model.generate_batch
+
+    def generate_batch_with_limit(prompts, *args):
+        if len(prompts) > 2:
+            raise torch.OutOfMemoryError("CUDA out of memory")
+        return generate_batch(prompts, *args)
+
+    with patch.object(hf_model, "generate_batch", side_effect=generate_batch_with_limit):
+        batches = list(
+            hf_model.iter_generate_with_chat_template(
+                chats,
+                add_generation_prompt=False,
+                continue_final_message=True,
+                max_new_tokens=4,
+                batch_size=1,
+                token_budget=10_000,
+            )
+        )
+
+    assert [len(indices) for indices, _ in batches] == [2, 1, 2]
+    responses = {i: response for indices, rs in batches for i, response in zip(indices, rs)}
+    assert [responses[i] for i in range(len(chats))] == expected
+    assert hf_model.oom_splits == 2
+
+
+@pytest.mark.parametrize("token_budget", [None, 500])
+def test_continuous_batching_matches_static_batching(hf_model, chats, token_budget):
+    kwargs = {**CONTINUE_FINAL_MESSAGE, "max_new_tokens": 12}
+    full = hf_model.generate_batch_with_chat_template(chats, batch_size=len(chats), **kwargs)
+    # Rows that stop early free their slot for the next chat.
+    shared = len(os.path.commonprefix(full))
+    stop_row = next(i for i, response in enumerate(full) if full.count(response) == 1)
+    stop_at = full[stop_row][: shared + 1]
+    batches = list(
+        hf_model.iter_generate_with_chat_template(
+            chats,
+            batch_size=2,
+            stop_when=lambda response: response == stop_at,
+            token_budget=token_budget,
+            continuous=True,
+            **kwargs,
+        )
+    )
+
+    responses = {i: response for indices, rs in batches for i, response in zip(indices, rs)}
+    assert sorted(responses) == list(range(len(chats)))
+    assert responses[stop_row] == stop_at
+    assert [responses[i] for i in range(len(chats)) if i != stop_row] == [
+        response for i, response in enumerate(full) if i != stop_row
+    ]
+
+
+@pytest.mark.parametrize("continuous", [False, True])
+def test_max_new_tokens_per_prompt(hf_model, chats, continuous):
+    kwargs = {**CONTINUE_FINAL_MESSAGE, "batch_size": 2}
+    short = hf_model.generate_batch_with_chat_template(chats, max_new_tokens=4, **kwargs)
+    long = hf_model.generate_batch_with_chat_template(chats, max_new_tokens=12, **kwargs)
+    caps = [4, 12, 4, 12, 4][: len(chats)]
+    batches = hf_model.iter_generate_with_chat_template(
+        chats, max_new_tokens=caps, continuous=continuous, **kwargs
+    )
+
+    responses = {i: response for indices, rs in batches for i, response in zip(indices, rs)}
+    assert [responses[i] for i in range(len(chats))] == [
+        short[i] if cap == 4 else long[i] for i, cap in enumerate(caps)
+    ]
+
+
+def test_continuous_batching_with_prefix_cache_and_schemas(tiny_model_dir):
+    builder = ToTChatBuilder(prompting=Prompting.zero_shot, split=ToTSplit.arithmetic)
+    chats = [builder.build_chat(q, LastToken.add_generation_prompt, INSTRUCTION) for q in QUESTIONS]
+    schema = AnswerSchema(("answer",), LastToken.add_generation_prompt)
+    schemas = [schema, None, schema, None, schema]
+    kwargs = {**ADD_GENERATION_PROMPT, "max_new_tokens": 10}
+    model = HFModel(model_name=str(tiny_model_dir))
+    expected = model.generate_batch_with_chat_template(
+        chats, batch_size=1, answer_schemas=schemas, **kwargs
+    )
+
+    model.cache_prefix([{"role": "system", "content": INSTRUCTION}])
+    batches = model.iter_generate_with_chat_template(
+        chats, batch_size=3, answer_schemas=schemas, continuous=True, **kwargs
+    )
+    responses = {i: response for indices, rs in batches for i, response in zip(indices, rs)}
+    assert [responses[i] for i in range(len(chats))] == expected
+    assert model.prefill_tokens_saved > 0
+
+
+def test_continuous_batching_applies_generation_config(tiny_model_dir, chats):
+    kwargs = {**CONTINUE_FINAL_MESSAGE, "max_new_tokens": 10}
+    model = HFModel(model_name=str(tiny_model_dir))
+    plain = model.generate_batch_with_chat_template(chats, batch_size=1, **kwargs)
+    model.model.generation_config.repetition_penalty = 1.5
+    expected = model.generate_batch_with_chat_template(chats, batch_size=1, **kwargs)
+    assert expected != plain
+    assert continuous_batching.unsupported_reason(model.model) is None
+
+    batches = model.iter_generate_with_chat_template(chats, batch_size=3, continuous=True, **kwargs)
+    responses = {i: response for indices, rs in batches for i, response in zip(indices, rs)}
+    assert [responses[i] for i in range(len(chats))] == expected
+
+
+@pytest.mark.parametrize(
+    "configure, reason",
+    [
+        (lambda model: setattr(model.config, "sliding_window", 8), "sliding window"),
+        (lambda model: setattr(model.generation_config, "suppress_tokens", [5]), "suppress_tokens"),
+    ],
+)
+def test_continuous_batching_falls_back_to_static_batching(
+    tiny_model_dir, chats, capsys, configure, reason
+):
+    kwargs = {**CONTINUE_FINAL_MESSAGE, "max_new_tokens": 6, "batch_size": 3}
+    model = HFModel(model_name=str(tiny_model_dir))
+    configure(model.model)
+    expected = list(model.iter_generate_with_chat_template(chats, **kwargs))
+
+    assert (
+        list(model.iter_generate_with_chat_template(chats, continuous=True, **kwargs)) == expected
+    )
+    assert reason in capsys.readouterr().out
+
+
+def test_continuous_batching_checks_transformers_version(hf_model):
+    assert continuous_batching.unsupported_reason(hf_model.model) is None
+    with patch.object(continuous_batching.transformers, "__version__", "4.52.4"):
+        assert "needs transformers>=4.56,<6" in continuous_batching.unsupported_reason(
+            hf_model.model
+        )
+
+
+def test_pipeline_matches_serial_generation(hf_model, chats):
+    kwargs = {**CONTINUE_FINAL_MESSAGE, "max_new_tokens": 6, "batch_size": 2}
+    expected = hf_model.generate_batch_with_chat_template(chats, **kwargs)
+    hf_model.stage_timer = StageTimer()
+    try:
+        batches = list(hf_model.iter_generate_with_chat_template(chats, pipeline=True, **kwargs))
+    finally:
+        stage_timer, hf_model.stage_timer = hf_model.stage_timer, None
+
+    assert [len(indices) for indices, _ in batches] == [2, 2, 1]
+    responses = {i: response for indices, rs in batches for i, response in zip(indices, rs)}
+    assert [responses[i] for i in range(len(chats))] == expected
+    assert set(stage_timer.seconds) == {"tokenize", "prepare", "generate", "decode"}
+
+
+@pytest.mark.parametrize("prefix_cache", [False, True])
+def test_samples_share_prefill(tiny_model_dir, chats, prefix_cache):
+    kwargs = {**CONTINUE_FINAL_MESSAGE, "max_new_tokens": 6, "batch_size": 2}
+    model = HFModel(model_name=str(tiny_model_dir))
+    greedy = model.generate_batch_with_chat_template(chats, **kwargs)
+    if prefix_cache:
+        model.cache_prefix([{"role": "system", "content": INSTRUCTION}])
+    # Sampling from the top token only must reproduce greedy decoding for every sample.
+    model.model.generation_config.top_k = 1
+    with patch.object(model.model, "forward", wraps=model.model.forward) as forward:
+        samples = model.generate_batch_with_chat_template(chats, num_samples=3, **kwargs)
+
+    assert samples == [[response] * 3 for response in greedy]
+    prefill_calls = [
+        call for call in forward.call_args_list if call.kwargs["input_ids"].shape[1] > 1
+    ]
+    assert [call.kwargs["input_ids"].shape[0] for call in prefill_calls] == [2, 2, 1]
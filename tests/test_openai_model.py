@@ -0,0 +1,124 @@
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+pytest.importorskip("httpx")
+
+from temp_answer_qa import LastToken, Prompting, ToTSplit
+from temp_answer_qa.chat_builder import ToTChatBuilder
+from temp_answer_qa.openai_model import OpenAIModel
+
+
+class ChatCompletionsHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers["Content-Length"])))
+        server = self.server
+        with server.lock:
+            server.requests.append(body)
+            server.connections.add(self.client_address)
+            fail = server.failures > 0
+            server.failures -= 1
+        if fail:
+            self._reply(503, {"error": "overloaded"})
+            return
+        question = body["messages"][-2 if body["continue_final_message"] else -1]["content"]
+        # Later questions finish first, so results arrive out of order.
+        time.sleep(0.01 * (10 - int(question[1:])))
+        self._reply(200, {"choices": [{"message": {"role": "assistant", "content": question}}]})
+
+    def _reply(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def server():
+    server = ThreadingHTTPServer(("127.0.0.1", 0), ChatCompletionsHandler)
+    server.lock = threading.Lock()
+    server.requests = []
+    server.connections = set()
+    server.failures = 0
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def test_generate_keeps_order_and_assistant_prefill(server):
+    builder = ToTChatBuilder(prompting=Prompting.zero_shot, split=ToTSplit.arithmetic)
+    chats = [builder.build_chat(f"Q{i}", LastToken.continue_final_message, "I") for i in range(10)]
+    model = OpenAIModel(
+        "test-model", api_base=f"http://127.0.0.1:{server.server_port}/v1", max_concurrency=3
+    )
+
+    batches = list(
+        model.iter_generate_with_chat_template(
+            chats,
+            add_generation_prompt=False,
+            continue_final_message=True,
+            max_new_tokens=16,
+            batch_size=4,
+        )
+    )
+    model.close()
+
+    assert [indices for indices, _ in batches] == [[0, 1, 2, 3], [4, 5, 6, 7], [8, 9]]
+    assert [r for _, responses in batches for r in responses] == [f"Q{i}" for i in range(10)]
+    assert len(server.connections) <= 3
+    request = server.requests[0]
+    assert request["model"] == "test-model"
+    assert request["max_tokens"] == 16
+    assert request["continue_final_message"] is True
+    assert request["add_generation_prompt"] is False
+    assert request["messages"] in chats
+    assert request["messages"][-1] == {"role": "assistant", "content": 'JSON = {"explanation":'}
+
+
+def test_generate_retries_unavailable_server(server):
+    server.failures = 2
+    model = OpenAIModel(
+        "test-model",
+        api_base=f"http://127.0.0.1:{server.server_port}/v1",
+        backoff_seconds=0.01,
+    )
+    response = model.generate_with_chat_template(
+        [{"role": "user", "content": "Q1"}],
+        add_generation_prompt=True,
+        continue_final_message=False,
+        max_new_tokens=16,
+    )
+    model.close()
+
+    assert response == "Q1"
+    assert len(server.requests) == 3
+
+
+def test_generate_gives_up_after_max_retries(server):
+    server.failures = 10
+    model = OpenAIModel(
+        "test-model",
+        api_base=f"http://127.0.0.1:{server.server_port}/v1",
+        max_retries=1,
+        backoff_seconds=0.01,
+    )
+    with pytest.raises(Exception, match="503"):
+        model.generate_with_chat_template(
+            [{"role": "user", "content": "Q1"}],
+            add_generation_prompt=True,
+            continue_final_message=False,
+            max_new_tokens=16,
+        )
+    model.close()
+    assert len(server.requests) == 2
@@ -0,0 +1,72 @@
+import threading
+import time
+
+import pytest
+
+from temp_answer_qa.pipeline import BackgroundWorker, StageTimer, prefetch
+
+
+def test_prefetch_yields_items_in_order():
+    assert list(prefetch(iter(range(10)), maxsize=2)) == list(range(10))
+
+
+def test_prefetch_runs_ahead_of_the_consumer():
+    produced = []
+
+    def produce():
+        for i in range(5):
+            produced.append(i)
+            yield i
+
+    items = prefetch(produce(), maxsize=2)
+    assert next(items) == 0
+    time.sleep(0.2)
+    # One item was consumed and at most two wait in the queue, plus one blocked in `put`.
+    assert len(produced) == 4
+    assert list(items) == [1, 2, 3, 4]
+
+
+def test_prefetch_raises_errors_of_the_producer():
+    def produce():
+        yield 1
+        raise RuntimeError("tokenizer failed")
+
+    items = prefetch(produce(), maxsize=2)
+    assert next(items) == 1
+    with pytest.raises(RuntimeError, match="tokenizer failed"):
+        next(items)
+
+
+def test_background_worker_calls_in_submission_order():
+    calls = []
+    threads = set()
+
+    def record(i):
+        calls.append(i)
+        threads.add(threading.get_ident())
+
+    worker = BackgroundWorker(record, maxsize=2)
+    for i in range(5):
+        worker.submit(i)
+    worker.close()
+    assert calls == list(range(5))
+    assert threads == {worker.thread.ident}
+
+
+def test_background_worker_raises_on_close():
+    def fail(i):
+        raise OSError("disk full")
+
+    worker = BackgroundWorker(fail, maxsize=2)
+    worker.submit(1)
+    with pytest.raises(OSError, match="disk full"):
+        worker.close()
+
+
+def test_stage_timer_reports_idle_time():
+    stage_timer = StageTimer()
+    stage_timer.seconds.update({"wall": 10.0, "prepare": 1.5, "generate": 8.0, "write": 0.5})
+    assert stage_timer.report() == (
+        "Stage times: prepare 1.50s, generate 8.00s, write 0.50s. "
+        "Generation was idle for 2.00s of 10.00s."
+    )
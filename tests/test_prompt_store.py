@@ -0,0 +1,29 @@
+import pytest
+
+from temp_answer_qa.prompt_store import PromptStore, write_prompt_store
+
+CHATS = [[{"role": "user", "content": f"Q{i}"}] for i in range(3)]
+INPUT_IDS = [[1, 2, 3], [4, 5], [6, 7, 8, 9]]
+
+
+@pytest.fixture
+def store(tmp_path):
+    path = tmp_path / "prompts.arrow"
+    write_prompt_store(path, [10, 11, 12], CHATS, INPUT_IDS, {"model_name": "test-model"})
+    return PromptStore(path)
+
+
+def test_prompts_follow_requested_rows(store):
+    prompts = store.prompts([12, 10], [CHATS[2], CHATS[0]])
+
+    assert store.metadata == {"model_name": "test-model"}
+    assert list(prompts) == [[6, 7, 8, 9], [1, 2, 3]]
+    assert prompts.lengths.tolist() == [4, 3]
+    assert list(prompts.select([1])) == [[1, 2, 3]]
+
+
+def test_prompts_reject_changed_chats(store):
+    with pytest.raises(ValueError, match="stale"):
+        store.prompts([11], [[{"role": "user", "content": "Q1 edited"}]])
+    with pytest.raises(ValueError, match="stale"):
+        store.prompts([13], [CHATS[0]])
@@ -0,0 +1,83 @@
+from unittest.mock import patch
+
+import pandas as pd
+import pytest
+
+from temp_answer_qa import Dataset
+from temp_answer_qa.question_store import drop_table_texts, load_questions, load_tables
+
+QUESTIONS = pd.DataFrame(
+    {
+        "question": ["Q1", "Q2", "Q3", "Q4"],
+        "table_id": [7, 8, 7, 9],
+        "table_context": ["T7", "T8", "T7", "T9"],
+        "split": ["head", "tail", "head", "tail"],
+    }
+)
+
+
+@pytest.fixture
+def folders(tmp_path):
+    questions_dir = tmp_path / "questions"
+    questions_dir.mkdir()
+    QUESTIONS.to_csv(questions_dir / "ttqa.csv", index=False)
+    with (
+        patch("temp_answer_qa.question_store.QUESTIONS_DIR", questions_dir),
+        patch("temp_answer_qa.question_store.QUESTION_STORE_DIR", tmp_path / "store"),
+    ):
+        yield questions_dir, tmp_path / "store"
+
+
+def test_load_questions_matches_csv(folders):
+    _, store_dir = folders
+
+    questions = load_questions(Dataset.ttqa, "tail", ["question"])
+
+    assert (store_dir / "ttqa" / "questions.parquet").exists()
+    assert questions.index.tolist() == [1, 3]
+    assert questions.columns.tolist() == ["question"]
+    pd.testing.assert_frame_equal(
+        load_questions(Dataset.ttqa),
+        QUESTIONS.drop(columns="table_context"),
+        check_index_type=False,
+    )
+
+
+def test_tables_are_stored_once_per_id(folders):
+    tables = load_tables(Dataset.ttqa)
+
+    assert tables.to_dict() == {7: "T7", 8: "T8", 9: "T9"}
+
+
+def test_loaded_questions_are_copies(folders):
+    questions = load_questions(Dataset.ttqa, "head")
+    questions.loc[:, "response"] = "R"
+
+    assert "response" not in load_questions(Dataset.ttqa, "head")
+
+
+def test_store_is_rebuilt_when_csv_changes(folders):
+    questions_dir, _ = folders
+    load_questions(Dataset.ttqa, "head")
+    QUESTIONS.assign(question=["A", "B", "C", "D"]).to_csv(questions_dir / "ttqa.csv", index=False)
+
+    assert load_questions(Dataset.ttqa, "head")["question"].tolist() == ["A", "C"]
+
+
+def test_drop_table_texts_keeps_other_columns(folders, tmp_path):
+    path = tmp_path / "responses.csv"
+    QUESTIONS.assign(response=["1", "", "3.0", "4"]).to_csv(path, index=False)
+    expected = path.read_text().replace(",T7", "").replace(",T8", "").replace(",T9", "")
+    expected = expected.replace(",table_context", "")
+
+    assert drop_table_texts(path, load_tables(Dataset.ttqa))
+    assert path.read_text() == expected
+    assert not drop_table_texts(path, load_tables(Dataset.ttqa))
+
+
+def test_drop_table_texts_refuses_differing_texts(folders, tmp_path):
+    path = tmp_path / "responses.csv"
+    QUESTIONS.assign(table_context="edited").to_csv(path, index=False)
+
+    with pytest.raises(ValueError, match="differ"):
+        drop_table_texts(path, load_tables(Dataset.ttqa))
@@ -0,0 +1,36 @@
+from temp_answer_qa.response_cache import ResponseCache
+
+CHAT = [{"role": "user", "content": "Q1"}]
+
+
+def test_key_depends_on_every_input():
+    key = ResponseCache.key("model", CHAT, True, False, {"max_new_tokens": 256})
+    assert key == ResponseCache.key("model", CHAT, True, False, {"max_new_tokens": 256})
+    assert key != ResponseCache.key("model@abc", CHAT, True, False, {"max_new_tokens": 256})
+    assert key != ResponseCache.key(
+        "model", [{"role": "user", "content": "Q2"}], True, False, {"max_new_tokens": 256}
+    )
+    assert key != ResponseCache.key("model", CHAT, False, True, {"max_new_tokens": 256})
+    assert key != ResponseCache.key("model", CHAT, True, False, {"max_new_tokens": 512})
+
+
+def test_get_and_put_persist_and_count(tmp_path):
+    response_cache = ResponseCache(tmp_path / "cache.sqlite")
+    response_cache.put_many(["a", "b"], ["A", "B"])
+    response_cache.close()
+
+    response_cache = ResponseCache(tmp_path / "cache.sqlite")
+    assert response_cache.get_many(["a", "c", "b"]) == {"a": "A", "b": "B"}
+    assert (response_cache.hits, response_cache.misses) == (2, 1)
+
+
+def test_prune_evicts_least_recently_used(tmp_path):
+    response_cache = ResponseCache(tmp_path / "cache.sqlite")
+    for key in ["a", "b", "c"]:
+        response_cache.put_many([key], [key.upper() * 9])
+    response_cache.get_many(["a"])
+
+    assert response_cache.prune(max_size_bytes=25) == 1
+    assert response_cache.get_many(["a", "b", "c"]) == {"a": "A" * 9, "c": "C" * 9}
+    assert response_cache.prune(max_size_bytes=0) == 2
+    assert response_cache.size_bytes() == 0
@@ -0,0 +1,72 @@
+from datetime import timedelta
+
+import pandas as pd
+import pytest
+
+from temp_answer_qa import Aggregation
+from temp_answer_qa.measure_error import ToTErrorMeasurer, TTQAMeasurer
+from temp_answer_qa.self_consistency import aggregate_samples
+
+
+@pytest.fixture
+def tot_samples():
+    return pd.DataFrame(
+        {
+            "question": ["Q1"] * 4 + ["Q2"] * 3 + ["Q3"] * 2,
+            "sample": [0, 1, 2, 3, 0, 1, 2, 0, 1],
+            "response": [f"R{i}" for i in range(9)],
+            "response_numeric": [
+                5,
+                7,
+                7,
+                100,
+                timedelta(seconds=30),
+                None,
+                timedelta(seconds=10),
+                None,
+                None,
+            ],
+            "answer_temporal_unit": ["days"] * 4 + ["seconds"] * 3 + ["years"] * 2,
+        }
+    )
+
+
+def test_majority_picks_most_frequent_answer(tot_samples):
+    aggregated = aggregate_samples(
+        tot_samples, ToTErrorMeasurer().model_response_to_digit, Aggregation.majority
+    )
+    assert aggregated["question"].tolist() == ["Q1", "Q2", "Q3"]
+    # Q2 has a tie between 30 and 10 seconds, the first sample wins; Q3 has no numeric answer.
+    assert aggregated["response"].tolist() == ["R1", "R4", "R7"]
+    assert "sample" not in aggregated.columns
+
+
+def test_median_picks_sample_closest_to_median(tot_samples):
+    aggregated = aggregate_samples(
+        tot_samples, ToTErrorMeasurer().model_response_to_digit, Aggregation.median
+    )
+    # The median of 5, 7, 7 and 100 days is 7; the median of 30 and 10 seconds is 20.
+    assert aggregated["response"].tolist() == ["R1", "R4", "R7"]
+    assert aggregated["response_numeric"].tolist()[:2] == [7, timedelta(seconds=30)]
+
+
+def test_measured_samples_are_compared_by_response_digit(tot_samples):
+    measured = tot_samples.assign(response_digit=[5, 7, 7, 100, 30, None, 10, None, None])
+
+    aggregated = aggregate_samples(measured, aggregation=Aggregation.median)
+
+    assert aggregated.equals(
+        aggregate_samples(measured, ToTErrorMeasurer().model_response_to_digit, Aggregation.median)
+    )
+
+
+def test_median_of_dates():
+    samples = pd.DataFrame(
+        {
+            "sample": [0, 1, 2],
+            "response_numeric": pd.to_datetime(["2020-01-01", "2020-03-01", "2020-01-20"]),
+            "answer_temporal_unit": ["date"] * 3,
+        }
+    )
+    aggregated = aggregate_samples(samples, TTQAMeasurer().model_response_to_digit, "median")
+    assert aggregated["response_numeric"].tolist() == [pd.Timestamp("2020-01-20")]
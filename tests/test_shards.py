@@ -0,0 +1,84 @@
+from unittest.mock import MagicMock, patch
+
+import numpy as np
+import pandas as pd
+import pytest
+
+from temp_answer_qa import LastToken, Prompting, ToTSplit
+from temp_answer_qa.inference import tot
+from temp_answer_qa.shards import merge_shards, select_shard, shard_path
+
+DATASET = pd.DataFrame(
+    {
+        "question_wo_instruct": [f"Q{i}" for i in range(7)],
+        "instruction": ['Answer as JSON = {"answer": 1},\nplease'] * 7,
+        "label": [1, 2.5, np.nan, 4, 5, 6, 7],
+        "split": ["arithmetic"] * 7,
+    },
+    index=[5, 3, 8, 1, 0, 9, 2],
+)
+
+
+def run_tot(output_folder, **kwargs):
+    mock_model = MagicMock()
+    mock_model.generate_with_chat_template.side_effect = lambda chat, **_: f"A, {chat[-1]}"
+    with (
+        patch("temp_answer_qa.inference.data_loader") as mock_data_loader,
+        patch("temp_answer_qa.inference.HFModel", return_value=mock_model),
+    ):
+        mock_data_loader.load_tot.return_value = DATASET.copy()
+        tot(
+            prompting=Prompting.zero_shot,
+            split=ToTSplit.arithmetic,
+            model_name="test-model",
+            last_token=LastToken.add_generation_prompt,
+            output_folder=output_folder,
+            **kwargs,
+        )
+
+
+def test_select_shard():
+    shards = [select_shard(DATASET, 3, i) for i in range(3)]
+    assert [shard["row"].tolist() for shard in shards] == [[0, 3, 6], [1, 4], [2, 5]]
+    assert pd.concat(shards).sort_values("row").drop(columns="row").equals(DATASET)
+    with pytest.raises(ValueError):
+        select_shard(DATASET, 3, 3)
+
+
+def test_merged_shards_match_unsharded_run(tmp_path):
+    run_tot(tmp_path / "unsharded")
+    for shard_index in range(3):
+        run_tot(tmp_path / "sharded", num_shards=3, shard_index=shard_index)
+
+    file_name = "tot_arithmetic_test-model_zero-shot_add_generation_prompt.csv"
+    assert not (tmp_path / "sharded" / file_name).exists()
+    merge_shards(tmp_path / "sharded" / file_name)
+    merged = (tmp_path / "sharded" / file_name).read_text()
+    assert merged == (tmp_path / "unsharded" / file_name).read_text()
+
+
+def test_merge_shards_requires_all_shards(tmp_path):
+    output_path = tmp_path / "tot_arithmetic_test-model_zero-shot_add_generation_prompt.csv"
+    with pytest.raises(FileNotFoundError):
+        merge_shards(output_path)
+    for shard_index in (0, 2):
+        select_shard(DATASET, 3, shard_index).to_csv(
+            shard_path(output_path, 3, shard_index), index=False
+        )
+    with pytest.raises(FileNotFoundError, match=r"Missing shards \[1\]"):
+        merge_shards(output_path)
+    select_shard(DATASET, 2, 1).to_csv(shard_path(output_path, 2, 1), index=False)
+    with pytest.raises(ValueError, match="disagree"):
+        merge_shards(output_path)
+
+
+def test_merge_shards_keeps_samples_of_each_row(tmp_path):
+    output_path = tmp_path / "tot_arithmetic_test-model_zero-shot_add_generation_prompt.csv"
+    for shard_index in range(2):
+        shard = select_shard(DATASET, 2, shard_index)
+        sampled = pd.concat([shard.assign(sample=1), shard.assign(sample=0)])
+        sampled.to_csv(shard_path(output_path, 2, shard_index), index=False)
+
+    merged = merge_shards(output_path)
+    assert merged["question_wo_instruct"].tolist() == [f"Q{i // 2}" for i in range(14)]
+    assert merged["sample"].tolist() == ["0", "1"] * 7
@@ -1,7 +1,14 @@
 import pandas as pd
+import pytest
 
 from temp_answer_qa import LastToken
-from temp_answer_qa.response_processing import ToTJSONParser, ToTResponseToNumericObj
+from temp_answer_qa.response_processing import (
+    ToTJSONParser,
+    ToTResponseToNumericObj,
+    tot_parse_labels,
+    tot_process_response,
+    tot_process_response_rowwise,
+)
 
 
 def test_model_response_to_json():
@@ -109,3 +116,116 @@ def test_remove_explanation_from_json():
     assert tot_json_parser.remove_explanation_from_json(
         {"explanation": "abc", "answer": {"foo": "bar"}}
     ) == {"answer": {"foo": "bar"}}
+
+
+def test_is_complete():
+    tot_json_parser = ToTJSONParser(last_token=LastToken.continue_final_message)
+    assert not tot_json_parser.is_complete(' "Add {the} days"')
+    assert not tot_json_parser.is_complete(' "Add the days", "answer": {"days": 3}')
+    assert tot_json_parser.is_complete(' "Add the \\"}\\" days", "answer": 3}')
+    assert tot_json_parser.is_complete(' "Add the days", "answer": {"days": 3}} Explanation')
+
+    tot_json_parser = ToTJSONParser(last_token=LastToken.add_generation_prompt)
+    assert not tot_json_parser.is_complete('JSON = {"explanation": "Add the days",')
+    assert tot_json_parser.is_complete('JSON = {"explanation": "Add the days", "answer": 3}')
+
+
+def test_cast_responses_to_numeric_matches_single_casts():
+    responses = [
+        {"age": 7},
+        {"age": "7"},
+        {"age": 7.9},
+        {"age": "7.5"},
+        {"date": "10/01/2015"},
+        {"date": "13/01/2015"},
+        {"date": "02/30/2015"},
+        {"date": "999-999"},
+        {"date": "2015-10-01"},
+        {"answer": 1307},
+        {"answer": "1307"},
+        {"answer": True},
+        {"answer": "7 BC"},
+        {"answer": "7AD"},
+        {"answer": " - 2001 AD"},
+        {"answer": "30-07-1998"},
+        {"answer": "Oct 17, 1997"},
+        {"answer": "17 July, 2007"},
+        {"answer": "Sept 17, 1997"},
+        {"answer": 1.45},
+        {"answer": {"foo": "bar"}},
+        {"H": 17, "M": "48", "S": 51.0},
+        {"X": 1, "Y": 2, "Z": "x"},
+        {"minutes": 48, "hours": 17},
+        {},
+        {"day": "previous_day", "time": "21:45:12"},
+        {"time": "21:45", "day": 1},
+        {"day": "same_day", "time": "HH:MM:SS"},
+        {"days": 2, "hours": 17, "minutes": 48, "seconds": 51},
+        {"foo": 42},
+        None,
+        [1, 2],
+    ]
+    tot_resp2num = ToTResponseToNumericObj()
+    numeric = tot_resp2num.cast_responses_to_numeric(responses)
+    expected = [tot_resp2num.cast_response_to_numeric(response) for response in responses]
+    assert numeric == expected
+    assert [type(value) for value in numeric] == [type(value) for value in expected]
+
+
+@pytest.mark.parametrize("last_token", list(LastToken))
+def test_tot_process_response_matches_rowwise(last_token):
+    responses = pd.DataFrame(
+        {
+            "label": ['{"answer": 1307}', '{"date": "10/01/2015"}', '{"H": 1, "M": 2, "S": 3}'] * 2,
+            "response": [
+                ' "Add the days.", "answer": 1307}',
+                'JSON = {"explanation": "Count.\n", "date": "10/01/2015"} Done.',
+                ' "Split", "H": 1, "M": 2, "S": 3}',
+                "no JSON",
+                ' "Broken", "answer": 01}',
+                ' "Big", "answer": 123456789012345678901234567890}',
+            ],
+        },
+        index=[5, 3, 8, 1, 0, 9],
+    )
+    pd.testing.assert_frame_equal(
+        tot_process_response(responses, last_token),
+        tot_process_response_rowwise(responses, last_token),
+    )
+
+
+def test_tot_process_response_with_parsed_labels():
+    responses = pd.DataFrame(
+        {
+            "label": ['{"answer": 1307}', '{"date": "10/01/2015"}', '{"H": 1, "M": 2, "S": 3}'],
+            "response": [' "Add", "answer": 1307}', "no JSON", ' "Split", "H": 1, "M": 2, "S": 3}'],
+        }
+    )
+    # The last label is not among the parsed ones and is parsed with the responses.
+    labels = tot_parse_labels(responses["label"].iloc[:2])
+    pd.testing.assert_frame_equal(
+        tot_process_response(responses, LastToken.continue_final_message, labels),
+        tot_process_response_rowwise(responses, LastToken.continue_final_message),
+    )
+
+
+def test_tot_process_response_keeps_applied_dtypes():
+    responses = pd.DataFrame({"label": ['{"age": 3}'] * 2, "response": [' "A", "age": 3}'] * 2})
+    processed = tot_process_response(responses, LastToken.continue_final_message)
+    assert processed["response_numeric"].dtype == "int64"
+    assert processed["label_json"].dtype == object
+
+
+@pytest.mark.parametrize("use_orjson", [True, False])
+def test_model_responses_to_json(monkeypatch, use_orjson):
+    if not use_orjson:
+        monkeypatch.setattr("temp_answer_qa.response_processing.orjson", None)
+    tot_json_parser = ToTJSONParser(last_token=LastToken.continue_final_message)
+    responses = pd.Series(
+        [' "Add", "answer": 3}', ' "Big", "answer": 123456789012345678901234567890}', "bla"]
+    )
+    assert tot_json_parser.model_responses_to_json(responses) == [
+        {"explanation": "Add", "answer": 3},
+        {"explanation": "Big", "answer": 123456789012345678901234567890},
+        None,
+    ]
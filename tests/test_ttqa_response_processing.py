@@ -1,9 +1,15 @@
 import datetime
 
 import numpy as np
+import pandas as pd
 import pytest
 
-from temp_answer_qa.response_processing import TTQAResponseParser, TTQAResponseToNumericObj
+from temp_answer_qa.response_processing import (
+    TTQAResponseParser,
+    TTQAResponseToNumericObj,
+    ttqa_process_response,
+    ttqa_process_response_rowwise,
+)
 
 MODEL_RESPONSES = [
     "Adolf von Baeyer was born on 31 October 1835. He married Adelheid Bendemann in 1868. To find out his age at the time of marriage, subtract his birth year from the year of marriage: 1868-1835=33.\nFinal Answer: 33 years",
@@ -74,7 +80,6 @@ def test_cast_answer_to_numeric(extracted_answer, answer_format, expected_numeri
         ttqa_response_to_numeric_obj.cast_response_to_numeric(extracted_answer, answer_format)
         == expected_numeric_answer
     )
-    
 
 
 def test_wrong_input_parser():
@@ -92,3 +97,54 @@ def test_wrong_input_resonse_to_numeric():
     assert ttqa_responsed_parser.cast_response_to_numeric("bla", np.nan) is None
     assert ttqa_responsed_parser.cast_response_to_numeric("bla", "foo") is None
     assert ttqa_responsed_parser.cast_response_to_numeric("2999/01/01", "%B %d, %Y") is None
+
+
+def test_is_complete():
+    ttqa_response_parser = TTQAResponseParser()
+    assert not ttqa_response_parser.is_complete("Subtract the years.\nFinal Answer:")
+    assert not ttqa_response_parser.is_complete("Subtract the years.\nFinal Answer: 33 ye")
+    assert ttqa_response_parser.is_complete("Subtract the years.\nFinal Answer: 33 years\n")
+
+
+def test_extract_responses_matches_single_extraction():
+    ttqa_response_parser = TTQAResponseParser()
+    responses = pd.Series(MODEL_RESPONSES + [np.nan], index=range(10, 17))
+    answer_formats = pd.Series(ANSWER_FORMATS[:6] + ["yyyy"], index=range(10, 17))
+    assert ttqa_response_parser.extract_responses(responses, answer_formats) == [
+        ttqa_response_parser.extract_response(response, answer_format)
+        for response, answer_format in zip(responses, answer_formats)
+    ]
+
+
+def test_extract_responses_with_unknown_format():
+    ttqa_response_parser = TTQAResponseParser()
+    with pytest.raises(ValueError, match="some_format"):
+        ttqa_response_parser.extract_responses(
+            pd.Series(["Final Answer: 3", "bla"]), pd.Series(["yyyy", "some_format"])
+        )
+
+
+def test_cast_responses_to_numeric_matches_single_casts():
+    ttqa_response_to_numeric_obj = TTQAResponseToNumericObj()
+    responses = ["33", "0", "3.5", "", None, "2021", datetime.datetime(1837, 2, 17), "June 8, 1953"]
+    responses += ["2999/01/01", "bla"]
+    answer_formats = ["<num_years>"] * 5 + ["yyyy"] + ["%B %d, %Y"] * 3 + ["foo"]
+    assert ttqa_response_to_numeric_obj.cast_responses_to_numeric(responses, answer_formats) == [
+        ttqa_response_to_numeric_obj.cast_response_to_numeric(response, answer_format)
+        for response, answer_format in zip(responses, answer_formats)
+    ]
+
+
+@pytest.mark.parametrize("rows", [slice(None), slice(4, 5), slice(2, 3)])
+def test_ttqa_process_response_matches_rowwise(rows):
+    responses = pd.DataFrame(
+        {
+            "label": ["33", "12", "2021", "4", "February 17, 1837", "May 9, 1931"],
+            "answer_format": ANSWER_FORMATS[:6],
+            "response": MODEL_RESPONSES,
+        },
+        index=[7, 3, 9, 1, 0, 4],
+    ).iloc[rows]
+    pd.testing.assert_frame_equal(
+        ttqa_process_response(responses), ttqa_process_response_rowwise(responses)
+    )
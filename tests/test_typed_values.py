@@ -0,0 +1,94 @@
+import datetime
+
+import numpy as np
+import pandas as pd
+
+from temp_answer_qa.typed_values import (
+    Kind,
+    assign_typed,
+    from_typed,
+    get_typed,
+    to_typed,
+    typed_columns,
+    untyped,
+)
+
+VALUES = [
+    None,
+    3,
+    2.5,
+    np.nan,
+    datetime.timedelta(days=1, microseconds=3),
+    pd.Timedelta("18:48:28"),
+    datetime.datetime(1837, 2, 17),
+    pd.to_datetime("10/01/2015"),
+]
+# Values that the typed columns cannot hold exactly.
+OBJECTS = [
+    [1, 2],
+    {"H": 1},
+    True,
+    2**70,
+    np.int64(3),
+    pd.NaT,
+    datetime.timedelta(days=200_000),
+    datetime.datetime(1500, 1, 1),
+    datetime.datetime(2000, 1, 1, tzinfo=datetime.UTC),
+    pd.Timestamp("2022-01-02"),
+    pd.Timestamp("2000-01-01T00:00:00.000000001"),
+]
+
+
+def test_to_typed():
+    typed = to_typed(VALUES)
+
+    assert typed["kind"].tolist() == [
+        Kind.none,
+        Kind.int,
+        Kind.float,
+        Kind.float,
+        Kind.timedelta,
+        Kind.Timedelta,
+        Kind.datetime,
+        Kind.Timestamp,
+    ]
+    assert typed.dtypes.astype(str).tolist() == [
+        "category",
+        "Int64",
+        "float64",
+        "timedelta64[ns]",
+        "datetime64[ns]",
+        "object",
+    ]
+    assert typed["int"].tolist()[:3] == [pd.NA, 3, pd.NA]
+    assert typed["timedelta"].dropna().tolist() == [VALUES[4], VALUES[5]]
+    assert typed["datetime"].dropna().tolist() == [VALUES[6], VALUES[7]]
+
+
+def test_from_typed_restores_values():
+    values = VALUES + OBJECTS
+    typed = to_typed(values)
+    restored = from_typed(typed)
+
+    assert (typed["kind"][len(VALUES) :] == Kind.object).all()
+    assert [type(value) for value in restored] == [type(value) for value in values]
+    assert pd.Series(restored, dtype=object).equals(pd.Series(values, dtype=object))
+    assert from_typed(typed.iloc[[7, 1]]) == [VALUES[7], VALUES[1]]
+
+
+def test_untyped_restores_typed_columns_in_place():
+    values = VALUES + OBJECTS
+    df = pd.DataFrame(
+        {"before": range(len(values)), "after": 0}, index=range(100, 100 + len(values))
+    )
+    typed = assign_typed(df, "numeric", to_typed(values))[
+        ["before", *typed_columns("numeric"), "after"]
+    ]
+
+    assert get_typed(typed, "before") is None
+    assert get_typed(typed, "numeric").equals(to_typed(values))
+    restored = untyped(typed)
+    assert restored.columns.tolist() == ["before", "numeric", "after"]
+    assert restored.index.equals(df.index)
+    assert [type(value) for value in restored["numeric"]] == [type(value) for value in values]
+    assert restored["numeric"].equals(pd.Series(values, index=df.index, dtype=object))